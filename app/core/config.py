@@ -1,5 +1,5 @@
 import os
-from typing import List, Union
+from typing import Dict, List, Optional, Union
 from pydantic import AnyHttpUrl, field_validator, PostgresDsn
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -44,6 +44,70 @@ class Settings(BaseSettings):
 
     # Redis
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+    # 2D Try-On
+    TRYON_MODEL_PATH: str = os.getenv("TRYON_MODEL_PATH", "./weights/tryon.onnx")
+    TRYON_MODEL_VARIANT: str = "fp32" # fp32, fp16, int8_dynamic or int8_static (built by scripts/tryon_variants.py)
+    TRYON_WORKERS: int = 0 # 0 = size to available cores
+    TRYON_MAX_PENDING: int = 64 # Requests queued or running before returning 503
+    TRYON_MAX_BATCH_SIZE: int = 8
+    TRYON_MAX_BATCH_WAIT_MS: float = 5.0
+    TRYON_BATCH_BUCKETS: List[int] = [1, 2, 4, 8] # Batch shapes the session is warmed up for
+    TRYON_OPTIMIZED_MODEL_PATH: Optional[str] = None # Saved ORT-optimized graph, reused on later starts
+    TRYON_WARMUP_ON_STARTUP: bool = True
+    TRYON_SESSIONS: int = 1 # Independent sessions sharing the cores; >1 helps on many-core CPU nodes
+    TRYON_POOL_MODE: str = "thread" # thread (shared weights) or process (one pinned worker per session)
+    TRYON_NUMA_PINNING: bool = False
+    TRYON_CACHE_MAX_BYTES: int = 256 * 1024 * 1024 # In-process LRU tier; 0 disables caching
+    TRYON_CACHE_BACKEND: str = "redis" # Shared tier: redis, disk or none
+    TRYON_CACHE_DIR: str = "./cache/tryon_2d"
+    TRYON_CACHE_DISK_MAX_BYTES: int = 2 * 1024 * 1024 * 1024 # Disk tier; least recently used results evicted above this
+    TRYON_CACHE_TTL: int = 86400
+
+    # 3D Reconstruction
+    TRYON_3D_PRELOAD_MODELS: bool = True # Load PIXIE/PIFuHD when a worker process starts
+    TRYON_3D_MIN_FREE_GPU_FRACTION: float = 0.1 # Evict resident models below this much free GPU memory
+    TRYON_3D_WORKER_MAX_MEMORY_MB: int = 12288 # Recycle a worker process once its RSS passes this
+    TRYON_3D_MAX_BATCH_SIZE: int = 4 # Views per model forward; larger uploads are split into chunks
+    TRYON_3D_DECODE_THREADS: int = 4
+    TRYON_3D_EXPORT_THREADS: int = 3 # GLB levels, preview and SMPL-X params are written concurrently
+    TRYON_3D_LOD_RATIOS: List[float] = [1.0, 0.25, 0.05] # Face count of each GLB level relative to the full mesh
+    TRYON_3D_QUANTIZE_MESHES: bool = True # 16-bit positions / 8-bit normals (KHR_mesh_quantization)
+    TRYON_3D_SMPLX_DTYPE: str = "float32" # SMPL-X params .npz precision: float32 or float16
+    TRYON_3D_SURFACE_RESOLUTION: int = 256 # Marching cubes grid per axis; a power-of-two multiple of 64
+    TRYON_3D_SURFACE_MAX_MEMORY_MB: int = 2048 # Bounds grid blocks plus occupancy-query chunks
+    TRYON_3D_PROGRESS_MAXLEN: int = 100 # Events kept per task stream
+    TRYON_3D_PROGRESS_TTL: int = 3600 # Seconds a task's stream outlives its last event
+    TRYON_3D_PROGRESS_KEEPALIVE_S: float = 15.0 # SSE comment interval while a stage is running
+    TRYON_3D_ARTIFACT_DIR: str = "./cache/tryon_3d" # Content-addressed finished reconstructions
+    TRYON_3D_ARTIFACT_MAX_BYTES: int = 20 * 1024 * 1024 * 1024 # LRU eviction above this; 0 disables the store
+    TRYON_3D_INFLIGHT_TTL: int = 3600 # Seconds an identical submission attaches to a running job
+    TRYON_3D_GPU_TIERS_GB: List[int] = [8, 16, 24, 48] # One queue per class and tier; jobs go to the smallest that fits
+    TRYON_3D_WORKER_GPU_MEMORY_MB: int = 0 # Capacity this worker advertises; 0 = detect
+    TRYON_3D_INTERACTIVE_MAX_SECONDS: float = 10.0 # Estimated runtime up to which a job is routed as interactive
+    TRYON_3D_PREVIEW_RESOLUTION: int = 128 # Surface resolution of quick preview jobs
+
+    # Scraper
+    SCRAPER_MAX_CONTEXTS: int = 4 # Reusable browser contexts kept open
+    SCRAPER_MAX_CONCURRENCY: int = 4 # Pages scraped at once; capped at SCRAPER_MAX_CONTEXTS
+    SCRAPER_MAX_REQUESTS_PER_CONTEXT: int = 50 # Then the context (and its user agent) is replaced
+    SCRAPER_PAGE_DEADLINE_S: float = 15.0 # Navigation plus readiness, per page
+    SCRAPER_NETWORK_IDLE_TIMEOUT_S: float = 3.0 # Cap on waiting for network idle (ads/analytics may never go idle)
+    SCRAPER_READY_SELECTORS: Dict[str, List[str]] = {} # Per domain, e.g. {"shop.com": ["h1", ".price", ".gallery img"]}
+    SCRAPER_DEFAULT_READY_SELECTORS: List[str] = ["h1", "img"]
+    SCRAPER_SCROLL_STEP_S: float = 0.25 # Pause after each viewport scrolled
+    SCRAPER_SCROLL_STABLE_STEPS: int = 2 # Steps at the bottom without new images before the page counts as loaded
+    SCRAPER_MAX_SCROLL_STEPS: int = 20
+    SCRAPER_BLOCK_RESOURCE_TYPES: List[str] = ["image", "media", "font"] # Aborted; image URLs are still recorded
+    SCRAPER_BLOCK_DOMAINS: List[str] = [ # Trackers and ads, subdomains included
+        "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+        "facebook.net", "hotjar.com", "criteo.com", "scorecardresearch.com",
+        "segment.io", "nr-data.net", "analytics.tiktok.com", "bat.bing.com",
+    ]
+    SCRAPER_HTTP_TIMEOUT_S: float = 5.0 # Static fetch attempted before the browser
+    SCRAPER_HTTP_MAX_CONNECTIONS: int = 20 # Kept-alive connections of the shared HTTP client
+    SCRAPER_STATIC_MIN_TEXT_CHARS: int = 200 # Less visible text than this counts as a JS-only shell
+    SCRAPER_TIER_TTL_S: int = 86400 # How long a domain's working tier (HTTP or browser) is remembered
     
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -1,3 +1,5 @@
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
@@ -15,13 +17,27 @@ from app.core.exceptions import (
 )
 from app.middlewares.rate_limiter import limiter
 from app.routers.api import api_router
+from app.services.health import HealthService
+from app.services.scraper.browser import close_browser_pool
+from app.services.scraper.fetcher import close_http_client
+from app.services.tryon_fast.async_engine import is_tryon_engine_ready, start_tryon_warmup, tryon_model_configured
 
 # Setup logging
 setup_logging()
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    if settings.TRYON_WARMUP_ON_STARTUP:
+        await start_tryon_warmup()
+    yield
+    await close_browser_pool()
+    await close_http_client()
 
 def create_application() -> FastAPI:
     application = FastAPI(
         title=settings.PROJECT_NAME,
+        lifespan=lifespan,
         openapi_url=f"{settings.API_V1_STR}/openapi.json",
         docs_url=f"{settings.API_V1_STR}/docs",
         redoc_url=f"{settings.API_V1_STR}/redoc",
@@ -48,6 +64,14 @@ def create_application() -> FastAPI:
 
     # Router
     application.include_router(api_router, prefix=settings.API_V1_STR)
+
+    # Warm-up: keep /ready at 503 until the try-on engine has run every batch shape.
+    # Without a model there's nothing to wait for; 2D try-on requests answer 503 on their own.
+    if settings.TRYON_WARMUP_ON_STARTUP:
+        if tryon_model_configured():
+            HealthService.register_readiness_check("tryon_2d", is_tryon_engine_ready)
+        else:
+            logger.warning("Try-on model not found; /ready does not wait for the 2D engine")
     
     return application
 
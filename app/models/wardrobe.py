@@ -49,6 +49,7 @@ class TryOnResult3D(Base, TimestampMixin):
     garment_item_ids = Column(JSONB, nullable=False) # List of garment IDs
     model_glb_url = Column(String, nullable=False)
     preview_image_url = Column(String, nullable=True)
+    smplx_params_url = Column(String, nullable=True) # .npz of the fused SMPL-X parameters
     status = Column(String, default="pending") # pending, processing, completed, failed
     
     avatar = relationship("UserAvatar")
@@ -1,6 +1,7 @@
 from fastapi import APIRouter
-from app.routers import health
+from app.routers import health, tryon
 
 api_router = APIRouter()
 api_router.include_router(health.router, tags=["health"])
+api_router.include_router(tryon.router, tags=["tryon"])
 
@@ -1,5 +1,5 @@
-from fastapi import APIRouter, Request, Depends
-from app.schemas.health import HealthCheck
+from fastapi import APIRouter, Request, Depends, Response, status
+from app.schemas.health import HealthCheck, ReadinessCheck
 from app.services.health import HealthService
 from app.middlewares.rate_limiter import limiter
 
@@ -13,3 +13,12 @@ async def health_check(request: Request) -> HealthCheck:
     """
     return await HealthService.get_health()
 
+@router.get("/ready", response_model=ReadinessCheck)
+async def readiness_check(response: Response) -> ReadinessCheck:
+    """
+    Readiness endpoint for load balancers; 503 until every registered component is warm.
+    """
+    readiness = await HealthService.get_readiness()
+    if readiness.status != "ready":
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return readiness
@@ -0,0 +1,77 @@
+import json
+from typing import Any, Dict, Literal, Optional
+import numpy as np
+from fastapi import APIRouter, Depends, File, Form, Header, Query, UploadFile, status
+from fastapi.responses import Response, StreamingResponse
+from app.core.exceptions import ServiceException
+from app.services.tryon_3d.progress import ProgressReader, get_progress_reader
+from app.services.tryon_3d.routing import queue_metrics
+from app.services.tryon_fast.async_engine import AsyncTryOnEngine, get_tryon_engine
+from app.services.tryon_fast.utils import OUTPUT_MEDIA_TYPES, QUALITY_RANGES
+
+router = APIRouter()
+
+@router.post("/tryon/2d", response_class=Response)
+async def tryon_2d(
+    person_mask: UploadFile = File(...),
+    garment_mask: UploadFile = File(...),
+    garment_texture: UploadFile = File(...),
+    pose_keypoints: str = Form(..., description="JSON list of (x, y[, visibility]) keypoints"),
+    output_format: Literal["png", "jpeg", "webp"] = Query("png", alias="format"),
+    quality: Optional[int] = Query(None, description="PNG compression level 0-9 or JPEG/WebP quality 1-100"),
+    engine: AsyncTryOnEngine = Depends(get_tryon_engine),
+) -> Response:
+    """
+    Fast 2D try-on. Inference runs off the event loop; returns 503 when the engine is saturated.
+    """
+    if quality is not None:
+        low, high = QUALITY_RANGES[output_format]
+        if not low <= quality <= high:
+            raise ServiceException(
+                f"quality must be {low}-{high} for {output_format}", status_code=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+    try:
+        keypoints = np.asarray(json.loads(pose_keypoints), dtype=np.float32)
+    except (ValueError, TypeError) as e:
+        raise ServiceException(f"Invalid pose_keypoints: {e}", status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    result = await engine.process_async(
+        await person_mask.read(),
+        await garment_mask.read(),
+        await garment_texture.read(),
+        keypoints,
+        output_format=output_format,
+        quality=quality,
+    )
+    return Response(content=result, media_type=OUTPUT_MEDIA_TYPES[output_format])
+
+@router.get("/tryon/2d/stats")
+async def tryon_2d_stats(engine: AsyncTryOnEngine = Depends(get_tryon_engine)) -> Dict[str, Any]:
+    """
+    Batching, backpressure and result cache counters.
+    """
+    return engine.stats()
+
+@router.get("/tryon/3d/{task_id}/events")
+async def tryon_3d_events(
+    task_id: str,
+    last_event_id: Optional[str] = Header(None),
+    reader: ProgressReader = Depends(get_progress_reader),
+) -> StreamingResponse:
+    """
+    Server-sent events for a 3D reconstruction task: one event per finished stage (with
+    timings and partial artifacts such as the coarse SMPL-X mesh), then completed or failed.
+    Reconnecting clients resume after their Last-Event-ID.
+    """
+    return StreamingResponse(
+        reader.sse(task_id, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/tryon/3d/queues")
+async def tryon_3d_queues(reader: ProgressReader = Depends(get_progress_reader)) -> Dict[str, Any]:
+    """
+    Depth and recent wait times (p50/p95) of every 3D reconstruction queue.
+    """
+    return await queue_metrics(reader.client)
@@ -1,3 +1,4 @@
+from typing import Dict
 from pydantic import BaseModel
 
 class HealthCheck(BaseModel):
@@ -5,3 +6,6 @@ class HealthCheck(BaseModel):
     status: str
     version: str
 
+class ReadinessCheck(BaseModel):
+    status: str
+    checks: Dict[str, bool] = {}
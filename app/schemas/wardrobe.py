@@ -64,6 +64,7 @@ class TryOnResult3DResponse(TryOnResult3DBase):
     id: UUID
     model_glb_url: Optional[str] = None
     preview_image_url: Optional[str] = None
+    smplx_params_url: Optional[str] = None
     created_at: datetime
     updated_at: datetime
     model_config = ConfigDict(from_attributes=True)
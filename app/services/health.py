@@ -1,7 +1,14 @@
-from app.schemas.health import HealthCheck
+import logging
+from typing import Callable, Dict
+from app.schemas.health import HealthCheck, ReadinessCheck
 from app.core.config import settings
 
+logger = logging.getLogger(__name__)
+
 class HealthService:
+    # Named readiness checks registered by components that need warm-up
+    _readiness_checks: Dict[str, Callable[[], bool]] = {}
+
     @staticmethod
     async def get_health() -> HealthCheck:
         return HealthCheck(
@@ -10,3 +17,20 @@ class HealthService:
             version="1.0.0" # Ideally, this comes from a version file or config
         )
 
+    @classmethod
+    def register_readiness_check(cls, name: str, check: Callable[[], bool]) -> None:
+        cls._readiness_checks[name] = check
+
+    @classmethod
+    async def get_readiness(cls) -> ReadinessCheck:
+        checks = {}
+        for name, check in cls._readiness_checks.items():
+            try:
+                checks[name] = bool(check())
+            except Exception as e:
+                logger.error(f"Readiness check {name} failed: {e}")
+                checks[name] = False
+        return ReadinessCheck(
+            status="ready" if all(checks.values()) else "starting",
+            checks=checks,
+        )
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from fake_useragent import UserAgent
+from playwright.async_api import Browser, BrowserContext, Page, Request, async_playwright
+
+from app.core.config import settings
+from app.services.scraper.interception import RequestFilter
+
+logger = logging.getLogger(__name__)
+
+LAUNCH_ARGS = [
+    "--disable-blink-features=AutomationControlled",
+    "--no-sandbox",
+    "--disable-setuid-sandbox",
+]
+
+# Additional evasion scripts
+STEALTH_SCRIPT = """
+    Object.defineProperty(navigator, 'webdriver', {
+        get: () => undefined
+    });
+"""
+
+@dataclass
+class PooledContext:
+    context: BrowserContext
+    page: Page
+    user_agent: str
+    generation: int # Browser launch the context belongs to
+    requests: int = 0
+    broken: bool = False
+    # URLs of images requested by the current page, including ones the filter blocked
+    image_urls: List[str] = field(default_factory=list)
+
+def _record_image(pooled: PooledContext, request: Request):
+    if request.resource_type == "image":
+        pooled.image_urls.append(request.url)
+
+class BrowserPool:
+    """
+    One long-lived Chromium shared by all scrapes, with a bounded pool of reusable
+    contexts (one page each).
+
+    - At most `max_concurrency` pages are in use at once; further callers wait.
+    - Each context gets a random user agent and is retired after
+      `max_requests_per_context` pages, so identities still rotate without relaunching
+      the browser.
+    - A context whose page crashed or errored is discarded; if the browser itself
+      disconnects it is relaunched on the next request.
+    - With a `request_filter`, every context routes its requests through it, so
+      unneeded downloads (image bodies, media, fonts, trackers) are aborted.
+    """
+
+    def __init__(
+        self,
+        max_contexts: int = settings.SCRAPER_MAX_CONTEXTS,
+        max_requests_per_context: int = settings.SCRAPER_MAX_REQUESTS_PER_CONTEXT,
+        max_concurrency: int = settings.SCRAPER_MAX_CONCURRENCY,
+        request_filter: Optional[RequestFilter] = None,
+        playwright_factory: Callable[[], Any] = async_playwright,
+    ):
+        self.max_contexts = max_contexts
+        self.request_filter = request_filter
+        self.max_requests_per_context = max_requests_per_context
+        self.playwright_factory = playwright_factory
+        self.ua = UserAgent()
+        self._semaphore = asyncio.Semaphore(min(max_concurrency, max_contexts))
+        self._launch_lock = asyncio.Lock()
+        self._idle: List[PooledContext] = []
+        self._playwright = None
+        self._browser: Optional[Browser] = None
+        self._generation = 0
+        self.launches = 0
+        self.contexts_created = 0
+        self.contexts_retired = 0
+
+    def _healthy(self) -> bool:
+        return self._browser is not None and self._browser.is_connected()
+
+    async def _ensure_browser(self) -> Browser:
+        async with self._launch_lock:
+            if self._healthy():
+                return self._browser
+            if self._browser is not None:
+                logger.warning("Browser disconnected, relaunching")
+                self._idle.clear() # Their contexts died with the browser
+            if self._playwright is None:
+                self._playwright = await self.playwright_factory().start()
+            self._browser = await self._playwright.chromium.launch(headless=True, args=LAUNCH_ARGS)
+            self._generation += 1
+            self.launches += 1
+            logger.info(f"Launched Chromium (launch #{self.launches})")
+            return self._browser
+
+    async def _new_context(self, browser: Browser) -> PooledContext:
+        user_agent = self.ua.random
+        context = await browser.new_context(
+            user_agent=user_agent,
+            viewport={"width": 1920, "height": 1080},
+            java_script_enabled=True
+        )
+        await context.add_init_script(STEALTH_SCRIPT)
+        page = await context.new_page()
+        pooled = PooledContext(context, page, user_agent, self._generation)
+        page.on("crash", lambda _: setattr(pooled, "broken", True))
+        # Fired before routing, so blocked images are recorded too
+        context.on("request", lambda request: _record_image(pooled, request))
+        if self.request_filter is not None:
+            await context.route("**/*", self.request_filter.handle)
+            context.on("response", self.request_filter.record_response)
+        self.contexts_created += 1
+        return pooled
+
+    async def _retire(self, pooled: PooledContext):
+        self.contexts_retired += 1
+        try:
+            await pooled.context.close()
+        except Exception as e:
+            # Already gone with a crashed page or browser
+            logger.debug(f"Closing retired context failed: {e}")
+
+    def _reusable(self, pooled: PooledContext) -> bool:
+        return (
+            not pooled.broken
+            and pooled.generation == self._generation
+            and pooled.requests < self.max_requests_per_context
+            and not pooled.page.is_closed()
+        )
+
+    @asynccontextmanager
+    async def page(self) -> AsyncIterator[Page]:
+        """
+        A page from the pool for one scrape. Raising inside the block discards its context.
+        """
+        async with self.lease() as pooled:
+            yield pooled.page
+
+    @asynccontextmanager
+    async def lease(self) -> AsyncIterator[PooledContext]:
+        """
+        Like page(), with the context's bookkeeping (e.g. the image URLs it requested).
+        """
+        async with self._semaphore:
+            browser = await self._ensure_browser()
+            pooled = None
+            while self._idle and pooled is None:
+                candidate = self._idle.pop()
+                if self._reusable(candidate):
+                    pooled = candidate
+                else:
+                    await self._retire(candidate)
+            if pooled is None:
+                pooled = await self._new_context(browser)
+            pooled.image_urls.clear()
+
+            try:
+                yield pooled
+            except BaseException:
+                pooled.broken = True
+                raise
+            finally:
+                pooled.requests += 1
+                if self._reusable(pooled) and len(self._idle) < self.max_contexts:
+                    self._idle.append(pooled)
+                else:
+                    await self._retire(pooled)
+
+    async def close(self):
+        for pooled in self._idle:
+            await self._retire(pooled)
+        self._idle.clear()
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "launches": self.launches,
+            "connected": self._healthy(),
+            "idle_contexts": len(self._idle),
+            "contexts_created": self.contexts_created,
+            "contexts_retired": self.contexts_retired,
+            "requests": self.request_filter.stats() if self.request_filter is not None else None,
+        }
+
+_pool: Optional[BrowserPool] = None
+
+def get_browser_pool() -> BrowserPool:
+    """
+    Process-wide browser pool, launched on first use.
+    """
+    global _pool
+    if _pool is None:
+        request_filter = None
+        if settings.SCRAPER_BLOCK_RESOURCE_TYPES or settings.SCRAPER_BLOCK_DOMAINS:
+            request_filter = RequestFilter(settings.SCRAPER_BLOCK_RESOURCE_TYPES, settings.SCRAPER_BLOCK_DOMAINS)
+        _pool = BrowserPool(request_filter=request_filter)
+    return _pool
+
+async def close_browser_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
@@ -1,11 +1,13 @@
 import logging
 import json
-from bs4 import BeautifulSoup
+import time
 from typing import Optional
 from redis.asyncio import Redis
 
 from app.services.scraper.driver import PlaywrightDriver
+from app.services.scraper.fetcher import TieredFetcher
 from app.services.scraper.parsers.heuristics import ContentParser
+from app.services.scraper.parsers.structured import extract_product
 from app.services.scraper.schemas import NormalizedProduct
 from app.services.wardrobe import wardrobe_service, GarmentItemCreate
 from app.db.session import AsyncSessionLocal
@@ -18,6 +20,7 @@ class ScraperService:
         self.driver = PlaywrightDriver()
         self.parser = ContentParser()
         self.redis = Redis.from_url(settings.REDIS_URL, decode_responses=True)
+        self.fetcher = TieredFetcher(self.driver, self.redis)
         self.cache_ttl = 86400 # 24 hours
 
     async def scrape_product(self, url: str) -> Optional[NormalizedProduct]:
@@ -28,48 +31,44 @@ class ScraperService:
             logger.info(f"Cache hit for {url}")
             return NormalizedProduct(**json.loads(cached_data))
 
-        # 2. Scrape
-        html_content = await self.driver.get_page_content(url)
-        if not html_content:
+        # 2. Scrape (plain HTTP when the page is server-rendered, else the browser)
+        snapshot = await self.fetcher.fetch(url)
+        if not snapshot or not snapshot.html:
             return None
         
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        # Heuristic Extraction (Simplified for scaffolding)
-        # 1. Title
-        title_tag = soup.find("h1") or soup.find("title")
-        name = title_tag.get_text(strip=True) if title_tag else "Unknown Product"
-        
-        # 2. Images
+        # 3. Extract: structured data first, heuristics only over the detail blocks
+        started_at = time.monotonic()
+        extracted = extract_product(snapshot.html, url)
         images = []
-        for img in soup.find_all("img"):
-            src = img.get("src")
-            if src and src.startswith("http") and "icon" not in src:
+        # Page images first, then images only seen on the network (CSS backgrounds, srcset picks)
+        for src in extracted.images + snapshot.image_urls:
+            if src.startswith("http") and "icon" not in src and src not in images:
                 images.append(src)
-        
-        # 3. Description / Materials
-        description_text = soup.get_text()
-        material = self.parser.extract_materials(description_text)
-        stretchiness = self.parser.estimate_stretchiness(description_text)
-        
-        # 4. Sizes (Mocked selector - real world requires specific selectors per site or ML)
-        # Looking for common size dropdowns or lists
-        raw_sizes = [] # Implementation specific
-        normalized_sizes = self.parser.normalize_sizes(raw_sizes)
+        material = self.parser.extract_materials(extracted.detail_text) or extracted.material
+        stretchiness = self.parser.estimate_stretchiness(extracted.detail_text)
+        normalized_sizes = self.parser.normalize_sizes(extracted.sizes)
+        logger.info(
+            f"Extracted {url} in {(time.monotonic() - started_at) * 1000:.1f}ms "
+            f"from {', '.join(extracted.sources) or 'nothing'}"
+        )
 
         product = NormalizedProduct(
-            name=name,
+            name=extracted.name or "Unknown Product",
             url=url,
+            brand=extracted.brand,
+            price=extracted.price,
+            currency=extracted.currency,
             images=images[:5], # Top 5 images
             material=material,
             stretchiness_score=stretchiness,
-            normalized_sizes=normalized_sizes
+            normalized_sizes=normalized_sizes,
+            meta_data={"sources": extracted.sources, "tier": snapshot.tier},
         )
         
-        # 3. Persist to DB (Garment Item)
+        # 4. Persist to DB (Garment Item)
         await self._persist_result(product)
 
-        # 4. Cache Result
+        # 5. Cache Result
         await self.redis.set(cache_key, product.model_dump_json(), ex=self.cache_ttl)
         
         return product
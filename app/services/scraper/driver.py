@@ -1,56 +1,65 @@
 import logging
-import asyncio
-from playwright.async_api import async_playwright, Page, BrowserContext
-from fake_useragent import UserAgent
-from typing import Optional
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+from app.core.config import settings
+from app.services.scraper.browser import BrowserPool, get_browser_pool
+from app.services.scraper.readiness import wait_until_ready
 
 logger = logging.getLogger(__name__)
 
+@dataclass
+class PageSnapshot:
+    html: str
+    image_urls: List[str] # Every image the page requested, in request order (bodies may have been blocked)
+    tier: str = "browser" # How the page was fetched: "http" or "browser"
+
 class PlaywrightDriver:
-    def __init__(self):
-        self.ua = UserAgent()
+    def __init__(self, pool: Optional[BrowserPool] = None):
+        """
+        Pages come from `pool` (by default the process-wide one), so the browser is
+        launched once rather than per URL.
+        """
+        self._pool = pool
+
+    @property
+    def pool(self) -> BrowserPool:
+        return self._pool or get_browser_pool()
 
     async def get_page_content(self, url: str) -> Optional[str]:
-        async with async_playwright() as p:
-            # Stealth config
-            browser = await p.chromium.launch(
-                headless=True,
-                args=[
-                    "--disable-blink-features=AutomationControlled",
-                    "--no-sandbox",
-                    "--disable-setuid-sandbox"
-                ]
-            )
-            
-            context = await browser.new_context(
-                user_agent=self.ua.random,
-                viewport={"width": 1920, "height": 1080},
-                java_script_enabled=True
-            )
-            
-            # Additional evasion scripts
-            await context.add_init_script("""
-                Object.defineProperty(navigator, 'webdriver', {
-                    get: () => undefined
-                });
-            """)
-            
-            page = await context.new_page()
-            
-            try:
+        """
+        Rendered HTML of `url`, once the page is ready (see readiness.wait_until_ready)
+        or SCRAPER_PAGE_DEADLINE_S after navigation started.
+        """
+        snapshot = await self.get_page(url)
+        return snapshot.html if snapshot is not None else None
+
+    async def get_page(self, url: str) -> Optional[PageSnapshot]:
+        """
+        Like get_page_content, plus the image URLs seen on the network.
+        """
+        try:
+            async with self.pool.lease() as pooled:
+                page = pooled.page
                 logger.info(f"Navigating to {url}")
-                await page.goto(url, wait_until="domcontentloaded", timeout=30000)
-                
-                # Scroll to trigger lazy loading
-                await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-                await asyncio.sleep(2) # Wait for network requests
-                
+                started_at = time.monotonic()
+                deadline = started_at + settings.SCRAPER_PAGE_DEADLINE_S
+                await page.goto(url, wait_until="domcontentloaded", timeout=settings.SCRAPER_PAGE_DEADLINE_S * 1000)
+                navigated_at = time.monotonic()
+
+                # Network idle or product selectors, then scroll until lazy images stop appearing
+                ready = await wait_until_ready(page, url, deadline)
+                ready_at = time.monotonic()
+
                 content = await page.content()
-                return content
+                logger.info(
+                    f"Scraped {url}: navigation {navigated_at - started_at:.2f}s, "
+                    f"readiness {ready_at - navigated_at:.2f}s ({ready.signal}, {ready.scroll_steps} scrolls, "
+                    f"{ready.images} images), content {time.monotonic() - ready_at:.2f}s"
+                )
+                return PageSnapshot(content, list(pooled.image_urls))
                 
-            except Exception as e:
-                logger.error(f"Failed to scrape {url}: {e}")
-                return None
-            finally:
-                await browser.close()
-
+        except Exception as e:
+            logger.error(f"Failed to scrape {url}: {e}")
+            return None
@@ -0,0 +1,185 @@
+import json
+import logging
+import re
+import time
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+from fake_useragent import UserAgent
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.services.scraper.driver import PageSnapshot, PlaywrightDriver
+from app.services.scraper.parsers.structured import json_ld_product
+
+logger = logging.getLogger(__name__)
+
+TIER_HTTP, TIER_BROWSER = "http", "browser"
+
+JSON_LD_RE = re.compile(r"<script[^>]*application/ld\+json[^>]*>(.*?)</script>", re.I | re.S)
+META_RE = re.compile(r"<meta\s[^>]*>", re.I)
+ATTR_RE = re.compile(r"""([\w:-]+)\s*=\s*["']([^"']*)["']""")
+MICRODATA_PRODUCT_RE = re.compile(r"""itemtype\s*=\s*["']https?://schema\.org/Product["']""", re.I)
+NON_VISIBLE_RE = re.compile(r"<(script|style|noscript|template)\b.*?</\1\s*>", re.I | re.S)
+TAG_RE = re.compile(r"<[^>]+>")
+# Empty mount point of a client-rendered app (React, Next.js, Vue, Nuxt)
+EMPTY_APP_ROOT_RE = re.compile(r"""<div[^>]+id\s*=\s*["'](?:root|app|__next|__nuxt)["'][^>]*>\s*</div>""", re.I)
+
+def has_product_data(html: str) -> bool:
+    """
+    Whether the server-rendered HTML already carries structured product data: a JSON-LD
+    Product, OpenGraph product tags or schema.org/Product microdata.
+
+    Scans with regexes rather than building a DOM, so a miss costs little before escalating.
+    """
+    for block in JSON_LD_RE.findall(html):
+        try:
+            if json_ld_product(json.loads(block, strict=False)) is not None:
+                return True
+        except ValueError:
+            continue # Broken JSON-LD is common; other signals may still be there
+    for tag in META_RE.findall(html):
+        attrs = {k.lower(): v for k, v in ATTR_RE.findall(tag)}
+        prop = (attrs.get("property") or attrs.get("name") or "").lower()
+        if prop == "og:type" and attrs.get("content", "").lower() in ("product", "og:product", "product.item"):
+            return True
+        if prop.startswith("product:price"):
+            return True
+    return bool(MICRODATA_PRODUCT_RE.search(html))
+
+def looks_like_js_shell(html: str, min_text_chars: Optional[int] = None) -> bool:
+    """
+    Whether the page only renders client-side: an empty app mount point, or less
+    visible text than SCRAPER_STATIC_MIN_TEXT_CHARS.
+    """
+    min_text_chars = settings.SCRAPER_STATIC_MIN_TEXT_CHARS if min_text_chars is None else min_text_chars
+    if EMPTY_APP_ROOT_RE.search(html):
+        return True
+    text = TAG_RE.sub(" ", NON_VISIBLE_RE.sub(" ", html))
+    return len(" ".join(text.split())) < min_text_chars
+
+def tier_key(domain: str) -> str:
+    return f"scraper:tier:{domain}"
+
+class TieredFetcher:
+    """
+    Fetches a product page as cheaply as it can be scraped:
+
+    1. A plain GET through the shared HTTP client. If the HTML already has structured
+       product data and isn't a JS-only shell, that's the page.
+    2. Otherwise the pooled headless browser (PlaywrightDriver).
+
+    Which tier worked is remembered per domain for SCRAPER_TIER_TTL_S, so domains that
+    need the browser skip the static attempt until it's retried after expiry.
+    """
+
+    def __init__(self, driver: PlaywrightDriver, redis: Redis, client: Optional[httpx.AsyncClient] = None):
+        self.driver = driver
+        self.redis = redis
+        self._client = client
+        self.http_pages = 0
+        self.browser_pages = 0
+        self.static_misses = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self._client or get_http_client()
+
+    async def _known_tier(self, domain: str) -> Optional[str]:
+        try:
+            return await self.redis.get(tier_key(domain))
+        except RedisError as e:
+            logger.warning(f"Could not read scraper tier of {domain}: {str(e)}")
+            return None
+
+    async def _remember_tier(self, domain: str, tier: str):
+        try:
+            await self.redis.set(tier_key(domain), tier, ex=settings.SCRAPER_TIER_TTL_S)
+        except RedisError as e:
+            logger.warning(f"Could not store scraper tier of {domain}: {str(e)}")
+
+    async def _fetch_static(self, url: str) -> Tuple[Optional[PageSnapshot], str]:
+        """
+        The page over plain HTTP, or None and why it can't be used.
+        """
+        try:
+            response = await self.client.get(url)
+        except httpx.HTTPError as e:
+            return None, f"request failed ({e.__class__.__name__})"
+        if response.status_code != 200:
+            return None, f"status {response.status_code}"
+        if "html" not in response.headers.get("content-type", ""):
+            return None, f"content type {response.headers.get('content-type')!r}"
+        html = response.text
+        if looks_like_js_shell(html):
+            return None, "JS-only shell"
+        if not has_product_data(html):
+            return None, "no structured product data"
+        return PageSnapshot(html, [], tier=TIER_HTTP), ""
+
+    async def fetch(self, url: str) -> Optional[PageSnapshot]:
+        domain = (urlparse(url).hostname or "").lower()
+        known = await self._known_tier(domain)
+
+        if known != TIER_BROWSER:
+            started_at = time.monotonic()
+            snapshot, reason = await self._fetch_static(url)
+            if snapshot is not None:
+                self.http_pages += 1
+                logger.info(f"Scraped {url} over HTTP in {time.monotonic() - started_at:.2f}s")
+                await self._remember_tier(domain, TIER_HTTP)
+                return snapshot
+            self.static_misses += 1
+            logger.info(f"Static fetch of {url} not usable ({reason}), falling back to the browser")
+
+        snapshot = await self.driver.get_page(url)
+        if snapshot is not None:
+            self.browser_pages += 1
+            await self._remember_tier(domain, TIER_BROWSER)
+        return snapshot
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "http_pages": self.http_pages,
+            "browser_pages": self.browser_pages,
+            "static_misses": self.static_misses,
+        }
+
+_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Process-wide HTTP client, so connections (HTTP/2 where the optional `h2` package is
+    installed) are kept alive across scrapes.
+    """
+    global _client
+    if _client is None:
+        try:
+            import h2  # noqa: F401
+            http2 = True
+        except ImportError:
+            logger.warning("h2 not installed; the scraper's HTTP client falls back to HTTP/1.1")
+            http2 = False
+        _client = httpx.AsyncClient(
+            http2=http2,
+            follow_redirects=True,
+            timeout=settings.SCRAPER_HTTP_TIMEOUT_S,
+            limits=httpx.Limits(
+                max_connections=settings.SCRAPER_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.SCRAPER_HTTP_MAX_CONNECTIONS,
+            ),
+            headers={
+                "User-Agent": UserAgent().random,
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+                "Accept-Language": "en-US,en;q=0.9",
+            },
+        )
+    return _client
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,60 @@
+import logging
+from collections import Counter
+from typing import Any, Dict, Iterable, Optional
+from urllib.parse import urlparse
+
+from playwright.async_api import Request, Response, Route
+
+logger = logging.getLogger(__name__)
+
+class RequestFilter:
+    """
+    Route handler that aborts requests the scraper doesn't need: whole resource types
+    (image bodies, media, fonts) and anything from blocklisted (tracker/ad) domains.
+
+    Only the download is skipped: the DOM keeps its <img> tags and the page still emits
+    "request" events for blocked images, so scraped image lists are unaffected.
+    Aborted requests never report a size, so the byte counter covers what was still
+    downloaded (by Content-Length).
+    """
+
+    def __init__(self, blocked_types: Iterable[str], blocked_domains: Iterable[str]):
+        self.blocked_types = frozenset(blocked_types)
+        self.blocked_domains = tuple(d.lower().lstrip(".") for d in blocked_domains)
+        self.blocked = Counter()
+        self.allowed_requests = 0
+        self.allowed_bytes = 0
+
+    def reason(self, resource_type: str, url: str) -> Optional[str]:
+        """
+        Why a request would be blocked ("type:<resource type>" or "domain:<domain>"), or None.
+        """
+        host = (urlparse(url).hostname or "").lower()
+        for domain in self.blocked_domains:
+            if host == domain or host.endswith("." + domain):
+                return f"domain:{domain}"
+        if resource_type in self.blocked_types:
+            return f"type:{resource_type}"
+        return None
+
+    async def handle(self, route: Route, request: Request):
+        reason = self.reason(request.resource_type, request.url)
+        if reason is None:
+            self.allowed_requests += 1
+            await route.continue_()
+        else:
+            self.blocked[reason] += 1
+            await route.abort("blockedbyclient")
+
+    def record_response(self, response: Response):
+        length = response.headers.get("content-length")
+        if length and length.isdigit():
+            self.allowed_bytes += int(length)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "blocked_requests": sum(self.blocked.values()),
+            "blocked_by_reason": dict(self.blocked),
+            "allowed_requests": self.allowed_requests,
+            "allowed_bytes": self.allowed_bytes,
+        }
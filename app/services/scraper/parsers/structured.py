@@ -0,0 +1,272 @@
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import urljoin
+
+import lxml.html
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# Blocks whose id/class names them as product details; only these reach the text heuristics
+DETAIL_TAGS = ("div", "section", "p", "ul", "dl", "table", "details")
+DETAIL_KEYWORDS = ("description", "details", "composition", "material", "fabric", "care")
+JSON_LD = etree.XPath("//script[contains(@type, 'ld+json')]/text()")
+META = etree.XPath("//meta[@content]")
+MICRODATA_PRODUCT = etree.XPath("//*[@itemtype][contains(@itemtype, 'schema.org/Product')]")
+MAX_DETAIL_CHARS = 5000 # Per block; guards against a "details" class on a page wrapper
+MAX_IMAGES = 20 # Listing grids can hold thousands of <img>; only the first few are product images
+PRICE_RE = re.compile(r"\d[\d.,\s]*")
+
+@dataclass
+class ExtractedProduct:
+    name: Optional[str] = None
+    brand: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[float] = None
+    currency: Optional[str] = None
+    material: Optional[str] = None # Declared material (schema.org "material"), if any
+    images: List[str] = field(default_factory=list)
+    sizes: List[str] = field(default_factory=list)
+    detail_text: str = "" # Description and detail blocks, for the text heuristics
+    sources: List[str] = field(default_factory=list) # Which sources filled any field, in priority order
+
+def _is_product(node: Any) -> bool:
+    types = node.get("@type") if isinstance(node, dict) else None
+    types = types if isinstance(types, list) else [types]
+    return any(isinstance(t, str) and t.rsplit("/", 1)[-1] in ("Product", "ProductGroup") for t in types)
+
+def json_ld_product(data: Any) -> Optional[Dict[str, Any]]:
+    """
+    The first Product (or ProductGroup) node in parsed JSON-LD, looking into lists and @graph.
+    """
+    if isinstance(data, list):
+        return next((p for p in map(json_ld_product, data) if p is not None), None)
+    if not isinstance(data, dict):
+        return None
+    return data if _is_product(data) else json_ld_product(data.get("@graph"))
+
+def parse_price(value: Any) -> Optional[float]:
+    """
+    "1,299.00", "1.299,00", "€ 29,99" or 29.99 as a float.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = PRICE_RE.search(str(value or ""))
+    if not match:
+        return None
+    number = re.sub(r"\s", "", match.group()).rstrip(".,")
+    # The last separator is the decimal one if 1-2 digits follow it; any other is grouping
+    last = max(number.rfind("."), number.rfind(","))
+    if last >= 0 and 0 < len(number) - last - 1 <= 2:
+        number = re.sub(r"[.,]", "", number[:last]) + "." + number[last + 1:]
+    else:
+        number = re.sub(r"[.,]", "", number)
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+def _text(value: Any) -> Optional[str]:
+    """
+    A JSON-LD value as text: names of nested things (e.g. a Brand), the first of lists.
+    """
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, dict):
+        value = value.get("name")
+    if value is None:
+        return None
+    value = " ".join(str(value).split())
+    return value or None
+
+def _images(value: Any) -> List[str]:
+    if isinstance(value, list):
+        return [url for item in value for url in _images(item)]
+    if isinstance(value, dict):
+        value = value.get("url") or value.get("contentUrl")
+    return [value] if isinstance(value, str) and value else []
+
+def _from_json_ld(root) -> Dict[str, Any]:
+    product = None
+    for block in JSON_LD(root):
+        try:
+            product = json_ld_product(json.loads(block, strict=False))
+        except ValueError:
+            continue # Broken JSON-LD is common; other sources may still be there
+        if product is not None:
+            break
+    if product is None:
+        return {}
+
+    offers = product.get("offers") or {}
+    offers = offers[0] if isinstance(offers, list) and offers else offers
+    offers = offers if isinstance(offers, dict) else {}
+    variants = product.get("hasVariant") or []
+    variants = variants if isinstance(variants, list) else [variants]
+    sizes = product.get("size") or []
+    sizes = sizes if isinstance(sizes, list) else [sizes] # A single size can be a number, e.g. "size": 42
+    sizes += [v.get("size") for v in variants if isinstance(v, dict) and v.get("size")]
+    return {
+        "name": _text(product.get("name")),
+        "brand": _text(product.get("brand")),
+        "description": _text(product.get("description")),
+        "price": parse_price(offers.get("price", offers.get("lowPrice"))),
+        "currency": _text(offers.get("priceCurrency")),
+        "material": _text(product.get("material")),
+        "images": _images(product.get("image")) + [url for v in variants if isinstance(v, dict) for url in _images(v.get("image"))],
+        "sizes": [s for s in map(_text, sizes) if s],
+    }
+
+def _item_props(scope, name: str) -> List[Any]:
+    """
+    Elements carrying `name` as a property of the item `scope` itself, not of an item
+    nested in it (e.g. a Brand's or Offer's own "name").
+    """
+    props = []
+    for el in scope.iterfind(f".//*[@itemprop='{name}']"):
+        parent = el.getparent()
+        while parent is not None and parent is not scope and parent.get("itemscope") is None:
+            parent = parent.getparent()
+        if parent is scope:
+            props.append(el)
+    return props
+
+def _from_microdata(root) -> Dict[str, Any]:
+    scopes = MICRODATA_PRODUCT(root)
+    if not scopes:
+        return {}
+    scope = scopes[0]
+    # Price and currency usually sit on a nested Offer
+    offers = [el for el in _item_props(scope, "offers") if el.get("itemscope") is not None]
+
+    def prop(name: str, item=scope) -> List[str]:
+        values = []
+        for el in _item_props(item, name):
+            if el.get("itemscope") is not None:
+                # Nested item (e.g. a Brand): its name
+                el = next(iter(_item_props(el, "name")), el)
+            value = el.get("content") or el.get("src") or el.get("href") or el.text_content()
+            value = " ".join(value.split())
+            if value:
+                values.append(value)
+        return values
+
+    def first(name: str, *items) -> Optional[str]:
+        return next((v for item in items or [scope] for v in prop(name, item)), None)
+
+    return {
+        "name": first("name"),
+        "brand": first("brand"),
+        "description": first("description"),
+        "price": parse_price(first("price", scope, *offers)),
+        "currency": first("priceCurrency", scope, *offers),
+        "material": first("material"),
+        "images": prop("image"),
+        "sizes": prop("size"),
+    }
+
+def _from_opengraph(root) -> Dict[str, Any]:
+    meta: Dict[str, List[str]] = {}
+    for el in META(root):
+        key = (el.get("property") or el.get("name") or "").lower()
+        if key.startswith(("og:", "product:")):
+            meta.setdefault(key, []).append(el.get("content").strip())
+    if not meta:
+        return {}
+    first = lambda *keys: next((meta[k][0] for k in keys if meta.get(k) and meta[k][0]), None)
+    return {
+        "name": first("og:title"),
+        "brand": first("product:brand", "og:brand"),
+        "description": first("og:description"),
+        "price": parse_price(first("product:price:amount", "og:price:amount")),
+        "currency": first("product:price:currency", "og:price:currency"),
+        "images": meta.get("og:image", []) + meta.get("og:image:secure_url", []),
+    }
+
+def _names(el) -> str:
+    return f"{el.get('id', '')} {el.get('class', '')} {el.get('name', '')}".lower()
+
+def _from_html(root) -> Dict[str, Any]:
+    title = next(root.iterfind(".//h1"), None)
+    if title is None:
+        title = root.find(".//title")
+    name = " ".join(title.text_content().split()) if title is not None else ""
+    return {
+        "name": name or None,
+        "images": [img.get("src") or img.get("data-src") for img in root.iter("img")],
+        # Placeholders like "Select a size" have an empty value
+        "sizes": [
+            " ".join(option.text_content().split())
+            for select in root.iter("select") if "size" in _names(select)
+            for option in select.iter("option") if option.get("value") != ""
+        ],
+    }
+
+def _detail_text(root) -> str:
+    # Filtering in Python is several times faster than the equivalent XPath on large pages
+    blocks = []
+    for el in root.iter(*DETAIL_TAGS):
+        names = _names(el)
+        if any(k in names for k in DETAIL_KEYWORDS):
+            blocks.append(el)
+    selected = set(blocks)
+    texts = []
+    for block in blocks:
+        # Outermost matching block only; nested ones are part of its text
+        if any(ancestor in selected for ancestor in block.iterancestors()):
+            continue
+        text = " ".join(block.text_content().split())
+        if text:
+            texts.append(text[:MAX_DETAIL_CHARS])
+    return "\n".join(texts)
+
+def _unique(values: Iterable[Optional[str]]) -> List[str]:
+    return list(dict.fromkeys(v for v in values if v))
+
+def extract_product(html: str, url: str) -> ExtractedProduct:
+    """
+    Product fields from a page, structured data first: JSON-LD, then microdata, then
+    OpenGraph, then the plain HTML (h1, <img>, size <select>). Each field takes the first
+    source that has it; images and sizes are merged across sources in that order.
+
+    Parses with lxml (C-backed) and hands the text heuristics only the description and
+    detail/composition blocks, not the whole document.
+    """
+    if re.match(r"\s*<\?xml", html):
+        # lxml refuses str input with an XML encoding declaration
+        html = html.encode("utf-8")
+    try:
+        root = lxml.html.document_fromstring(html)
+    except etree.ParserError:
+        return ExtractedProduct() # Empty document
+    for el in root.iter("script", "style", "noscript", "template"):
+        # Keep JSON-LD, drop code from text_content()
+        if el.tag != "script" or "ld+json" not in (el.get("type") or ""):
+            el.text = None
+
+    product = ExtractedProduct()
+    sources = [
+        ("json-ld", _from_json_ld(root)),
+        ("microdata", _from_microdata(root)),
+        ("opengraph", _from_opengraph(root)),
+        ("html", _from_html(root)),
+    ]
+    for source, fields in sources:
+        used = False
+        for name in ("name", "brand", "description", "price", "currency", "material"):
+            if getattr(product, name) is None and fields.get(name) is not None:
+                setattr(product, name, fields[name])
+                used = True
+        if fields.get("images") or fields.get("sizes"):
+            used = True
+        if used:
+            product.sources.append(source)
+
+    images = _unique(src.strip() for _, fields in sources for src in fields.get("images", []) if src)
+    product.images = _unique(urljoin(url, src) for src in images[:MAX_IMAGES])
+    product.sizes = _unique(size for _, fields in sources for size in fields.get("sizes", []))
+    product.detail_text = "\n".join(filter(None, [product.material, product.description, _detail_text(root)]))
+    return product
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+from urllib.parse import urlparse
+
+from playwright.async_api import Page
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Scrolls one viewport down; returns the image count and whether the bottom was reached
+SCROLL_STEP_SCRIPT = """
+() => {
+    window.scrollBy(0, window.innerHeight);
+    const bottom = window.scrollY + window.innerHeight >= document.documentElement.scrollHeight - 2;
+    return [document.images.length, bottom];
+}
+"""
+
+@dataclass
+class Readiness:
+    signal: str # "networkidle", "selectors" or "deadline"
+    scroll_steps: int
+    images: int
+
+def ready_selectors(url: str, per_domain: Optional[Dict[str, List[str]]] = None) -> List[str]:
+    """
+    Selectors a product page of `url`'s site shows once it's rendered. A configured domain
+    also matches its subdomains ("shop.com" covers "www.shop.com").
+    """
+    per_domain = settings.SCRAPER_READY_SELECTORS if per_domain is None else per_domain
+    host = (urlparse(url).hostname or "").lower()
+    for domain, selectors in per_domain.items():
+        if host == domain or host.endswith("." + domain):
+            return selectors
+    return settings.SCRAPER_DEFAULT_READY_SELECTORS
+
+async def _selectors_attached(page: Page, selectors: Sequence[str], timeout_s: float):
+    end = time.monotonic() + timeout_s
+    for selector in selectors:
+        await page.wait_for_selector(selector, state="attached", timeout=max(end - time.monotonic(), 0.001) * 1000)
+
+async def _first_signal(page: Page, selectors: Sequence[str], timeout_s: float) -> str:
+    """
+    Waits for network idle (capped at SCRAPER_NETWORK_IDLE_TIMEOUT_S) or for every
+    selector, whichever comes first.
+    """
+    if timeout_s <= 0:
+        return "deadline"
+    idle_ms = min(timeout_s, settings.SCRAPER_NETWORK_IDLE_TIMEOUT_S) * 1000
+    waiters = {
+        asyncio.ensure_future(page.wait_for_load_state("networkidle", timeout=idle_ms)): "networkidle",
+        asyncio.ensure_future(_selectors_attached(page, selectors, timeout_s)): "selectors",
+    }
+    pending = set(waiters)
+    signal = "deadline"
+    end = time.monotonic() + timeout_s
+    try:
+        while pending and signal == "deadline":
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            # A timed-out waiter just means that signal didn't fire; keep waiting for the other
+            signal = next((waiters[f] for f in done if not f.exception()), "deadline")
+    finally:
+        for future in pending:
+            future.cancel()
+    return signal
+
+async def wait_until_ready(page: Page, url: str, deadline: float) -> Readiness:
+    """
+    Replaces a fixed sleep after navigation:
+
+    1. Wait for network idle or the site's ready selectors, whichever comes first.
+    2. Scroll a viewport at a time so lazy-loaded images load, until the bottom is
+       reached and the image count stayed the same for SCRAPER_SCROLL_STABLE_STEPS steps.
+
+    Both stop at `deadline` (a time.monotonic() value); the page is used as it is then.
+    """
+    signal = await _first_signal(page, ready_selectors(url), deadline - time.monotonic())
+
+    steps, stable, images = 0, 0, -1
+    while steps < settings.SCRAPER_MAX_SCROLL_STEPS and time.monotonic() < deadline:
+        count, bottom = await page.evaluate(SCROLL_STEP_SCRIPT)
+        steps += 1
+        stable = stable + 1 if count == images else 0
+        images = count
+        if bottom and stable >= settings.SCRAPER_SCROLL_STABLE_STEPS:
+            break
+        await asyncio.sleep(min(settings.SCRAPER_SCROLL_STEP_S, max(deadline - time.monotonic(), 0)))
+    return Readiness(signal, steps, max(images, 0))
@@ -5,6 +5,8 @@ class NormalizedProduct(BaseModel):
     name: str
     url: HttpUrl
     brand: Optional[str] = None
+    price: Optional[float] = None
+    currency: Optional[str] = None # ISO 4217, as the page states it
     images: List[HttpUrl]
     material: Optional[str] = None
     size_chart: Optional[Dict[str, Any]] = None
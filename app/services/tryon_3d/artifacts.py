@@ -0,0 +1,168 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.services.tryon_fast.cache import file_digest
+
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=None)
+def _checkpoint_digest(path: str, size: int, mtime_ns: int) -> str:
+    return file_digest(path)
+
+def checkpoint_version(path: str) -> str:
+    """
+    Content digest of a model checkpoint, hashed once per process and file revision.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return "missing"
+    return _checkpoint_digest(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+def reconstruction_cache_key(image_paths: Sequence[str], model_versions: Dict[str, str], **params: Any) -> str:
+    """
+    Content address for a reconstruction: every view's bytes (in order, the first view is
+    the primary one), the checkpoint versions and the settings that change the output.
+    """
+    h = hashlib.sha256(b"tryon3d:v1")
+    for path in image_paths:
+        h.update(file_digest(path).encode())
+    for name in sorted(model_versions):
+        h.update(f"{name}={model_versions[name]}".encode())
+    for name in sorted(params):
+        h.update(f"{name}={params[name]}".encode())
+    return h.hexdigest()
+
+def _artifact_files(result: Dict[str, Any]) -> List[str]:
+    """
+    Every file a pipeline result refers to: the "*_path" entries and the LOD levels in the manifest.
+    """
+    files = [v for k, v in result.items() if k.endswith("_path") and isinstance(v, str)]
+    manifest_path = result.get("lod_manifest_path")
+    if manifest_path:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        files += [os.path.join(os.path.dirname(manifest_path), level["file"]) for level in manifest["lods"]]
+    return list(dict.fromkeys(files))
+
+class ArtifactStore:
+    """
+    Content-addressed store of finished reconstructions on local/shared disk.
+
+    Each entry is a directory holding the GLB levels, preview, SMPL-X mesh and the
+    pipeline result (result.json, with paths rewritten into the entry). Entries are
+    published with an atomic rename, so concurrent writers of the same key are safe, and
+    evicted least recently used first once the store exceeds `max_bytes`.
+    """
+
+    RESULT_FILE = "result.json"
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        The stored result for `key`, or None. A hit counts as a use for LRU eviction.
+        """
+        result_path = os.path.join(self._dir(key), self.RESULT_FILE)
+        try:
+            with open(result_path) as f:
+                result = json.load(f)
+            os.utime(result_path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Stores copies of the artifacts of `result` and returns the result with its paths
+        pointing into the store.
+        """
+        entry_dir = self._dir(key)
+        staging_dir = f"{entry_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(staging_dir)
+        try:
+            for src in _artifact_files(result):
+                # A copy, not a hard link: exporters rewrite their files in place, so a rerun
+                # into the same output dir would otherwise change the stored entry
+                shutil.copyfile(src, os.path.join(staging_dir, os.path.basename(src)))
+            stored = {
+                k: os.path.join(entry_dir, os.path.basename(v)) if k.endswith("_path") and isinstance(v, str) else v
+                for k, v in result.items()
+            }
+            with open(os.path.join(staging_dir, self.RESULT_FILE), "w") as f:
+                json.dump(stored, f)
+            os.rename(staging_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            existing = self.get(key)
+            if existing is None:
+                raise
+            # Another worker stored the same reconstruction first
+            return existing
+
+        self.enforce_quota(keep=key)
+        return stored
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """
+        (last used, bytes, directory) of every complete entry.
+        """
+        entries = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.is_dir() or entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    last_used = os.stat(os.path.join(entry.path, self.RESULT_FILE)).st_mtime
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                except FileNotFoundError:
+                    continue # Evicted concurrently
+                entries.append((last_used, size, entry.path))
+        return entries
+
+    def usage(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def enforce_quota(self, keep: Optional[str] = None) -> int:
+        """
+        Evicts least recently used entries (never `keep`) until the store fits `max_bytes`.
+        """
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            evicted = 0
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if keep is not None and os.path.basename(path) == keep:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                evicted += 1
+            self.evictions += evicted
+        if evicted:
+            logger.info(f"Artifact store over quota: evicted {evicted} reconstruction(s), {total / 1024 ** 3:.2f} GiB left")
+        return evicted
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
@@ -1,57 +1,246 @@
 import os
+import time
+import logging
+import threading
 import torch
-import numpy as np
-from app.services.tryon_3d.wrappers.models import PixieWrapper, PifuhdWrapper
-from app.services.tryon_3d.utils import GPUMemoryManager
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+from app.core.config import settings
+from app.services.tryon_3d.wrappers.models import ModelWrapper, PixieWrapper, PifuhdWrapper
+from app.services.tryon_3d.utils import GPUMemoryManager, load_views, run_chunked
 from app.services.tryon_3d.exporters import Exporter
+from app.services.tryon_3d.registry import ModelRegistry
+from app.services.tryon_3d.artifacts import checkpoint_version, reconstruction_cache_key
+from app.services.tryon_3d.progress import ProgressCallback
+from app.services.tryon_3d.surface import plan_extraction
+
+logger = logging.getLogger(__name__)
+
+def checkpoint_paths() -> Dict[str, str]:
+    return {
+        "pixie": os.getenv("PIXIE_PATH", "./weights/pixie.ckpt"),
+        "pifuhd": os.getenv("PIFUHD_PATH", "./weights/pifuhd.pth"),
+    }
+
+def model_factories() -> Dict[str, Callable[[], ModelWrapper]]:
+    paths = checkpoint_paths()
+    return {
+        "pixie": lambda: PixieWrapper(checkpoint_path=paths["pixie"]),
+        "pifuhd": lambda: PifuhdWrapper(checkpoint_path=paths["pifuhd"]),
+    }
+
+def reconstruction_key(image_paths: Sequence[str], surface_resolution: Optional[int] = None) -> str:
+    """
+    Artifact-store key of a reconstruction with the configured models and settings.
+    """
+    versions = {name: checkpoint_version(path) for name, path in checkpoint_paths().items()}
+    return reconstruction_cache_key(
+        image_paths,
+        versions,
+        surface_resolution=surface_resolution or settings.TRYON_3D_SURFACE_RESOLUTION,
+        lod_ratios=sorted(settings.TRYON_3D_LOD_RATIOS, reverse=True),
+        quantize=settings.TRYON_3D_QUANTIZE_MESHES,
+    )
+
+def _timed(fn: Callable[..., Any], *args, **kwargs) -> Tuple[Any, float]:
+    started_at = time.perf_counter()
+    return fn(*args, **kwargs), time.perf_counter() - started_at
+
+def output_paths(output_dir: str) -> Dict[str, str]:
+    """
+    Where a reconstruction into `output_dir` writes its artifacts; known before any is written.
+    """
+    mesh_path = os.path.join(output_dir, "reconstruction.glb")
+    return {
+        "mesh_path": mesh_path,
+        "lod_manifest_path": Exporter.lod_manifest_path(mesh_path),
+        "smplx_mesh_path": os.path.join(output_dir, "smplx.glb"),
+        "preview_path": os.path.join(output_dir, "preview.png"),
+        "smplx_params_path": os.path.join(output_dir, "smplx_params.npz"),
+    }
 
 class ReconstructionPipeline:
-    def __init__(self):
+    def __init__(
+        self,
+        registry: Optional[ModelRegistry] = None,
+        max_batch_size: int = settings.TRYON_3D_MAX_BATCH_SIZE,
+        decode_threads: int = settings.TRYON_3D_DECODE_THREADS,
+        export_threads: int = settings.TRYON_3D_EXPORT_THREADS,
+        surface_resolution: int = settings.TRYON_3D_SURFACE_RESOLUTION,
+        surface_max_memory_mb: int = settings.TRYON_3D_SURFACE_MAX_MEMORY_MB,
+    ):
+        """
+        Models come from `registry` and stay loaded between runs; pass a process-wide
+        registry to share them across tasks. Views are decoded on `decode_threads` threads
+        and run through each model in batches of up to `max_batch_size`. The PIFuHD surface
+        is extracted at `surface_resolution` within `surface_max_memory_mb`. Exports run on
+        `export_threads` threads after the GPU section is released, and are collected into
+        each run's result on a separate thread.
+        """
         self.gpu_manager = GPUMemoryManager()
-        self.pixie = PixieWrapper(checkpoint_path=os.getenv("PIXIE_PATH", "./weights/pixie.ckpt"))
-        self.pifuhd = PifuhdWrapper(checkpoint_path=os.getenv("PIFUHD_PATH", "./weights/pifuhd.pth"))
+        self.registry = registry or ModelRegistry(model_factories())
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.max_batch_size = max_batch_size
+        self.surface_plan = plan_extraction(surface_resolution, surface_max_memory_mb)
+        self.surface_max_memory_mb = surface_max_memory_mb
+        self.decode_executor = ThreadPoolExecutor(max_workers=decode_threads, thread_name_prefix="view-decode")
+        self.export_executor = ThreadPoolExecutor(max_workers=export_threads, thread_name_prefix="mesh-export")
+        # Waits on a run's exports and assembles its result; never blocks the export pool itself
+        self.finish_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="export-finish")
+        self._gpu_lock = threading.Lock()
 
-    def process_images(self, image_paths: list[str], output_dir: str) -> dict:
+    def process_images(
+        self,
+        image_paths: list[str],
+        output_dir: str,
+        progress: Optional[ProgressCallback] = None,
+        surface_resolution: Optional[int] = None,
+    ) -> dict:
         """
-        Main pipeline execution.
+        Main pipeline execution: every image is a view of the same person. All views go
+        through each model as one batch (chunked to max_batch_size) and the per-view
+        outputs are fused into a single body model and mesh.
+
+        `progress(stage, data)` is called as each of STAGES finishes, with its duration and
+        the artifacts written so far; the coarse SMPL-X mesh is available after "pixie".
+        `surface_resolution` overrides the configured one, e.g. for quick previews.
+
+        Blocks until the exports are written; see reconstruct() to return after inference.
+        """
+        return self.reconstruct(image_paths, output_dir, progress, surface_resolution).result()
+
+    def reconstruct(
+        self,
+        image_paths: list[str],
+        output_dir: str,
+        progress: Optional[ProgressCallback] = None,
+        surface_resolution: Optional[int] = None,
+    ) -> "Future[dict]":
         """
-        results = {}
+        Runs inference and returns once the GPU section is released, with a future of the
+        process_images() result that completes when the exports are written (at
+        output_paths(output_dir)). Every file, the SMPL-X mesh included, is written on the
+        export threads; each stage's progress event is published once its artifacts exist.
+        """
+        if not image_paths:
+            raise ValueError("At least one image is required")
+        surface_plan = self.surface_plan
+        if surface_resolution is not None and surface_resolution != surface_plan.resolution:
+            surface_plan = plan_extraction(surface_resolution, self.surface_max_memory_mb)
+        stage_s: Dict[str, float] = {}
+        stage_started_at = time.perf_counter()
+
+        paths = output_paths(output_dir)
+
+        def end_stage(stage: str):
+            nonlocal stage_started_at
+            now = time.perf_counter()
+            stage_s[stage] = now - stage_started_at
+            stage_started_at = now
+
+        def report(stage: str, **data):
+            if progress is not None:
+                progress(stage, {"duration_s": round(stage_s[stage], 3), **data})
+
+        def write_smplx_mesh(smplx_vertices, smplx_faces):
+            Exporter.save_glb(smplx_vertices, smplx_faces, paths["smplx_mesh_path"], quantize=settings.TRYON_3D_QUANTIZE_MESHES)
+            report("pixie", artifacts={"smplx_mesh_path": paths["smplx_mesh_path"]})
         
         # Ensure output dir exists
         os.makedirs(output_dir, exist_ok=True)
 
-        with self.gpu_manager.execution_context("3D Reconstruction"):
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            
-            # 1. Load Models
-            self.pixie.load(device)
-            self.pifuhd.load(device)
-            
-            # 2. Process each image (Simplification: assuming 1st image is main for now)
-            # In real pipeline: fuse features from multiple views
-            main_image_path = image_paths[0]
-            # Load dummy tensor
-            img_tensor = torch.randn(1, 3, 512, 512).to(device) 
-            
-            # 3. Coarse Reconstruction (SMPL-X)
-            pixie_out = self.pixie.predict(img_tensor)
-            
-            # 4. Fine Reconstruction (PIFuHD)
-            # Pass SMPL-X projection as guidance to PIFuHD (conceptual)
-            vertices, faces = self.pifuhd.predict(img_tensor)
-            
-            # 5. Export
-            glb_path = os.path.join(output_dir, "reconstruction.glb")
-            preview_path = os.path.join(output_dir, "preview.png")
-            
-            Exporter.save_glb(vertices, faces, glb_path)
-            Exporter.render_preview(vertices, faces, preview_path)
-            
+        # Only the GPU section is serialized: the next reconstruction (another task, or the
+        # next one on a solo worker once this returns) starts while these exports finish
+        with self._gpu_lock:
+            # Models stay resident; memory is only reclaimed under pressure (below)
+            with self.gpu_manager.execution_context("3D Reconstruction", cleanup=False):
+                device = self.device
+                
+                # 1. Get Models (loaded only on the first task in this process or after an eviction)
+                started_at = time.perf_counter()
+                pixie = self.registry.get("pixie", device)
+                pifuhd = self.registry.get("pifuhd", device)
+                load_s = time.perf_counter() - started_at
+                stage_started_at = time.perf_counter()
+                
+                # 2. Decode all views in parallel into one (N, 3, 512, 512) batch
+                views = load_views(image_paths, self.decode_executor, device=device)
+                end_stage("decode")
+                report("decode", num_views=len(image_paths))
+
+                with torch.inference_mode():
+                    # 3. Coarse Reconstruction (SMPL-X): per-view estimates fused into one body
+                    pixie_out = pixie.fuse(run_chunked(pixie.predict, views, self.max_batch_size))
+                    end_stage("pixie")
+                    # Written (and announced) on the export pool while PIFuHD runs
+                    smplx_future = self.export_executor.submit(write_smplx_mesh, *pixie.body_mesh(pixie_out))
+
+                    # 4. Fine Reconstruction (PIFuHD): per-view features fused before surface reconstruction
+                    # Pass SMPL-X projection as guidance to PIFuHD (conceptual)
+                    features = run_chunked(pifuhd.encode, views, self.max_batch_size)
+                    vertices, faces = pifuhd.reconstruct(pifuhd.fuse(features), surface_plan)
+                    end_stage("pifuhd")
+
+                # Everything the exports need, off the device
+                smplx_params = {k: v.cpu().numpy() for k, v in pixie_out.items()}
+                del views, features, pixie_out
+
+            # Evict under the lock: no other task is using the models here
+            self.registry.relieve_memory_pressure()
+
+        # Stage events stay in order: "pixie" is out once its mesh is written
+        smplx_future.result()
+        report("pifuhd", vertices=len(vertices), faces=len(faces))
+        
+        # 5. Export: GLB levels, preview and SMPL-X params concurrently, outside the GPU section
+        glb_path = paths["mesh_path"]
+        preview_path = paths["preview_path"]
+        params_path = paths["smplx_params_path"]
+        
+        export_started_at = time.perf_counter()
+        lods_future = self.export_executor.submit(
+            _timed, Exporter.save_lods, vertices, faces, glb_path,
+            ratios=settings.TRYON_3D_LOD_RATIOS,
+            quantize=settings.TRYON_3D_QUANTIZE_MESHES,
+        )
+        preview_future = self.export_executor.submit(_timed, Exporter.render_preview, vertices, faces, preview_path)
+        params_future = self.export_executor.submit(
+            _timed, Exporter.save_smplx_params, smplx_params, params_path, dtype=settings.TRYON_3D_SMPLX_DTYPE,
+        )
+
+        def finish_exports() -> dict:
+            # Reported in stage order whichever finishes first
+            lods, stage_s["export"] = lods_future.result()
+            report("export", artifacts={"mesh_path": glb_path, "lod_manifest_path": lods["manifest_path"]})
+            _, stage_s["preview"] = preview_future.result()
+            report("preview", artifacts={"preview_path": preview_path})
+            params_future.result()
+
             results = {
-                "mesh_path": glb_path,
-                "preview_path": preview_path,
-                "smplx_params": {k: v.cpu().numpy().tolist() for k, v in pixie_out.items()}
+                **paths,
+                "lod_manifest_path": lods["manifest_path"],
+                "num_views": len(image_paths),
+                "timings": {
+                    "model_load_s": load_s,
+                    "inference_s": stage_s["decode"] + stage_s["pixie"] + stage_s["pifuhd"],
+                    "export_s": time.perf_counter() - export_started_at,
+                    "stages_s": stage_s,
+                },
             }
-            
-        return results
 
+            timings = results["timings"]
+            logger.info(
+                f"Reconstruction timings: load {timings['model_load_s']:.2f}s, "
+                f"inference {timings['inference_s']:.2f}s, export {timings['export_s']:.2f}s"
+            )
+            return results
+
+        return self.finish_executor.submit(finish_exports)
+
+    def shutdown(self):
+        """
+        Waits for pending exports, then stops the pipeline's threads.
+        """
+        self.finish_executor.shutdown(wait=True)
+        self.export_executor.shutdown(wait=True)
+        self.decode_executor.shutdown(wait=True)
@@ -2,39 +2,313 @@ import trimesh
 import numpy as np
 import os
 import cv2
-from typing import Tuple
+import json
+import struct
+from typing import Any, Dict, List, Sequence, Tuple, Union
+from app.services.tryon_3d.lod import clean_mesh, decimate
+
+# Camera yaw in degrees for the named preview views, rotating about the vertical (y) axis
+PREVIEW_VIEWS: Dict[str, float] = {"front": 0.0, "right": 90.0, "back": 180.0, "left": 270.0}
+
+# Cross-shaped 3x3 footprint, the same one cv2.circle(radius=1, filled) draws
+_POINT_KERNEL = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+
+# Barycentric sample grids by subdivision level, shared across calls
+_barycentric_cache: Dict[int, np.ndarray] = {}
+
+def _barycentric_grid(n: int) -> np.ndarray:
+    """
+    (K, 3) barycentric weights of a regular grid with n steps per triangle edge.
+    """
+    grid = _barycentric_cache.get(n)
+    if grid is None:
+        i, j = np.meshgrid(np.arange(n + 1), np.arange(n + 1), indexing="ij")
+        keep = i + j <= n
+        u, v = i[keep] / n, j[keep] / n
+        grid = np.stack([1.0 - u - v, u, v], axis=1)
+        _barycentric_cache[n] = grid
+    return grid
+
+# glTF accessor component types
+_GL_BYTE, _GL_UNSIGNED_SHORT, _GL_UNSIGNED_INT, _GL_FLOAT = 5120, 5123, 5125, 5126
+_GL_ARRAY_BUFFER, _GL_ELEMENT_ARRAY_BUFFER = 34962, 34963
+
+def _pad4(data: bytes, fill: bytes = b"\x00") -> bytes:
+    return data + fill * (-len(data) % 4)
+
+def _glb_bytes(vertices: np.ndarray, faces: np.ndarray, normals: np.ndarray, quantize: bool) -> bytes:
+    """
+    Single-mesh GLB. Indices use 16 bits when the vertex count allows. With `quantize`,
+    positions are stored as 16-bit integers over the mesh bounds (dequantized by the node
+    transform) and normals as normalized bytes, per KHR_mesh_quantization.
+    """
+    lo, hi = vertices.min(axis=0), vertices.max(axis=0)
+    node: Dict[str, Any] = {"mesh": 0}
+    if quantize:
+        extent = np.maximum(hi - lo, 1e-12)
+        # Vertex attributes need 4-byte aligned strides, hence the padding component
+        positions = np.zeros((len(vertices), 4), dtype=np.uint16)
+        positions[:, :3] = np.rint((vertices - lo) / extent * 65535)
+        normal_data = np.zeros((len(normals), 4), dtype=np.int8)
+        normal_data[:, :3] = np.rint(np.clip(normals, -1, 1) * 127)
+        position_accessor = {"componentType": _GL_UNSIGNED_SHORT, "min": positions[:, :3].min(0).tolist(), "max": positions[:, :3].max(0).tolist()}
+        normal_accessor = {"componentType": _GL_BYTE, "normalized": True}
+        node.update(translation=lo.tolist(), scale=(extent / 65535).tolist())
+    else:
+        positions = vertices.astype(np.float32)
+        normal_data = normals.astype(np.float32)
+        position_accessor = {"componentType": _GL_FLOAT, "min": positions.min(0).tolist(), "max": positions.max(0).tolist()}
+        normal_accessor = {"componentType": _GL_FLOAT}
+
+    index_type = np.uint16 if len(vertices) <= 65535 else np.uint32
+    indices = faces.astype(index_type).ravel()
+
+    views = [
+        (positions.tobytes(), positions.strides[0], _GL_ARRAY_BUFFER),
+        (normal_data.tobytes(), normal_data.strides[0], _GL_ARRAY_BUFFER),
+        (indices.tobytes(), None, _GL_ELEMENT_ARRAY_BUFFER),
+    ]
+    binary, buffer_views = b"", []
+    for data, stride, target in views:
+        view = {"buffer": 0, "byteOffset": len(binary), "byteLength": len(data), "target": target}
+        if stride is not None:
+            view["byteStride"] = stride
+        buffer_views.append(view)
+        binary += _pad4(data)
+
+    gltf: Dict[str, Any] = {
+        "asset": {"version": "2.0", "generator": "virtual-wardrobe"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [node],
+        "meshes": [{"primitives": [{"attributes": {"POSITION": 0, "NORMAL": 1}, "indices": 2, "mode": 4}]}],
+        "accessors": [
+            {"bufferView": 0, "count": len(vertices), "type": "VEC3", **position_accessor},
+            {"bufferView": 1, "count": len(vertices), "type": "VEC3", **normal_accessor},
+            {"bufferView": 2, "count": len(indices), "type": "SCALAR",
+             "componentType": _GL_UNSIGNED_SHORT if index_type == np.uint16 else _GL_UNSIGNED_INT},
+        ],
+        "bufferViews": buffer_views,
+        "buffers": [{"byteLength": len(binary)}],
+    }
+    if quantize:
+        gltf["extensionsUsed"] = gltf["extensionsRequired"] = ["KHR_mesh_quantization"]
+
+    json_chunk = _pad4(json.dumps(gltf, separators=(",", ":")).encode(), b" ")
+    length = 12 + 8 + len(json_chunk) + 8 + len(binary)
+    return b"".join([
+        struct.pack("<4sII", b"glTF", 2, length),
+        struct.pack("<I4s", len(json_chunk), b"JSON"), json_chunk,
+        struct.pack("<I4s", len(binary), b"BIN\x00"), binary,
+    ])
 
 class Exporter:
     @staticmethod
-    def save_glb(vertices: np.ndarray, faces: np.ndarray, output_path: str):
+    def save_smplx_params(params: Dict[str, np.ndarray], output_path: str, dtype: str = "float32") -> str:
+        """
+        Writes SMPL-X parameters as an uncompressed .npz, one array per parameter in `dtype`
+        (float16 halves the size at ~1e-3 relative precision). Returns the path.
+        """
+        with open(output_path, "wb") as f:
+            np.savez(f, **{k: np.asarray(v, dtype=dtype) for k, v in params.items()})
+        return output_path
+
+    @staticmethod
+    def load_smplx_params(path: str) -> Dict[str, np.ndarray]:
+        with np.load(path) as data:
+            return {k: data[k].astype(np.float32) for k in data.files}
+
+    @staticmethod
+    def save_glb(vertices: np.ndarray, faces: np.ndarray, output_path: str, quantize: bool = False):
         """
-        Exports mesh to GLB format using trimesh.
+        Exports mesh to GLB format with smooth vertex normals and compact indices.
+        quantize=True stores 16-bit positions and 8-bit normals (KHR_mesh_quantization).
         """
-        mesh = trimesh.Trimesh(vertices=vertices, faces=faces)
-        mesh.export(output_path, file_type='glb')
+        mesh = trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+        with open(output_path, "wb") as f:
+            f.write(_glb_bytes(np.asarray(mesh.vertices), np.asarray(mesh.faces), np.asarray(mesh.vertex_normals), quantize))
         return output_path
 
     @staticmethod
-    def render_preview(vertices: np.ndarray, faces: np.ndarray, output_path: str) -> str:
+    def lod_manifest_path(output_path: str) -> str:
+        return f"{os.path.splitext(output_path)[0]}.lods.json"
+
+    @staticmethod
+    def save_lods(
+        vertices: np.ndarray,
+        faces: np.ndarray,
+        output_path: str,
+        ratios: Sequence[float] = (1.0, 0.25, 0.05),
+        quantize: bool = True,
+    ) -> Dict[str, Any]:
+        """
+        Cleans the mesh and writes one GLB per level of detail plus a JSON manifest, so a
+        viewer can fetch the coarsest level first and refine.
+
+        Level 0 (full detail) goes to `output_path` itself, level i to "<name>.lod<i>.glb"
+        next to it, each decimated from the previous one to `ratios[i]` of the full face
+        count. The manifest ("<name>.lods.json") lists levels coarsest first.
+        """
+        root, _ = os.path.splitext(output_path)
+        vertices, faces = clean_mesh(np.asarray(vertices, dtype=np.float64), np.asarray(faces, dtype=np.int64))
+        if len(faces) == 0:
+            raise ValueError("Mesh has no valid faces after cleanup")
+        full_faces = len(faces)
+
+        levels: List[Dict[str, Any]] = []
+        ratios = sorted(ratios, reverse=True)
+        for level, ratio in enumerate(ratios):
+            if level > 0:
+                vertices, faces = decimate(vertices, faces, ratio * full_faces / max(len(faces), 1))
+            path = output_path if level == 0 else f"{root}.lod{level}.glb"
+            Exporter.save_glb(vertices, faces, path, quantize=quantize)
+            levels.append({
+                "level": level,
+                "ratio": ratio,
+                "file": os.path.basename(path),
+                "vertices": int(len(vertices)),
+                "faces": int(len(faces)),
+                "bytes": os.path.getsize(path),
+            })
+
+        # "file" is relative: clients resolve it against the manifest's own URL
+        manifest = {"quantized": quantize, "lods": levels[::-1]}
+        manifest_path = Exporter.lod_manifest_path(output_path)
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        return {**manifest, "manifest_path": manifest_path}
+
+    @staticmethod
+    def _project(vertices: np.ndarray, yaw: float, resolution: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rotates the mesh by `yaw` degrees about y and maps x -> column, y -> row (as the
+        original preview did), scaled uniformly to fit the frame. Returns (pixel xy, depth).
+        """
+        theta = np.deg2rad(yaw)
+        c, s = np.cos(theta), np.sin(theta)
+        x = vertices[:, 0] * c + vertices[:, 2] * s
+        depth = vertices[:, 2] * c - vertices[:, 0] * s
+        xy = np.stack([x, vertices[:, 1]], axis=1)
+
+        lo, hi = xy.min(0), xy.max(0)
+        scale = (resolution - 1) / max(float((hi - lo).max()), 1e-6)
+        offset = ((resolution - 1) - (hi - lo) * scale) / 2 # Center the shorter axis
+        return (xy - lo) * scale + offset, depth
+
+    @staticmethod
+    def _splat_points(xy: np.ndarray, resolution: int) -> np.ndarray:
+        pixels = np.clip(np.rint(xy).astype(np.int64), 0, resolution - 1)
+        hits = np.bincount(pixels[:, 1] * resolution + pixels[:, 0], minlength=resolution * resolution)
+        mask = (hits > 0).astype(np.uint8).reshape(resolution, resolution) * 255
+        return cv2.dilate(mask, _POINT_KERNEL)
+
+    @staticmethod
+    def _rasterize_triangles(
+        vertices: np.ndarray,
+        faces: np.ndarray,
+        xy: np.ndarray,
+        depth: np.ndarray,
+        yaw: float,
+        resolution: int,
+    ) -> np.ndarray:
+        """
+        Z-buffered, flat-shaded triangles. Each triangle is sampled on a barycentric grid
+        dense enough for one sample per pixel along its longest edge; triangles are
+        bucketed by grid size so every bucket is one vectorized pass. The nearest sample
+        per pixel wins (np.maximum.at z-buffer).
+        """
+        tri_xy = xy[faces]  # (F, 3, 2)
+        tri_depth = depth[faces]  # (F, 3)
+
+        # Flat shading: headlight along the view direction, two-sided
+        a, b, c = vertices[faces[:, 0]], vertices[faces[:, 1]], vertices[faces[:, 2]]
+        normals = np.cross(b - a, c - a)
+        theta = np.deg2rad(yaw)
+        # Camera axis in model space: _project's depth is z*cos - x*sin
+        view_dir = np.array([-np.sin(theta), 0.0, np.cos(theta)])
+        norms = np.sqrt(np.einsum("ij,ij->i", normals, normals))
+        lambert = np.abs(normals @ view_dir) / np.maximum(norms, 1e-12)
+        shade = (40 + 215 * lambert).astype(np.uint8)
+
+        edges_sq = np.square(tri_xy - tri_xy[:, [1, 2, 0]]).sum(axis=2).max(axis=1)
+        # Power-of-two levels keep the number of buckets (and passes) small
+        levels = np.clip(2 ** np.ceil(0.5 * np.log2(np.maximum(edges_sq, 1.0))), 1, 2 * resolution).astype(np.int64)
+
+        # Sub-pixel triangles (the bulk of a dense mesh) are fully covered by their corners
+        vertex_pixel = np.clip(np.rint(xy).astype(np.int64), 0, resolution - 1)
+        vertex_pixel = vertex_pixel[:, 1] * resolution + vertex_pixel[:, 0]
+
+        pixel_chunks, depth_chunks, shade_chunks = [], [], []
+        for n in np.unique(levels):
+            idx = np.nonzero(levels == n)[0]
+            if n == 1:
+                pixel_chunks.append(vertex_pixel[faces[idx]].ravel())
+                depth_chunks.append(tri_depth[idx].ravel())
+                shade_chunks.append(np.repeat(shade[idx], 3))
+                continue
+            weights = _barycentric_grid(int(n))  # (K, 3)
+            samples = np.matmul(weights, tri_xy[idx])  # (F_n, K, 2)
+            pixels = np.clip(np.rint(samples).astype(np.int64), 0, resolution - 1)
+            pixel_chunks.append((pixels[..., 1] * resolution + pixels[..., 0]).ravel())
+            depth_chunks.append((tri_depth[idx] @ weights.T).ravel())
+            shade_chunks.append(np.repeat(shade[idx], len(weights)))
+
+        pixel = np.concatenate(pixel_chunks)
+        sample_depth = np.concatenate(depth_chunks)
+        sample_shade = np.concatenate(shade_chunks)
+
+        # Z-buffer: nearest sample (largest depth, camera on +z) per pixel
+        zbuffer = np.full(resolution * resolution, -np.inf)
+        np.maximum.at(zbuffer, pixel, sample_depth)
+        visible = sample_depth >= zbuffer[pixel]
+
+        img = np.zeros(resolution * resolution, dtype=np.uint8)
+        img[pixel[visible]] = sample_shade[visible]
+        return img.reshape(resolution, resolution)
+
+    @staticmethod
+    def rasterize(
+        vertices: np.ndarray,
+        faces: np.ndarray,
+        resolution: int = 256,
+        yaw: float = 0.0,
+        mode: str = "points",
+    ) -> np.ndarray:
+        """
+        Software render of one view as a (resolution, resolution) grayscale image.
+        mode: "points" splats every vertex, "mesh" rasterizes the triangles.
+        """
+        vertices = np.asarray(vertices, dtype=np.float64)
+        if len(vertices) == 0:
+            return np.zeros((resolution, resolution), dtype=np.uint8)
+        xy, depth = Exporter._project(vertices, yaw, resolution)
+        if mode == "points":
+            return Exporter._splat_points(xy, resolution)
+        if mode == "mesh":
+            faces = np.asarray(faces, dtype=np.int64)
+            if len(faces) == 0:
+                return Exporter._splat_points(xy, resolution)
+            return Exporter._rasterize_triangles(vertices, faces, xy, depth, yaw, resolution)
+        raise ValueError(f"Unsupported preview mode: {mode}")
+
+    @staticmethod
+    def render_preview(
+        vertices: np.ndarray,
+        faces: np.ndarray,
+        output_path: str,
+        resolution: int = 256,
+        views: Sequence[Union[str, float]] = ("front",),
+        mode: str = "points",
+    ) -> str:
         """
         Renders a simple preview of the mesh.
-        Using trimesh's scene or simple projection for speed.
-        """
-        # Create a scene
-        mesh = trimesh.Trimesh(vertices=vertices, faces=faces)
-        
-        # Simple orthographic projection for preview (mock render)
-        # In production, use pyrender for high quality offscreen rendering
-        
-        # Project to 2D
-        points = vertices[:, :2]
-        points = (points - points.min(0)) / (points.max(0) - points.min(0) + 1e-6)
-        points = (points * 255).astype(np.int32)
-        
-        img = np.zeros((256, 256, 3), dtype=np.uint8)
-        for p in points:
-            cv2.circle(img, (p[0], p[1]), 1, (255, 255, 255), -1)
-            
+        Vectorized software rasterizer (no GL context needed); several `views`, given as
+        names from PREVIEW_VIEWS or yaw angles, are rendered side by side into one image.
+        """
+        panels = [
+            Exporter.rasterize(vertices, faces, resolution, PREVIEW_VIEWS[v] if isinstance(v, str) else float(v), mode)
+            for v in views
+        ]
+        img = cv2.cvtColor(np.hstack(panels), cv2.COLOR_GRAY2BGR)
         cv2.imwrite(output_path, img)
         return output_path
-
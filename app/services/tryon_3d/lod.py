@@ -0,0 +1,141 @@
+import logging
+from typing import Tuple
+
+import numpy as np
+import trimesh
+
+logger = logging.getLogger(__name__)
+
+def clean_mesh(vertices: np.ndarray, faces: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merges duplicate vertices and drops degenerate faces, repeated faces and unreferenced
+    vertices. Vertices are then renumbered in order of first use so indices stay small
+    and local, which helps both GPU vertex caches and GLB compression.
+    """
+    mesh = trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+    mesh.merge_vertices()
+    mesh.update_faces(mesh.nondegenerate_faces())
+    mesh.update_faces(mesh.unique_faces())
+    mesh.remove_unreferenced_vertices()
+    return compact_indices(np.asarray(mesh.vertices), np.asarray(mesh.faces))
+
+def compact_indices(vertices: np.ndarray, faces: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Renumbers vertices in order of first reference by `faces`, dropping any never referenced.
+    """
+    if len(faces) == 0:
+        return vertices[:0], faces
+    flat = faces.ravel()
+    used, first_use = np.unique(flat, return_index=True)
+    order = used[np.argsort(first_use)]
+    remap = np.full(len(vertices), -1, dtype=np.int64)
+    remap[order] = np.arange(len(order))
+    return vertices[order], remap[faces]
+
+def _vertex_quadrics(vertices: np.ndarray, faces: np.ndarray) -> np.ndarray:
+    """
+    Area-weighted sum of the plane quadrics of the faces around each vertex, (V, 4, 4).
+    """
+    a, b, c = vertices[faces[:, 0]], vertices[faces[:, 1]], vertices[faces[:, 2]]
+    normals = np.cross(b - a, c - a)
+    double_area = np.linalg.norm(normals, axis=1)
+    normals = normals / np.maximum(double_area, 1e-12)[:, None]
+    planes = np.concatenate([normals, -(normals * a).sum(axis=1, keepdims=True)], axis=1)
+    face_quadrics = 0.5 * double_area[:, None, None] * planes[:, :, None] * planes[:, None, :]
+
+    quadrics = np.zeros((len(vertices), 4, 4))
+    for k in range(3):
+        np.add.at(quadrics, faces[:, k], face_quadrics)
+    return quadrics
+
+def _cluster(vertices: np.ndarray, cells_per_axis: int) -> Tuple[np.ndarray, int]:
+    lo, hi = vertices.min(axis=0), vertices.max(axis=0)
+    cell_size = max(float((hi - lo).max()), 1e-12) / cells_per_axis
+    cells = np.minimum(((vertices - lo) / cell_size).astype(np.int64), cells_per_axis - 1)
+    keys = (cells[:, 0] * cells_per_axis + cells[:, 1]) * cells_per_axis + cells[:, 2]
+    _, labels = np.unique(keys, return_inverse=True)
+    return labels.ravel(), int(labels.max()) + 1
+
+def _collapse_faces(faces: np.ndarray, labels: np.ndarray, count: int) -> np.ndarray:
+    """
+    Faces rewritten onto cluster ids, without the ones that collapsed or became duplicates.
+    """
+    clustered = labels[faces]
+    keep = (clustered[:, 0] != clustered[:, 1]) & (clustered[:, 1] != clustered[:, 2]) & (clustered[:, 0] != clustered[:, 2])
+    clustered = clustered[keep]
+    # Winding-independent key per face; fits in int64 for up to ~2M clusters
+    ordered = np.sort(clustered, axis=1)
+    keys = (ordered[:, 0] * count + ordered[:, 1]) * count + ordered[:, 2]
+    _, first = np.unique(keys, return_index=True)
+    return clustered[np.sort(first)]
+
+def decimate_clustering(vertices: np.ndarray, faces: np.ndarray, target_faces: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized quadric-error vertex clustering (Lindstrom, "Out-of-Core Simplification
+    of Large Polygonal Models"): vertices are snapped to a uniform grid sized by binary
+    search to land near `target_faces`, and each cell collapses to the point minimizing
+    the summed quadric error of its vertices. Much cheaper than edge collapse on large meshes.
+    """
+    if target_faces >= len(faces):
+        return vertices, faces
+
+    low, high = 2, 2048
+    best = None
+    while low <= high:
+        cells_per_axis = (low + high) // 2
+        labels, count = _cluster(vertices, cells_per_axis)
+        kept = _collapse_faces(faces, labels, count)
+        if len(kept) <= target_faces:
+            best = (labels, count, kept)
+            low = cells_per_axis + 1
+        else:
+            high = cells_per_axis - 1
+    if best is None:
+        labels, count = _cluster(vertices, 2)
+        best = (labels, count, _collapse_faces(faces, labels, count))
+    labels, count, kept = best
+
+    quadrics = np.zeros((count, 4, 4))
+    np.add.at(quadrics, labels, _vertex_quadrics(vertices, faces))
+    mean = np.zeros((count, 3))
+    np.add.at(mean, labels, vertices)
+    mean /= np.bincount(labels, minlength=count)[:, None]
+
+    # argmin x^T A x + 2 b^T x -> A x = -b; flat or rank-deficient cells fall back to the mean
+    A, b = quadrics[:, :3, :3], quadrics[:, :3, 3]
+    positions = mean.copy()
+    well_conditioned = np.linalg.cond(A) < 1e4
+    if well_conditioned.any():
+        positions[well_conditioned] = np.linalg.solve(A[well_conditioned], -b[well_conditioned][..., None])[..., 0]
+
+    # Keep each representative inside the bounds of the vertices it replaces
+    cell_lo = np.full((count, 3), np.inf)
+    cell_hi = np.full((count, 3), -np.inf)
+    np.minimum.at(cell_lo, labels, vertices)
+    np.maximum.at(cell_hi, labels, vertices)
+    positions = np.clip(positions, cell_lo, cell_hi)
+    return compact_indices(positions, kept)
+
+_clustering_logged = False
+
+def decimate(vertices: np.ndarray, faces: np.ndarray, ratio: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reduces the mesh to about `ratio` of its faces with quadric-error simplification:
+    edge collapse through trimesh when its backend is installed, quadric vertex
+    clustering otherwise. The backend isn't in requirements.txt: the pinned trimesh
+    (4.0.x) needs `open3d`, trimesh 4.1+ needs `fast_simplification`. The fallback is
+    logged once per process.
+    """
+    target_faces = max(4, int(len(faces) * ratio))
+    if ratio >= 1.0 or target_faces >= len(faces):
+        return vertices, faces
+    try:
+        mesh = trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+        simplified = mesh.simplify_quadric_decimation(face_count=target_faces)
+        return compact_indices(np.asarray(simplified.vertices), np.asarray(simplified.faces))
+    except ImportError as e:
+        global _clustering_logged
+        if not _clustering_logged:
+            logger.warning(f"Quadric decimation backend unavailable ({str(e)}); using vertex clustering for LODs")
+            _clustering_logged = True
+        return decimate_clustering(vertices, faces, target_faces)
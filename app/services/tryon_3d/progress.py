@@ -0,0 +1,110 @@
+"""
+Progress events of 3D reconstruction tasks, carried on one Redis stream per task.
+
+The worker appends an event per pipeline stage (with its timing and any partial
+artifacts) and the API relays them to clients over server-sent events, so clients
+don't have to poll the Celery result backend.
+"""
+import json
+import logging
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import redis
+from redis.asyncio import Redis
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages in the order they report
+STAGES = ("decode", "pixie", "pifuhd", "export", "preview")
+
+# Task-level events; the last two end the stream
+STARTED, STAGE, COMPLETED, FAILED = "started", "stage", "completed", "failed"
+TERMINAL_EVENTS = (COMPLETED, FAILED)
+
+# (stage, data) -> None; how the pipeline reports without knowing about Redis
+ProgressCallback = Callable[[str, Dict[str, Any]], None]
+
+def progress_stream_key(task_id: str) -> str:
+    return f"tryon3d:progress:{task_id}"
+
+class ProgressPublisher:
+    """
+    Appends a task's events to its stream from the (synchronous) Celery worker.
+
+    The stream is capped at `maxlen` entries and expires `ttl` seconds after the last
+    event. Publishing is best effort: a Redis outage is logged and never fails the task.
+    """
+
+    def __init__(self, client: redis.Redis, task_id: str, maxlen: int = 100, ttl: int = 3600):
+        self.client = client
+        self.key = progress_stream_key(task_id)
+        self.maxlen = maxlen
+        self.ttl = ttl
+        self.started_at = time.perf_counter()
+
+    def publish(self, event: str, **data: Any):
+        data["elapsed_s"] = round(time.perf_counter() - self.started_at, 3)
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.xadd(self.key, {"event": event, "data": json.dumps(data)}, maxlen=self.maxlen, approximate=True)
+            pipe.expire(self.key, self.ttl)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Could not publish {event} progress to {self.key}: {str(e)}")
+
+    def stage(self, stage: str, data: Dict[str, Any]):
+        self.publish(STAGE, stage=stage, progress=(STAGES.index(stage) + 1) / len(STAGES), **data)
+
+def format_sse(event_id: str, event: str, data: str) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+
+class ProgressReader:
+    """
+    Follows a task's stream from the API and renders it as server-sent events.
+    """
+
+    def __init__(self, client: Redis, block_ms: int = 15000):
+        self.client = client
+        self.block_ms = block_ms
+
+    async def events(self, task_id: str, last_event_id: str = "0-0") -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Yields {"id", "event", "data"} from after `last_event_id` until a terminal event.
+        Yields None whenever nothing arrived for `block_ms`, so callers can send keep-alives.
+        """
+        key = progress_stream_key(task_id)
+        while True:
+            response = await self.client.xread({key: last_event_id}, block=self.block_ms, count=100)
+            if not response:
+                yield None
+                continue
+            for entry_id, fields in response[0][1]:
+                last_event_id = entry_id
+                event = {"id": entry_id, "event": fields["event"], "data": fields["data"]}
+                yield event
+                if event["event"] in TERMINAL_EVENTS:
+                    return
+
+    async def sse(self, task_id: str, last_event_id: Optional[str] = None) -> AsyncIterator[str]:
+        async for event in self.events(task_id, last_event_id or "0-0"):
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield format_sse(event["id"], event["event"], event["data"])
+
+_reader: Optional[ProgressReader] = None
+
+def get_progress_reader() -> ProgressReader:
+    """
+    Process-wide reader for the API, created on first use.
+    """
+    global _reader
+    if _reader is None:
+        _reader = ProgressReader(
+            Redis.from_url(settings.REDIS_URL, decode_responses=True),
+            block_ms=int(settings.TRYON_3D_PROGRESS_KEEPALIVE_S * 1000),
+        )
+    return _reader
@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+import torch
+
+from app.services.tryon_3d.utils import GPUMemoryManager
+from app.services.tryon_3d.wrappers.models import ModelWrapper
+
+logger = logging.getLogger(__name__)
+
+class ModelRegistry:
+    """
+    Per-process cache of loaded reconstruction models.
+
+    A model is loaded the first time it's requested (or up front via `preload`) and then
+    reused by every later task in the worker process. Models are only unloaded, least
+    recently used first, when free GPU memory drops below `min_free_gpu_fraction`.
+    """
+
+    def __init__(self, factories: Dict[str, Callable[[], ModelWrapper]], min_free_gpu_fraction: float = 0.1):
+        self.factories = factories
+        self.min_free_gpu_fraction = min_free_gpu_fraction
+        self._models: "OrderedDict[str, ModelWrapper]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, name: str, device: str) -> ModelWrapper:
+        """
+        Returns the loaded model, loading it on a miss.
+        """
+        with self._lock:
+            model = self._models.get(name)
+            if model is not None and model.device == device:
+                self._models.move_to_end(name)
+                return model
+
+            started_at = time.perf_counter()
+            model = self.factories[name]()
+            model.load(device)
+            self._models[name] = model
+            self.loads += 1
+            logger.info(f"Loaded {name} on {device} in {time.perf_counter() - started_at:.2f}s")
+            return model
+
+    def preload(self, device: str) -> float:
+        """
+        Loads every registered model; returns the total load time in seconds.
+        """
+        started_at = time.perf_counter()
+        for name in self.factories:
+            self.get(name, device)
+        return time.perf_counter() - started_at
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    @staticmethod
+    def free_gpu_fraction() -> Optional[float]:
+        if not torch.cuda.is_available():
+            return None
+        free, total = torch.cuda.mem_get_info()
+        return free / total
+
+    def evict(self, name: str):
+        with self._lock:
+            model = self._models.pop(name, None)
+            if model is not None:
+                model.unload()
+                self.evictions += 1
+                logger.info(f"Evicted {name} from the model registry")
+
+    def evict_all(self):
+        for name in list(self._models):
+            self.evict(name)
+        GPUMemoryManager.cleanup()
+
+    def relieve_memory_pressure(self) -> int:
+        """
+        Evicts models, least recently used first, until enough GPU memory is free.
+        Returns how many were evicted; a no-op on CPU.
+        """
+        evicted = 0
+        fraction = self.free_gpu_fraction()
+        if fraction is None or fraction >= self.min_free_gpu_fraction:
+            return evicted
+
+        # Cached allocator blocks may be all that's needed
+        GPUMemoryManager.cleanup()
+        while self._models and self.free_gpu_fraction() < self.min_free_gpu_fraction:
+            self.evict(next(iter(self._models)))
+            GPUMemoryManager.cleanup()
+            evicted += 1
+        if evicted:
+            logger.warning(f"GPU memory pressure: evicted {evicted} model(s), {self.free_gpu_fraction():.0%} free")
+        return evicted
@@ -0,0 +1,204 @@
+"""
+Queue layout and routing of 3D reconstruction jobs.
+
+Jobs go to one queue per (class, GPU memory tier), e.g. "tryon3d.interactive.8g":
+
+- class: interactive jobs (estimated to finish quickly, e.g. low-resolution previews)
+  are consumed before batch jobs, so they never wait behind full reconstructions.
+- tier: the smallest GPU memory tier the job's estimated footprint fits in. A worker
+  consumes only the tiers its own memory can hold, so it never claims a job that
+  doesn't fit.
+
+Redis message priorities give per-user fairness: a user's job is queued behind other
+users' jobs by as many steps as that user already has running. Each class has its own
+band of priorities (interactive before batch), because kombu polls a priority level
+across all queues before the next level; within a level, QueueOrderCycle polls queues
+in worker_queues() order.
+"""
+import logging
+import math
+import os
+import shutil
+import subprocess
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import redis
+from kombu.utils.scheduling import priority_cycle
+from redis.asyncio import Redis
+
+from app.core.config import settings
+from app.services.tryon_3d.surface import BYTES_PER_GRID_POINT
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, BATCH = "interactive", "batch"
+JOB_CLASSES = (INTERACTIVE, BATCH)
+
+# Rough cost model; tune against the stage timings the pipeline reports
+MODEL_MEMORY_MB = 6144 # PIXIE + PIFuHD resident in fp32
+VIEW_MEMORY_MB = 512 # Activations per view in one model forward
+SECONDS_PER_VIEW = 1.0
+SURFACE_SECONDS_AT_256 = 2.0 # Surface extraction queries scale with the surface area, ~resolution^2
+
+# Redis message priorities (0 = first): one band per job class, one step per job the user already has running
+PRIORITY_STEPS = list(range(10))
+PRIORITY_BAND = len(PRIORITY_STEPS) // len(JOB_CLASSES)
+# How kombu's Redis transport names a queue's per-priority lists
+PRIORITY_SEP = "\x06\x16"
+
+@dataclass
+class JobCost:
+    num_views: int
+    surface_resolution: int
+    gpu_memory_mb: int
+    seconds: float
+
+def estimate_cost(num_views: int, surface_resolution: int) -> JobCost:
+    batch = min(num_views, settings.TRYON_3D_MAX_BATCH_SIZE)
+    dense_grid_mb = (surface_resolution + 1) ** 3 * BYTES_PER_GRID_POINT / (1024 * 1024)
+    memory_mb = MODEL_MEMORY_MB + batch * VIEW_MEMORY_MB + min(dense_grid_mb, settings.TRYON_3D_SURFACE_MAX_MEMORY_MB)
+    seconds = num_views * SECONDS_PER_VIEW + SURFACE_SECONDS_AT_256 * (surface_resolution / 256) ** 2
+    return JobCost(num_views, surface_resolution, int(math.ceil(memory_mb)), seconds)
+
+def queue_name(job_class: str, tier_gb: int) -> str:
+    return f"tryon3d.{job_class}.{tier_gb}g"
+
+def parse_queue(queue: str) -> Optional[Tuple[str, int]]:
+    """
+    (job class, tier in GB) of a queue named by queue_name(), else None.
+    """
+    prefix, _, rest = queue.partition(".")
+    job_class, _, tier = rest.partition(".")
+    if prefix != "tryon3d" or job_class not in JOB_CLASSES or not tier.endswith("g") or not tier[:-1].isdigit():
+        return None
+    return job_class, int(tier[:-1])
+
+def queue_rank(queue: str) -> Tuple[int, int]:
+    """
+    Drain order: interactive before batch, larger tiers first within a class, other queues last.
+    """
+    parsed = parse_queue(queue)
+    if parsed is None:
+        return len(JOB_CLASSES), 0
+    job_class, tier_gb = parsed
+    return JOB_CLASSES.index(job_class), -tier_gb
+
+class QueueOrderCycle(priority_cycle):
+    """
+    kombu queue cycle (the Redis transport's queue_order_strategy) that polls queues in
+    queue_rank order. The built-in strategies don't keep the order a worker selected its
+    queues in: kombu hands them over as a set, "sorted" goes by name (batch before
+    interactive, 16g before 8g) and "priority" by set iteration order.
+    """
+
+    def update(self, it):
+        self.items[:] = sorted(it, key=queue_rank)
+
+def all_queues(tiers_gb: Optional[Sequence[int]] = None) -> List[str]:
+    tiers_gb = tiers_gb or settings.TRYON_3D_GPU_TIERS_GB
+    return [queue_name(job_class, tier) for job_class in JOB_CLASSES for tier in sorted(tiers_gb)]
+
+def route(cost: JobCost, interactive: Optional[bool] = None, tiers_gb: Optional[Sequence[int]] = None) -> str:
+    """
+    Queue for a job: interactive when requested (or, by default, when it's estimated to
+    finish within TRYON_3D_INTERACTIVE_MAX_SECONDS), on the smallest tier that fits.
+    """
+    tiers_gb = sorted(tiers_gb or settings.TRYON_3D_GPU_TIERS_GB)
+    if interactive is None:
+        interactive = cost.seconds <= settings.TRYON_3D_INTERACTIVE_MAX_SECONDS
+    fitting = [tier for tier in tiers_gb if tier * 1024 >= cost.gpu_memory_mb]
+    if not fitting:
+        raise ValueError(f"Job needs ~{cost.gpu_memory_mb} MB, more than the largest tier ({tiers_gb[-1]} GB)")
+    return queue_name(INTERACTIVE if interactive else BATCH, fitting[0])
+
+def default_queue() -> str:
+    """
+    Where tasks enqueued without routing go: a default-sized batch job.
+    """
+    return route(estimate_cost(settings.TRYON_3D_MAX_BATCH_SIZE, settings.TRYON_3D_SURFACE_RESOLUTION), interactive=False)
+
+def fairness_priority(active_jobs: int, queue: str) -> int:
+    """
+    Message priority for a job on `queue` whose user already has `active_jobs` jobs:
+    within the band of the queue's class, so no batch job is polled before an interactive one.
+    """
+    job_class, _ = parse_queue(queue) or (BATCH, 0)
+    return JOB_CLASSES.index(job_class) * PRIORITY_BAND + min(active_jobs, PRIORITY_BAND - 1)
+
+def detect_capacity_mb() -> int:
+    """
+    Memory this worker offers jobs: TRYON_3D_WORKER_GPU_MEMORY_MB if set, else the GPU's
+    total memory (read through nvidia-smi so the parent process never initializes CUDA
+    before forking), else system RAM on CPU-only hosts.
+    """
+    if settings.TRYON_3D_WORKER_GPU_MEMORY_MB > 0:
+        return settings.TRYON_3D_WORKER_GPU_MEMORY_MB
+    if shutil.which("nvidia-smi"):
+        try:
+            output = subprocess.run(
+                ["nvidia-smi", "--query-gpu=memory.total", "--format=csv,noheader,nounits"],
+                capture_output=True, text=True, check=True, timeout=10,
+            ).stdout
+            return min(int(line) for line in output.split())
+        except (subprocess.SubprocessError, ValueError) as e:
+            logger.warning(f"Could not read GPU memory from nvidia-smi: {str(e)}")
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+
+def worker_queues(capacity_mb: int, tiers_gb: Optional[Sequence[int]] = None) -> List[str]:
+    """
+    Queues a worker with `capacity_mb` should consume, in the order it should drain
+    them: interactive before batch, and within a class the largest fitting tier first
+    so big workers take the jobs small ones can't.
+    """
+    tiers_gb = [tier for tier in tiers_gb or settings.TRYON_3D_GPU_TIERS_GB if tier * 1024 <= capacity_mb]
+    return sorted((queue_name(job_class, tier) for job_class in JOB_CLASSES for tier in tiers_gb), key=queue_rank)
+
+def user_jobs_key(user_id: str) -> str:
+    return f"tryon3d:user_jobs:{user_id}"
+
+def wait_times_key(queue: str) -> str:
+    return f"tryon3d:queue_wait:{queue}"
+
+def record_wait(client: redis.Redis, queue: str, enqueued_at: float, keep: int = 1000):
+    """
+    Stores how long a job waited in `queue`; the last `keep` waits back the metrics.
+    """
+    wait_ms = (time.time() - enqueued_at) * 1000.0
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.lpush(wait_times_key(queue), f"{wait_ms:.1f}")
+        pipe.ltrim(wait_times_key(queue), 0, keep - 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not record queue wait for {queue}: {str(e)}")
+
+async def queue_metrics(client: Redis, queues: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """
+    Per queue: pending jobs (across priority levels) and wait-time percentiles of recent jobs.
+    """
+    queues = queues or all_queues()
+    pipe = client.pipeline(transaction=False)
+    for queue in queues:
+        for priority in PRIORITY_STEPS:
+            pipe.llen(queue if priority == 0 else f"{queue}{PRIORITY_SEP}{priority}")
+        pipe.lrange(wait_times_key(queue), 0, -1)
+    responses = await pipe.execute()
+
+    metrics = {}
+    step = len(PRIORITY_STEPS) + 1
+    for i, queue in enumerate(queues):
+        depths, waits = responses[i * step:(i + 1) * step - 1], responses[(i + 1) * step - 1]
+        waits = np.array([float(w) for w in waits])
+        metrics[queue] = {
+            "depth": int(sum(depths)),
+            "wait_ms": {
+                "count": len(waits),
+                "p50": float(np.percentile(waits, 50)) if len(waits) else 0.0,
+                "p95": float(np.percentile(waits, 95)) if len(waits) else 0.0,
+                "max": float(waits.max()) if len(waits) else 0.0,
+            },
+        }
+    return metrics
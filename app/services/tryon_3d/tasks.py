@@ -1,31 +1,254 @@
+from celery.signals import worker_process_init, worker_process_shutdown, worker_shutdown
+from concurrent.futures import Future
+from app.core.config import settings
 from app.services.tryon_3d.worker import celery_app
-from app.services.tryon_3d.core import ReconstructionPipeline
+from app.services.tryon_3d.core import ReconstructionPipeline, model_factories, output_paths, reconstruction_key
+from app.services.tryon_3d.artifacts import ArtifactStore
+from app.services.tryon_3d.routing import estimate_cost, fairness_priority, record_wait, route, user_jobs_key
+from app.services.tryon_3d.registry import ModelRegistry
+from app.services.tryon_3d.progress import COMPLETED, FAILED, STARTED, ProgressPublisher
+from typing import Any, Dict, Optional
+from uuid import uuid4
+import functools
 import logging
+import threading
+import time
+import redis
 
 logger = logging.getLogger(__name__)
 
+# One pipeline (and set of loaded models) per worker process, reused by every task it runs
+_pipeline: Optional[ReconstructionPipeline] = None
+_pipeline_lock = threading.Lock()
+
+_redis: Optional[redis.Redis] = None
+
+def get_redis() -> redis.Redis:
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _redis
+
+_store: Optional[ArtifactStore] = None
+
+def get_artifact_store() -> Optional[ArtifactStore]:
+    global _store
+    if _store is None and settings.TRYON_3D_ARTIFACT_MAX_BYTES > 0:
+        _store = ArtifactStore(settings.TRYON_3D_ARTIFACT_DIR, settings.TRYON_3D_ARTIFACT_MAX_BYTES)
+    return _store
+
+def inflight_key(cache_key: str) -> str:
+    return f"tryon3d:inflight:{cache_key}"
+
+# Deletes the in-flight claim only if this task still holds it
+_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+def release_job(task_id: str, cache_key: Optional[str], user_id: Optional[str]):
+    """
+    Drops a job's in-flight claim (if it still holds it) and its slot in the user's job count.
+    """
+    try:
+        if cache_key is not None:
+            get_redis().eval(_RELEASE_SCRIPT, 1, inflight_key(cache_key), task_id)
+        if user_id is not None:
+            get_redis().decr(user_jobs_key(user_id))
+    except redis.RedisError as e:
+        logger.warning(f"Could not release job bookkeeping for task {task_id}: {str(e)}")
+
+def complete_reconstruction(
+    exports: "Future[dict]",
+    progress: ProgressPublisher,
+    store: Optional[ArtifactStore],
+    task_id: str,
+    cache_key: Optional[str],
+    user_id: Optional[str],
+):
+    """
+    Finishes a job once its exports are written: stores the result, publishes COMPLETED
+    (or FAILED) and releases the job.
+    """
+    try:
+        result = exports.result()
+        if store is not None:
+            result = store.put(cache_key, result)
+        progress.publish(COMPLETED, result=result, cached=False)
+    except Exception as e:
+        logger.error(f"Reconstruction export failed: {str(e)}")
+        progress.publish(FAILED, error=str(e))
+    finally:
+        # After the store write, so a new identical submission sees either the claim or the result
+        release_job(task_id, cache_key, user_id)
+
+def submit_reconstruction(
+    image_paths: list[str],
+    output_dir: str,
+    user_id: Optional[str] = None,
+    preview: bool = False,
+    interactive: Optional[bool] = None,
+) -> Dict[str, Any]:
+    """
+    Enqueues a reconstruction unless it isn't needed:
+
+    - "cached": the same views were already reconstructed with the current models;
+      the stored result is returned right away.
+    - "attached": an identical job is running; returns its task id, so the caller
+      follows that job's progress stream instead of enqueueing a duplicate.
+    - "queued": a new task was enqueued on the queue routing picked for its estimated
+      cost (see app.services.tryon_3d.routing), behind other users' jobs by as many
+      priority steps as `user_id` has jobs already queued or running.
+
+    `preview` reconstructs at TRYON_3D_PREVIEW_RESOLUTION; `interactive` overrides the
+    routing class, which otherwise follows the estimated runtime.
+    """
+    surface_resolution = settings.TRYON_3D_PREVIEW_RESOLUTION if preview else settings.TRYON_3D_SURFACE_RESOLUTION
+    cache_key = reconstruction_key(image_paths, surface_resolution)
+    store = get_artifact_store()
+    if store is not None:
+        cached = store.get(cache_key)
+        if cached is not None:
+            return {"status": "cached", "cache_key": cache_key, "result": cached}
+
+    client = get_redis()
+    # The claim can expire between SET and GET; claim again in that case
+    while True:
+        task_id = str(uuid4())
+        if client.set(inflight_key(cache_key), task_id, nx=True, ex=settings.TRYON_3D_INFLIGHT_TTL):
+            break
+        running = client.get(inflight_key(cache_key))
+        if running is not None:
+            return {"status": "attached", "cache_key": cache_key, "task_id": running}
+
+    counted_user = None
+    try:
+        queue = route(estimate_cost(len(image_paths), surface_resolution), interactive=interactive)
+        priority = fairness_priority(0, queue)
+        if user_id is not None:
+            pipe = client.pipeline(transaction=False)
+            pipe.incr(user_jobs_key(user_id))
+            pipe.expire(user_jobs_key(user_id), settings.TRYON_3D_INFLIGHT_TTL)
+            active_jobs = pipe.execute()[0] - 1
+            counted_user = user_id
+            priority = fairness_priority(max(active_jobs, 0), queue)
+
+        reconstruct_3d_task.apply_async(
+            (image_paths, output_dir),
+            {"cache_key": cache_key, "surface_resolution": surface_resolution, "user_id": user_id, "enqueued_at": time.time()},
+            task_id=task_id,
+            queue=queue,
+            priority=priority,
+        )
+    except Exception:
+        # Nothing was queued: don't leave identical submissions attached to it or the user's count raised
+        release_job(task_id, cache_key, counted_user)
+        raise
+    return {"status": "queued", "cache_key": cache_key, "task_id": task_id, "queue": queue, "priority": priority}
+
+def get_pipeline() -> ReconstructionPipeline:
+    global _pipeline
+    # Thread-pool workers run several tasks in one process; they must share one pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            registry = ModelRegistry(model_factories(), min_free_gpu_fraction=settings.TRYON_3D_MIN_FREE_GPU_FRACTION)
+            _pipeline = ReconstructionPipeline(registry)
+    return _pipeline
+
+@worker_process_init.connect
+def preload_models(**kwargs):
+    """
+    Loads the models once per worker process, before it takes its first task.
+    """
+    if not settings.TRYON_3D_PRELOAD_MODELS:
+        return
+    try:
+        pipeline = get_pipeline()
+        load_s = pipeline.registry.preload(pipeline.device)
+        logger.info(f"Preloaded reconstruction models on {pipeline.device} in {load_s:.2f}s")
+    except Exception as e:
+        # Tasks will retry the load on demand
+        logger.error(f"Model preload failed: {str(e)}")
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def release_models(**kwargs):
+    if _pipeline is not None:
+        # Tasks return before their exports are written; finish those first
+        _pipeline.shutdown()
+        _pipeline.registry.evict_all()
+
 @celery_app.task(bind=True, name="reconstruct_3d")
-def reconstruct_3d_task(self, image_paths: list[str], output_dir: str):
+def reconstruct_3d_task(
+    self,
+    image_paths: list[str],
+    output_dir: str,
+    cache_key: Optional[str] = None,
+    surface_resolution: Optional[int] = None,
+    user_id: Optional[str] = None,
+    enqueued_at: Optional[float] = None,
+):
     """
-    Celery task wrapper for 3D reconstruction.
+    Celery task wrapper for 3D reconstruction. Progress is published to the task's
+    Redis stream (see app.services.tryon_3d.progress) as each stage finishes.
+
+    Results are kept in the artifact store under `cache_key` (computed here when the
+    task wasn't enqueued through submit_reconstruction); a stored result is returned
+    without running the pipeline.
+
+    The task returns once inference is done, so the worker takes its next task while the
+    exports are written. Its result already lists every artifact path ("exporting": the
+    files are still being filled in); COMPLETED on the stream says they're all there, with
+    the stored copies' paths when the artifact store is enabled.
     """
+    if enqueued_at is not None:
+        record_wait(get_redis(), (self.request.delivery_info or {}).get("routing_key") or "unrouted", enqueued_at)
+    progress = ProgressPublisher(
+        get_redis(), self.request.id,
+        maxlen=settings.TRYON_3D_PROGRESS_MAXLEN, ttl=settings.TRYON_3D_PROGRESS_TTL,
+    )
+    store = get_artifact_store()
+    exports = None
     try:
         logger.info(f"Starting reconstruction for {len(image_paths)} images")
+        progress.publish(STARTED, num_views=len(image_paths))
+
+        if store is not None:
+            cache_key = cache_key or reconstruction_key(image_paths, surface_resolution)
+            cached = store.get(cache_key)
+            if cached is not None:
+                logger.info(f"Reconstruction {cache_key[:12]} served from the artifact store")
+                progress.publish(COMPLETED, result=cached, cached=True)
+                return {"status": "success", "cached": True, "result": cached}
         
-        # Instantiate pipeline inside task to ensure fresh GPU state
-        pipeline = ReconstructionPipeline()
-        result = pipeline.process_images(image_paths, output_dir)
+        # Models stay loaded across tasks; GPU memory is reclaimed by the registry under pressure
+        pipeline = get_pipeline()
+        exports = pipeline.reconstruct(
+            image_paths, output_dir, progress=progress.stage, surface_resolution=surface_resolution,
+        )
+        # Runs after the task has returned, when self.request no longer describes it
+        exports.add_done_callback(
+            functools.partial(complete_reconstruction, progress=progress, store=store, task_id=self.request.id, cache_key=cache_key, user_id=user_id)
+        )
         
         return {
-            "status": "success",
-            "result": result
+            "status": "exporting",
+            "cached": False,
+            "result": {**output_paths(output_dir), "num_views": len(image_paths)},
         }
         
     except Exception as e:
         logger.error(f"Reconstruction failed: {str(e)}")
+        progress.publish(FAILED, error=str(e))
         # Clean up if needed
         return {
             "status": "failed",
             "error": str(e)
         }
 
+    finally:
+        if exports is None:
+            # Otherwise released by complete_reconstruction
+            release_job(self.request.id, cache_key, user_id)
@@ -1,7 +1,10 @@
 import torch
 import gc
 import logging
-from typing import Optional, Any
+import cv2
+import numpy as np
+from concurrent.futures import Executor
+from typing import Optional, Any, Callable, Sequence
 from contextlib import contextmanager
 
 logger = logging.getLogger(__name__)
@@ -27,7 +30,11 @@ class GPUMemoryManager:
             logger.info(f"GPU Memory Reserved: {torch.cuda.memory_reserved() / 1024**2:.2f} MB")
 
     @contextmanager
-    def execution_context(self, task_name: str):
+    def execution_context(self, task_name: str, cleanup: bool = True):
+        """
+        cleanup=False skips the forced gc/cache flush afterwards, for callers that keep
+        models resident between tasks and manage memory pressure themselves.
+        """
         self.log_memory_stats()
         logger.info(f"Starting GPU task: {task_name}")
         try:
@@ -37,6 +44,48 @@ class GPUMemoryManager:
             raise
         finally:
             logger.info(f"Finishing GPU task: {task_name}")
-            self.cleanup()
+            if cleanup:
+                self.cleanup()
             self.log_memory_stats()
 
+
+def load_view(path: str, size: int = 512) -> np.ndarray:
+    """
+    Decodes one photo into a (3, size, size) float32 RGB array in [-1, 1].
+    The image is letterboxed to a square so the body keeps its aspect ratio.
+    """
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f"Could not decode image: {path}")
+
+    h, w = img.shape[:2]
+    scale = size / max(h, w)
+    resized = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    canvas = np.zeros((size, size, 3), dtype=np.uint8)
+    top, left = (size - resized.shape[0]) // 2, (size - resized.shape[1]) // 2
+    canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+
+    # BGR -> RGB, HWC -> CHW, [0, 255] -> [-1, 1]
+    return np.ascontiguousarray(canvas[:, :, ::-1].transpose(2, 0, 1), dtype=np.float32) / 127.5 - 1.0
+
+def load_views(image_paths: Sequence[str], executor: Executor, size: int = 512, device: str = "cpu") -> torch.Tensor:
+    """
+    Decodes all views in parallel and stacks them into one (N, 3, size, size) batch on `device`.
+    """
+    views = list(executor.map(lambda path: load_view(path, size), image_paths))
+    batch = torch.from_numpy(np.stack(views))
+    if device.startswith("cuda"):
+        batch = batch.pin_memory().to(device, non_blocking=True)
+    return batch
+
+def run_chunked(fn: Callable[[torch.Tensor], Any], batch: torch.Tensor, max_batch_size: int) -> Any:
+    """
+    Runs `fn` over `batch` in chunks of at most `max_batch_size` and concatenates the
+    results along dim 0. `fn` may return a tensor or a dict of tensors.
+    """
+    outputs = [fn(chunk) for chunk in torch.split(batch, max(1, max_batch_size))]
+    if len(outputs) == 1:
+        return outputs[0]
+    if isinstance(outputs[0], dict):
+        return {k: torch.cat([o[k] for o in outputs]) for k in outputs[0]}
+    return torch.cat(outputs)
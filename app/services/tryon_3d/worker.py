@@ -1,6 +1,12 @@
 import os
+import logging
 from celery import Celery
+from celery.signals import celeryd_after_setup
+from kombu import Queue
 from app.core.config import settings
+from app.services.tryon_3d.routing import PRIORITY_STEPS, all_queues, default_queue, detect_capacity_mb, worker_queues
+
+logger = logging.getLogger(__name__)
 
 # Redis connection
 redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
@@ -20,6 +26,30 @@ celery_app.conf.update(
     enable_utc=True,
     # Worker optimization
     worker_prefetch_multiplier=1, # One task at a time per worker (heavy GPU usage)
-    worker_max_tasks_per_child=10, # Restart worker after 10 tasks to prevent leaks
+    # Models stay resident between tasks, so recycle on memory growth rather than task count (KiB)
+    worker_max_memory_per_child=settings.TRYON_3D_WORKER_MAX_MEMORY_MB * 1024,
+    # Interactive/batch queues per GPU memory tier (see routing.py)
+    task_queues=[Queue(name) for name in all_queues()],
+    task_default_queue=default_queue(),
+    # Priorities order classes and users' jobs; within a priority, queues are polled in worker_queues() order
+    broker_transport_options={
+        "priority_steps": PRIORITY_STEPS,
+        "queue_order_strategy": "app.services.tryon_3d.routing:QueueOrderCycle",
+    },
 )
 
+@celeryd_after_setup.connect
+def select_queues(sender, instance, **kwargs):
+    """
+    Consumes only the queues whose jobs fit this worker's memory, interactive first.
+    Runs after -Q is applied, so an explicit queue list narrows the selection further.
+    """
+    capacity_mb = detect_capacity_mb()
+    queues = instance.app.amqp.queues
+    selected = set(queues.consume_from)
+    fitting = [name for name in worker_queues(capacity_mb) if name in selected]
+    if not fitting:
+        raise RuntimeError(f"No 3D queue fits this worker ({capacity_mb} MB) among {sorted(selected)}")
+    queues.select(fitting)
+    logger.info(f"Worker capacity {capacity_mb} MB, consuming {', '.join(fitting)}")
+
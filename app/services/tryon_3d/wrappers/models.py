@@ -1,7 +1,10 @@
 import torch
 import numpy as np
+import trimesh
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.services.tryon_3d.surface import SurfacePlan, extract_surface, plan_extraction
 
 class ModelWrapper(ABC):
     @abstractmethod
@@ -12,6 +15,11 @@ class ModelWrapper(ABC):
     def predict(self, input_data: Any) -> Any:
         pass
 
+    def unload(self):
+        """Drops the weights so their memory can be reclaimed."""
+        self.model = None
+        self.device = None
+
 class PixieWrapper(ModelWrapper):
     def __init__(self, checkpoint_path: str):
         self.checkpoint_path = checkpoint_path
@@ -44,6 +52,31 @@ class PixieWrapper(ModelWrapper):
             "cam": torch.zeros((batch_size, 3), device=self.device)
         }
 
+    @staticmethod
+    def fuse(outputs: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        """
+        Fuses per-view estimates of one person into a single (1, ...) parameter set.
+        Body shape and expression don't depend on the viewpoint, so they're averaged
+        across views; pose and camera are taken from the first (primary) view.
+        """
+        return {
+            k: v.mean(dim=0, keepdim=True) if k in ("betas", "expression") else v[:1]
+            for k, v in outputs.items()
+        }
+
+    def body_mesh(self, params: Dict[str, torch.Tensor]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Posed SMPL-X body surface (vertices, faces) for one fused parameter set.
+        Coarse, but available long before the PIFuHD reconstruction.
+        """
+        if self.device is None:
+            raise RuntimeError("Model not loaded")
+        # Mock body (real impl: smplx.create(...)(betas=..., expression=..., body_pose=...).vertices)
+        mesh = trimesh.creation.icosphere(subdivisions=3)
+        height = 1.0 + 0.01 * float(params["betas"][0, 0])
+        vertices = mesh.vertices * np.array([0.35, 0.9 * height, 0.2])
+        return vertices.astype(np.float32), mesh.faces.astype(np.int32)
+
 class PifuhdWrapper(ModelWrapper):
     def __init__(self, checkpoint_path: str):
         self.checkpoint_path = checkpoint_path
@@ -58,15 +91,44 @@ class PifuhdWrapper(ModelWrapper):
         # self.model.load_state_dict(...)
         print(f"Loading PIFuHD from {self.checkpoint_path} to {device}")
 
+    def encode(self, image_tensor: torch.Tensor) -> torch.Tensor:
+        """
+        Per-view image features, (B, C, H, W) -> (B, C_feat, H/4, W/4).
+        """
+        if self.device is None:
+            raise RuntimeError("Model not loaded")
+        # Mock feature extraction (real impl: self.model.filter(image_tensor))
+        return torch.nn.functional.avg_pool2d(image_tensor, 4)
+
+    @staticmethod
+    def fuse(features: torch.Tensor) -> torch.Tensor:
+        """
+        Multi-view feature fusion: average pooling over views, (N, ...) -> (1, ...).
+        """
+        return features.mean(dim=0, keepdim=True)
+
     def predict(self, image_tensor: torch.Tensor) -> np.ndarray:
         """
-        Reconstruct fine details. Returns mesh vertices/faces or volume.
-        Here we return dummy vertices/faces for scaffolding.
+        Reconstruct fine details from one or more views of the same person.
+        Returns mesh vertices/faces or volume.
         """
-        # Mock mesh generation
-        num_verts = 1000
-        vertices = np.random.rand(num_verts, 3).astype(np.float32)
-        faces = np.random.randint(0, num_verts, (2000, 3)).astype(np.int32)
-        
-        return vertices, faces
+        return self.reconstruct(self.fuse(self.encode(image_tensor)))
 
+    def query(self, features: torch.Tensor, points: np.ndarray) -> np.ndarray:
+        """
+        Occupancy in [0, 1] at (N, 3) points of the [-1, 1]^3 volume, conditioned on the fused features.
+        """
+        if self.device is None:
+            raise RuntimeError("Model not loaded")
+        # Mock implicit function: a smooth upright ellipsoid
+        # (real impl: self.model.query(points projected into the views, features))
+        d = (points[:, 0] / 0.35) ** 2 + (points[:, 1] / 0.9) ** 2 + (points[:, 2] / 0.2) ** 2
+        return (1.0 / (1.0 + np.exp(np.clip((d - 1.0) * 20.0, -50.0, 50.0)))).astype(np.float32)
+
+    def reconstruct(self, features: torch.Tensor, plan: Optional[SurfacePlan] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Surface reconstruction from fused features: chunked, coarse-to-fine marching cubes
+        over the occupancy field, so memory stays bounded by `plan` at any resolution.
+        """
+        plan = plan or plan_extraction(256, 2048)
+        return extract_surface(lambda points: self.query(features, points), plan)
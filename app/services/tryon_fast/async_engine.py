@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from fastapi import status
+from redis.asyncio import Redis
+
+from app.core.config import settings
+from app.core.exceptions import ServiceException
+from app.services.tryon_fast.batching import MicroBatcher
+from app.services.tryon_fast.cache import (
+    DiskResultStore,
+    MemoryLRUCache,
+    RedisResultStore,
+    ResultCache,
+    file_digest,
+    result_cache_key,
+)
+from app.services.tryon_fast.core import TryOnEngine, variant_model_path
+from app.services.tryon_fast.pool import EnginePool
+
+logger = logging.getLogger(__name__)
+
+def plan_threads(workers: int = 0, cores: Optional[int] = None) -> Tuple[int, int]:
+    """
+    Splits the available cores between executor workers and ORT intra-op threads.
+    Returns (workers, intra_op_threads) with workers * intra_op_threads <= cores.
+    """
+    if cores is None:
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    if workers <= 0:
+        # Enough workers to overlap decode/encode with inference without starving ORT
+        workers = max(1, min(4, cores // 2))
+    workers = min(workers, cores)
+    return workers, max(1, cores // workers)
+
+class AsyncTryOnEngine:
+    """
+    Event-loop friendly wrapper around TryOnEngine.
+
+    CPU-bound stages (decode, resize, inference, encode) run on a bounded thread pool
+    sized to the cores, and the underlying ORT session gets an intra-op thread count
+    that leaves room for that pool. With `sessions` > 1 the cores are instead split
+    between an EnginePool of independent sessions. Once `max_pending` requests are
+    queued or running, new ones fail fast with a 503 instead of queueing without bound.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        device_id: int = 0,
+        workers: int = settings.TRYON_WORKERS,
+        max_pending: int = settings.TRYON_MAX_PENDING,
+        max_batch_size: int = settings.TRYON_MAX_BATCH_SIZE,
+        max_wait_ms: float = settings.TRYON_MAX_BATCH_WAIT_MS,
+        cache: Optional[ResultCache] = None,
+        batch_buckets: Sequence[int] = settings.TRYON_BATCH_BUCKETS,
+        optimized_model_path: Optional[str] = settings.TRYON_OPTIMIZED_MODEL_PATH,
+        sessions: int = settings.TRYON_SESSIONS,
+        pool_mode: str = settings.TRYON_POOL_MODE,
+        numa_pinning: bool = settings.TRYON_NUMA_PINNING,
+    ):
+        self.workers, intra_op_threads = plan_threads(workers)
+        self.max_pending = max_pending
+        self.pending = 0
+
+        engine_kwargs = dict(
+            device_id=device_id,
+            encode_threads=intra_op_threads,
+            # Never pad past what the batcher can produce
+            batch_buckets=[b for b in batch_buckets if b <= max(1, max_batch_size)],
+            optimized_model_path=optimized_model_path,
+        )
+        if sessions > 1:
+            # Every session needs at least one worker driving it; the cores are split evenly
+            cores = self.workers * intra_op_threads
+            self.workers = max(self.workers, sessions)
+            intra_op_threads = max(1, cores // sessions)
+            self.engine: Union[TryOnEngine, EnginePool] = EnginePool(
+                model_path,
+                sessions,
+                threads_per_session=intra_op_threads,
+                mode=pool_mode,
+                numa_pinning=numa_pinning,
+                contexts_per_batch_size=-(-self.workers // sessions),
+                **engine_kwargs,
+            )
+        else:
+            self.engine = TryOnEngine(
+                model_path,
+                contexts_per_batch_size=self.workers,
+                intra_op_threads=intra_op_threads,
+                inter_op_threads=1,
+                **engine_kwargs,
+            )
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tryon")
+
+        # Results are only reusable for the exact same weights
+        self.cache = cache
+        self.model_digest = file_digest(model_path) if cache is not None else None
+
+        # Batching only pays off when more than one request can share a call
+        self.batcher: Optional[MicroBatcher] = None
+        if max_batch_size > 1:
+            self.batcher = MicroBatcher(
+                self.engine,
+                max_batch_size,
+                max_wait_ms,
+                executor=self.executor,
+                max_concurrent_batches=self.workers,
+            )
+
+        logger.info(
+            f"Try-on engine loaded: {self.workers} workers, {sessions} session(s) x {intra_op_threads} ORT threads, "
+            f"max pending {self.max_pending}, max batch {max_batch_size}"
+        )
+
+    async def process_async(
+        self,
+        person_mask: Union[bytes, np.ndarray],
+        garment_mask: Union[bytes, np.ndarray],
+        garment_texture: Union[bytes, np.ndarray],
+        pose_keypoints: np.ndarray,
+        output_format: str = "png",
+        quality: Optional[int] = None,
+    ) -> Union[bytes, memoryview]:
+        """
+        Async counterpart of TryOnEngine.process. Raises ServiceException(503) when saturated.
+        Repeated inputs are served from the result cache without running inference.
+        """
+        cache_key = None
+        # Raw buffers are for in-process callers; not worth a copy into the cache
+        if self.cache is not None and output_format != "raw":
+            cache_key = result_cache_key(
+                self.model_digest, person_mask, garment_mask, garment_texture, pose_keypoints,
+                output_format=output_format, quality=quality,
+            )
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        result = await self._infer(person_mask, garment_mask, garment_texture, pose_keypoints, output_format, quality)
+        if cache_key is not None:
+            await self.cache.set(cache_key, result)
+        return result
+
+    async def _infer(
+        self,
+        person_mask: Union[bytes, np.ndarray],
+        garment_mask: Union[bytes, np.ndarray],
+        garment_texture: Union[bytes, np.ndarray],
+        pose_keypoints: np.ndarray,
+        output_format: str,
+        quality: Optional[int],
+    ) -> Union[bytes, memoryview]:
+        if self.pending >= self.max_pending:
+            raise ServiceException("Try-on service is at capacity, retry later", status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        self.pending += 1
+        try:
+            if self.batcher is not None:
+                return await self.batcher.submit(
+                    person_mask, garment_mask, garment_texture, pose_keypoints, output_format, quality
+                )
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, self.engine.process,
+                person_mask, garment_mask, garment_texture, pose_keypoints, output_format, quality,
+            )
+        finally:
+            self.pending -= 1
+
+    @property
+    def ready(self) -> bool:
+        return self.engine.ready
+
+    async def warmup(self):
+        """
+        Warms every batch bucket on the worker pool without blocking the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.engine.warmup)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "startup": self.engine.startup_stats(),
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "workers": self.workers,
+            "sessions": self.engine.stats() if isinstance(self.engine, EnginePool) else None,
+            "batching": self.batcher.stats.snapshot() if self.batcher is not None else None,
+            "cache": self.cache.snapshot() if self.cache is not None else None,
+        }
+
+    async def close(self):
+        if self.batcher is not None:
+            await self.batcher.stop()
+        self.executor.shutdown(wait=False)
+        if isinstance(self.engine, EnginePool):
+            self.engine.close()
+
+def build_result_cache() -> Optional[ResultCache]:
+    """
+    Result cache configured from settings, or None when disabled.
+    """
+    if settings.TRYON_CACHE_MAX_BYTES <= 0:
+        return None
+
+    backend = None
+    if settings.TRYON_CACHE_BACKEND == "redis":
+        # Binary values: no response decoding
+        backend = RedisResultStore(Redis.from_url(settings.REDIS_URL), ttl=settings.TRYON_CACHE_TTL)
+    elif settings.TRYON_CACHE_BACKEND == "disk":
+        backend = DiskResultStore(settings.TRYON_CACHE_DIR, max_bytes=settings.TRYON_CACHE_DISK_MAX_BYTES)
+    return ResultCache(MemoryLRUCache(settings.TRYON_CACHE_MAX_BYTES), backend)
+
+_engine_lock = threading.Lock()
+
+@lru_cache()
+def _build_tryon_engine() -> AsyncTryOnEngine:
+    model_path = variant_model_path(settings.TRYON_MODEL_PATH, settings.TRYON_MODEL_VARIANT)
+    return AsyncTryOnEngine(model_path, cache=build_result_cache())
+
+def get_tryon_engine() -> AsyncTryOnEngine:
+    """
+    Process-wide engine, created on first use.
+    """
+    # Startup warm-up and early requests may race to create it
+    with _engine_lock:
+        try:
+            return _build_tryon_engine()
+        except FileNotFoundError as e:
+            raise ServiceException(str(e), status_code=status.HTTP_503_SERVICE_UNAVAILABLE) from e
+
+def tryon_model_configured() -> bool:
+    """
+    Whether the configured try-on model exists, i.e. the engine can be built at all.
+    """
+    return os.path.exists(variant_model_path(settings.TRYON_MODEL_PATH, settings.TRYON_MODEL_VARIANT))
+
+def is_tryon_engine_ready() -> bool:
+    """
+    Readiness check: the engine exists and has finished warming up.
+    """
+    return _build_tryon_engine.cache_info().currsize > 0 and _build_tryon_engine().ready
+
+async def warmup_tryon_engine():
+    """
+    Loads the engine and warms it up so the first real requests don't pay for it.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        engine = await loop.run_in_executor(None, get_tryon_engine)
+        await engine.warmup()
+    except ServiceException as e:
+        logger.warning(f"Try-on engine unavailable, skipping warm-up: {e.message}")
+    except Exception as e:
+        logger.error(f"Try-on engine warm-up failed: {str(e)}")
+
+_warmup_task: Optional[asyncio.Task] = None
+
+async def start_tryon_warmup():
+    """
+    Startup hook: warm up in the background so the app starts serving (and reporting
+    not-ready on /ready) immediately.
+    """
+    global _warmup_task
+    _warmup_task = asyncio.create_task(warmup_tryon_engine())
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.tryon_fast.core import TryOnEngine, TryOnRequest
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class _PendingRequest:
+    request: TryOnRequest
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+@dataclass
+class BatchStats:
+    """
+    Running counters for the micro-batcher.
+    Fill ratio = batch size / max batch size; queueing delay = submit -> dispatch.
+    """
+    batches: int = 0
+    items: int = 0
+    fill_ratio_sum: float = 0.0
+    queue_delay_ms_sum: float = 0.0
+    max_queue_delay_ms: float = 0.0
+    last_fill_ratio: float = 0.0
+    last_queue_delay_ms: float = 0.0
+
+    def record(self, batch_size: int, max_batch_size: int, queue_delays_ms: List[float]):
+        self.batches += 1
+        self.items += batch_size
+        self.last_fill_ratio = batch_size / max_batch_size
+        self.fill_ratio_sum += self.last_fill_ratio
+        self.last_queue_delay_ms = max(queue_delays_ms)
+        self.queue_delay_ms_sum += sum(queue_delays_ms)
+        self.max_queue_delay_ms = max(self.max_queue_delay_ms, self.last_queue_delay_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "avg_fill_ratio": self.fill_ratio_sum / self.batches if self.batches else 0.0,
+            "avg_queue_delay_ms": self.queue_delay_ms_sum / self.items if self.items else 0.0,
+            "max_queue_delay_ms": self.max_queue_delay_ms,
+            "last_fill_ratio": self.last_fill_ratio,
+            "last_queue_delay_ms": self.last_queue_delay_ms,
+        }
+
+class MicroBatcher:
+    """
+    Async front-end for TryOnEngine that coalesces concurrent requests.
+
+    Requests are queued and dispatched as one batch when either `max_batch_size`
+    items are waiting or `max_wait_ms` has elapsed since the oldest item arrived.
+    A single ONNX call serves the whole batch and each caller's future receives
+    its own encoded image. Raising `max_wait_ms` trades p50 latency for throughput.
+    """
+
+    def __init__(
+        self,
+        engine: TryOnEngine,
+        max_batch_size: int = settings.TRYON_MAX_BATCH_SIZE,
+        max_wait_ms: float = settings.TRYON_MAX_BATCH_WAIT_MS,
+        executor: Optional[Executor] = None,
+        max_concurrent_batches: int = 1,
+    ):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.executor = executor
+        self.max_concurrent_batches = max_concurrent_batches
+        self.stats = BatchStats()
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def start(self):
+        # The queue and worker belong to the loop that started them; rebuild them
+        # if we're now running on a different one (e.g. a fresh loop per test client)
+        if self._worker is not None and self._worker.get_loop() is not asyncio.get_running_loop():
+            self._worker = None
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(
+        self,
+        person_mask: Union[bytes, np.ndarray],
+        garment_mask: Union[bytes, np.ndarray],
+        garment_texture: Union[bytes, np.ndarray],
+        pose_keypoints: np.ndarray,
+        output_format: str = "png",
+        quality: Optional[int] = None,
+    ) -> Union[bytes, memoryview]:
+        """
+        Enqueues one try-on request and waits for its result.
+        """
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        request = TryOnRequest(person_mask, garment_mask, garment_texture, pose_keypoints, output_format, quality)
+        await self._queue.put(_PendingRequest(request, future))
+        return await future
+
+    async def _collect(self) -> List[_PendingRequest]:
+        first = await self._queue.get()
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait_ms / 1000.0
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                # Still drain whatever is already queued without waiting
+                if self._queue.empty():
+                    break
+                batch.append(self._queue.get_nowait())
+                continue
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            # Only start collecting once a batch slot is free, so requests keep
+            # accumulating (and batches fill up) while all slots are busy
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            # Callers that gave up while queued don't need a slot in the batch
+            batch = [item for item in batch if not item.future.done()]
+            if not batch:
+                self._slots.release()
+                continue
+            asyncio.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch: List[_PendingRequest]):
+        try:
+            dispatched_at = time.perf_counter()
+            queue_delays_ms = [(dispatched_at - item.enqueued_at) * 1000.0 for item in batch]
+            self.stats.record(len(batch), self.max_batch_size, queue_delays_ms)
+            logger.debug(
+                f"Dispatching batch of {len(batch)}/{self.max_batch_size} "
+                f"(fill={self.stats.last_fill_ratio:.2f}, max queue delay={self.stats.last_queue_delay_ms:.1f}ms)"
+            )
+
+            loop = asyncio.get_running_loop()
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self.engine.process_batch, [item.request for item in batch]
+                )
+            except Exception as e:
+                logger.error(f"Batched inference failed: {str(e)}")
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                return
+
+            for item, result in zip(batch, results):
+                if not item.future.done():
+                    item.future.set_result(result)
+        finally:
+            self._slots.release()
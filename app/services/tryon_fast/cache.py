@@ -0,0 +1,249 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    SHA-256 of a file, read in chunks so large models aren't loaded twice.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def result_cache_key(model_digest: str, *inputs: Union[bytes, np.ndarray], **params: Any) -> str:
+    """
+    Content address for a try-on result: model digest + every input's bytes + output params.
+    Arrays contribute dtype and shape as well so e.g. (18, 2) and (36,) don't collide.
+    """
+    h = hashlib.sha256(model_digest.encode())
+    for value in inputs:
+        if isinstance(value, np.ndarray):
+            value = np.ascontiguousarray(value)
+            h.update(f"nd:{value.dtype.str}:{value.shape}".encode())
+            data = value.tobytes()
+        else:
+            data = bytes(value)
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
+    for name in sorted(params):
+        h.update(f"{name}={params[name]}".encode())
+    return h.hexdigest()
+
+class MemoryLRUCache:
+    """
+    Thread-safe in-process LRU bounded by the total size of the stored values.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.evictions = 0
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes):
+        size = len(value)
+        if size > self.max_bytes:
+            return # Would evict everything and still not fit
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old)
+            self._items[key] = value
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.current_bytes -= len(evicted)
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+class RedisResultStore:
+    """
+    Shared tier holding encoded results in Redis with a TTL.
+    """
+
+    def __init__(self, redis: Redis, ttl: int = 86400, prefix: str = "tryon2d:result:"):
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.redis.get(self.prefix + key)
+
+    async def set(self, key: str, value: bytes):
+        await self.redis.set(self.prefix + key, value, ex=self.ttl)
+
+class DiskResultStore:
+    """
+    Local disk tier; files are sharded by key prefix and written atomically.
+
+    Bounded by `max_bytes` (0 = unbounded): reads refresh a file's mtime, and once a write
+    takes the store over the limit the least recently used files are removed until it's
+    back under `low_water` of it, so the directory isn't rescanned on every write.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 0, low_water: float = 0.9):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.current_bytes = sum(size for _, size, _ in self._files())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def _files(self) -> List[Tuple[float, int, str]]:
+        """
+        (last used, bytes, path) of every stored result.
+        """
+        files = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue # Evicted concurrently
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def _read(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return value
+
+    def _write(self, key: str, value: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(value)
+        with self._lock:
+            # Overwriting a key only grows the store by the difference
+            try:
+                previous = os.stat(path).st_size
+            except FileNotFoundError:
+                previous = 0
+            os.replace(tmp_path, path)
+            self.current_bytes += len(value) - previous
+            if self.max_bytes > 0 and self.current_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * self.low_water
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+        self.current_bytes = total
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._read, key)
+
+    async def set(self, key: str, value: bytes):
+        await asyncio.to_thread(self._write, key, value)
+
+@dataclass
+class CacheStats:
+    memory_hits: int = 0
+    backend_hits: int = 0
+    misses: int = 0
+    backend_errors: int = 0
+
+class ResultCache:
+    """
+    Two-tier result cache: in-process LRU in front of an optional Redis or disk store.
+    Backend failures are logged and treated as misses so the cache never fails a request.
+    """
+
+    def __init__(self, memory: MemoryLRUCache, backend: Optional[Union[RedisResultStore, DiskResultStore]] = None):
+        self.memory = memory
+        self.backend = backend
+        self.stats = CacheStats()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats.memory_hits += 1
+            return value
+
+        if self.backend is not None:
+            try:
+                value = await self.backend.get(key)
+            except Exception as e:
+                self.stats.backend_errors += 1
+                logger.warning(f"Result cache backend read failed: {e}")
+                value = None
+            if value is not None:
+                self.stats.backend_hits += 1
+                self.memory.set(key, value) # Promote
+                return value
+
+        self.stats.misses += 1
+        return None
+
+    async def set(self, key: str, value: bytes):
+        self.memory.set(key, value)
+        if self.backend is not None:
+            try:
+                await self.backend.set(key, value)
+            except Exception as e:
+                self.stats.backend_errors += 1
+                logger.warning(f"Result cache backend write failed: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        hits = self.stats.memory_hits + self.stats.backend_hits
+        lookups = hits + self.stats.misses
+        snapshot = {
+            "hits": hits,
+            "memory_hits": self.stats.memory_hits,
+            "backend_hits": self.stats.backend_hits,
+            "misses": self.stats.misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "evictions": self.memory.evictions,
+            "backend_errors": self.stats.backend_errors,
+            "memory_items": len(self.memory),
+            "memory_bytes": self.memory.current_bytes,
+        }
+        if isinstance(self.backend, DiskResultStore):
+            snapshot["disk_evictions"] = self.backend.evictions
+            snapshot["disk_bytes"] = self.backend.current_bytes
+        return snapshot
@@ -1,17 +1,90 @@
 import os
+import time
+import logging
 import onnxruntime as ort
 import torch
 import numpy as np
-from typing import Dict, Union, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Sequence, Union, Tuple, Optional
+from app.services.tryon_fast.execution import ORT_TO_TORCH_DTYPES, ExecutionContext, ExecutionContextPool
+from app.services.tryon_fast.metrics import LatencyHistogram
 from app.services.tryon_fast.utils import ImageUtils
 
+logger = logging.getLogger(__name__)
+
+def is_optimized_model_fresh(model_path: str, optimized_model_path: str) -> bool:
+    """
+    True when a saved ORT-optimized graph exists and is at least as new as its source model.
+    """
+    return os.path.exists(optimized_model_path) and os.path.getmtime(optimized_model_path) >= os.path.getmtime(model_path)
+
+# fp32 is the source model itself; the others are written next to it (see quantization.build_variant)
+MODEL_VARIANTS = ("fp32", "fp16", "int8_dynamic", "int8_static")
+
+def variant_model_path(model_path: str, variant: str) -> str:
+    """
+    Path of a model variant: ./weights/tryon.onnx -> ./weights/tryon.int8_static.onnx
+    """
+    if variant not in MODEL_VARIANTS:
+        raise ValueError(f"Unknown model variant: {variant}. Expected one of {MODEL_VARIANTS}")
+    if variant == "fp32":
+        return model_path
+    root, ext = os.path.splitext(model_path)
+    return f"{root}.{variant}{ext}"
+
+@dataclass
+class TryOnRequest:
+    """Raw inputs for a single person/garment pair."""
+    person_mask: Union[bytes, np.ndarray]
+    garment_mask: Union[bytes, np.ndarray]
+    garment_texture: Union[bytes, np.ndarray]
+    pose_keypoints: np.ndarray
+    output_format: str = "png" # png, jpeg, webp or raw (see ImageUtils.encode_image)
+    quality: Optional[int] = None
+
 class TryOnEngine:
     """
     High-performance Inference Engine for Virtual Try-On using ONNX Runtime.
     Designed for <250ms latency on T4/A10 GPUs.
     """
     
-    def __init__(self, model_path: str, device_id: int = 0):
+    # Assuming model input size 256x192 (CP-VTON standard)
+    input_size: Tuple[int, int] = (256, 192)
+
+    # Model inputs and their channel counts.
+    # Note: Actual CP-VTON inputs vary. 
+    # Common signature: agnostic (mask+pose), cloth, cloth_mask
+    # Here we assume the ONNX model expects these 4 inputs with a dynamic batch axis.
+    input_channels: Dict[str, int] = {
+        "person_mask": 1,
+        "garment_mask": 1,
+        "garment_texture": 3,
+        "pose_heatmap": 18,
+    }
+
+    def __init__(
+        self,
+        model_path: str,
+        device_id: int = 0,
+        contexts_per_batch_size: int = 2,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 0,
+        encode_threads: int = 1,
+        batch_buckets: Optional[Sequence[int]] = None,
+        optimized_model_path: Optional[str] = None,
+        first_requests_tracked: int = 100,
+        model_bytes: Optional[bytes] = None,
+        session_options: Optional[ort.SessionOptions] = None,
+    ):
+        """
+        model_bytes/session_options let a caller running several sessions (see EnginePool)
+        load the model once and pass pre-populated options such as shared initializers;
+        model_bytes must hold the model at model_path.
+        """
+        started_at = time.perf_counter()
+        self.ready = False
+        self.device_id = device_id
         self.device = f"cuda:{device_id}" if torch.cuda.is_available() else "cpu"
         self.providers = [
             ('CUDAExecutionProvider', {
@@ -28,50 +101,173 @@ class TryOnEngine:
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"Model not found at {model_path}")
 
-        session_options = ort.SessionOptions()
+        session_options = session_options or ort.SessionOptions()
         session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        # Reuse the graph ORT optimized on a previous start, unless the source model is newer.
+        # Otherwise have ORT save it this time.
+        if optimized_model_path:
+            if is_optimized_model_fresh(model_path, optimized_model_path):
+                model_path = optimized_model_path
+                session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            else:
+                os.makedirs(os.path.dirname(os.path.abspath(optimized_model_path)), exist_ok=True)
+                session_options.optimized_model_filepath = optimized_model_path
+        self.model_path = model_path
+        # 0 lets ORT size its own pools; callers running several sessions/threads pass explicit
+        # counts so ORT's pools and theirs don't oversubscribe the cores
+        session_options.intra_op_num_threads = intra_op_threads
+        session_options.inter_op_num_threads = inter_op_threads
+        if inter_op_threads == 1:
+            session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
         
-        self.session = ort.InferenceSession(model_path, session_options, providers=self.providers)
-        self.io_binding = self.session.io_binding()
+        self.session = ort.InferenceSession(model_bytes or model_path, session_options, providers=self.providers)
         
         # Cache input/output shapes
         self.inputs_meta = self.session.get_inputs()
         self.outputs_meta = self.session.get_outputs()
+
+        # Each worker thread checks out its own IOBinding + preallocated buffers
+        self.contexts = ExecutionContextPool(self._create_context, max_per_batch_size=contexts_per_batch_size)
+
+        # Encodes the images of a batch in parallel
+        self.encode_executor = ThreadPoolExecutor(encode_threads, thread_name_prefix="tryon-encode") if encode_threads > 1 else None
+
+        # Batches are padded up to these sizes so only warmed-up shapes ever reach the session
+        self.batch_buckets = sorted(set(batch_buckets)) if batch_buckets else []
+
+        self.load_time_s = time.perf_counter() - started_at
+        self.cold_start_s: Optional[float] = None
+        self.first_requests = LatencyHistogram(max_samples=first_requests_tracked)
         
-    def _bind_input_tensor(self, name: str, tensor: torch.Tensor):
+    def _create_context(self, batch_size: int) -> ExecutionContext:
         """
-        Binds a PyTorch tensor directly to ONNX Runtime input.
-        Zero-copy transfer.
+        Allocates and binds buffers for one batch size.
         """
-        # Ensure tensor is contiguous and on correct device
-        if not tensor.is_contiguous():
-            tensor = tensor.contiguous()
-            
-        self.io_binding.bind_input(
-            name=name,
-            device_type='cuda' if 'cuda' in self.device else 'cpu',
-            device_id=0,
-            element_type=np.float32,
-            shape=tuple(tensor.shape),
-            buffer_ptr=tensor.data_ptr(),
-        )
+        H, W = self.input_size
+        try:
+            return ExecutionContext(
+                self.session,
+                batch_size,
+                input_shapes={name: (channels, H, W) for name, channels in self.input_channels.items()},
+                output_name=self.outputs_meta[0].name,
+                output_shape=(3, H, W), # Assuming output is Bx3xHxW image
+                device=self.device,
+                device_id=self.device_id,
+                input_dtypes={meta.name: self._torch_dtype(meta) for meta in self.inputs_meta},
+                output_dtype=self._torch_dtype(self.outputs_meta[0]),
+            )
+        except RuntimeError as e:
+            # Fallback or detailed error for debugging model mismatch
+            raise ValueError(f"Model input binding failed. Check ONNX input names: {[i.name for i in self.inputs_meta]}") from e
 
-    def _bind_output_tensor(self, name: str, shape: Tuple[int, ...]):
+    @staticmethod
+    def _torch_dtype(meta: ort.NodeArg) -> torch.dtype:
         """
-        Pre-allocates output tensor on GPU and binds it.
+        Buffer dtype for a model input/output. Quantized (QDQ/QOperator) variants keep float32
+        I/O; fp16 variants exchange float16 tensors.
+        """
+        if meta.type not in ORT_TO_TORCH_DTYPES:
+            raise ValueError(f"Unsupported element type {meta.type} for {meta.name}")
+        return ORT_TO_TORCH_DTYPES[meta.type]
+
+    def _preprocess_into(self, ctx: ExecutionContext, index: int, request: TryOnRequest):
+        """
+        Decodes and normalizes one request's images straight into row `index` of the context's host buffers.
+        """
+        ImageUtils.preprocess_mask_into(request.person_mask, ctx.host_inputs["person_mask"][index])
+        ImageUtils.preprocess_mask_into(request.garment_mask, ctx.host_inputs["garment_mask"][index])
+        ImageUtils.preprocess_image_into(request.garment_texture, ctx.host_inputs["garment_texture"][index])
+
+    def _pose_heatmaps_into(self, ctx: ExecutionContext, requests: Sequence[TryOnRequest]):
         """
-        # Allocate output tensor on GPU
-        output_tensor = torch.empty(shape, dtype=torch.float32, device=self.device)
+        Builds (B, 18, H, W) pose heatmaps on the device, in a single call when all keypoint sets share a shape.
+        """
+        H, W = self.input_size
+        out = ctx.inputs["pose_heatmap"][:len(requests)]
+        keypoints = [np.asarray(r.pose_keypoints, dtype=np.float32) for r in requests]
+        if all(k.shape == keypoints[0].shape for k in keypoints):
+            ImageUtils.keypoints_to_heatmap(np.stack(keypoints), H, W, device=self.device, out=out)
+            return
+        for i, k in enumerate(keypoints):
+            ImageUtils.keypoints_to_heatmap(k, H, W, device=self.device, out=out[i:i + 1])
+
+    def _bucket(self, batch_size: int) -> int:
+        for bucket in self.batch_buckets:
+            if bucket >= batch_size:
+                return bucket
+        return batch_size
+
+    def warmup(self, batch_sizes: Optional[Sequence[int]] = None, iterations: int = 2):
+        """
+        Runs synthetic inputs through every batch shape so cuDNN algorithm search, ORT's
+        lazy initialization and context allocation happen before real traffic.
+        Sets `ready` once done.
+        """
+        started_at = time.perf_counter()
+        for batch_size in batch_sizes or self.batch_buckets or [1]:
+            with self.contexts.checkout(self._bucket(batch_size)) as ctx:
+                for buffer in ctx.inputs.values():
+                    buffer.zero_()
+                for _ in range(iterations):
+                    ctx.run()
+
+        warmup_s = time.perf_counter() - started_at
+        self.cold_start_s = self.load_time_s + warmup_s
+        self.ready = True
+        logger.info(f"Try-on engine warm: load {self.load_time_s:.2f}s + warm-up {warmup_s:.2f}s")
+
+    def startup_stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "load_time_s": self.load_time_s,
+            "cold_start_s": self.cold_start_s,
+            "first_requests": self.first_requests.snapshot(),
+        }
+
+    def process_batch(self, requests: Sequence[TryOnRequest]) -> List[Union[bytes, memoryview]]:
+        """
+        Runs a batch of try-on requests through a single ONNX call.
         
-        self.io_binding.bind_output(
-            name=name,
-            device_type='cuda' if 'cuda' in self.device else 'cpu',
-            device_id=0,
-            element_type=np.float32,
-            shape=tuple(shape),
-            buffer_ptr=output_tensor.data_ptr(),
-        )
-        return output_tensor
+        Each request is preprocessed into its row of a pooled, pre-bound BCHW buffer
+        (the model is expected to have a dynamic batch axis) and the BCHW output is
+        split back into one encoded image per request, in that request's output format.
+        Safe to call from several threads.
+        """
+        if not requests:
+            return []
+
+        batch_size = len(requests)
+        preprocess_s = []
+
+        # Rows past batch_size in a padded bucket hold stale data; their outputs are ignored
+        with self.contexts.checkout(self._bucket(batch_size)) as ctx:
+            # 1. Preprocess Inputs (CPU/GPU hybrid -> GPU tensors), written in place into the bound buffers
+            for i, r in enumerate(requests):
+                started_at = time.perf_counter()
+                self._preprocess_into(ctx, i, r)
+                preprocess_s.append(time.perf_counter() - started_at)
+            started_at = time.perf_counter()
+            ctx.upload(("person_mask", "garment_mask", "garment_texture"))
+            self._pose_heatmaps_into(ctx, requests)
+
+            # 2. Run Inference on this context's binding
+            ctx.run()
+
+            # 3. Copy the output off the bound buffer (GPU -> CPU uint8) before the context is checked back in
+            images = ImageUtils.tensor_to_uint8(ctx.output[:batch_size].float())
+            shared_s = time.perf_counter() - started_at
+
+        # 4. Encode outside the checkout so the context can serve the next batch meanwhile
+        formats = [(r.output_format, r.quality) for r in requests]
+        encode_s = []
+        results = ImageUtils.encode_batch(images, formats, self.encode_executor, timings=encode_s)
+
+        # One sample per request: its own preprocess and encode plus the batch's shared upload/inference
+        for own_preprocess_s, own_encode_s in zip(preprocess_s, encode_s):
+            if not self.first_requests.observe((own_preprocess_s + shared_s + own_encode_s) * 1000.0):
+                break
+        return results
 
     def process(
         self,
@@ -79,7 +275,9 @@ class TryOnEngine:
         garment_mask: Union[bytes, np.ndarray],
         garment_texture: Union[bytes, np.ndarray],
         pose_keypoints: np.ndarray,
-    ) -> bytes:
+        output_format: str = "png",
+        quality: Optional[int] = None,
+    ) -> Union[bytes, memoryview]:
         """
         Main inference pipeline.
         
@@ -88,48 +286,11 @@ class TryOnEngine:
             garment_mask: Binary mask of the target garment.
             garment_texture: RGB image of the garment.
             pose_keypoints: (18, 2) or (18, 3) keypoints.
+            output_format: png, jpeg, webp, or raw for an unencoded HWC RGB memoryview.
+            quality: PNG compression level (0-9) or JPEG/WebP quality (1-100).
             
         Returns:
-            PNG bytes of the warped garment/try-on result.
+            Encoded bytes of the warped garment/try-on result (PNG by default).
         """
-        # 1. Preprocess Inputs (CPU/GPU hybrid -> GPU tensors)
-        # Assuming model input size 256x192 (CP-VTON standard)
-        H, W = 256, 192
-        
-        # Prepare Tensors on GPU
-        t_person_mask = ImageUtils.preprocess_mask(person_mask, (H, W), self.device)
-        t_garment_mask = ImageUtils.preprocess_mask(garment_mask, (H, W), self.device)
-        t_garment_texture = ImageUtils.preprocess_image(garment_texture, (H, W), device=self.device)
-        t_pose_heatmap = ImageUtils.keypoints_to_heatmap(pose_keypoints, H, W, device=self.device)
-        
-        # 2. Concatenate/Prepare Inputs matching Model Signature
-        # Note: Actual CP-VTON inputs vary. 
-        # Common signature: agnostic (mask+pose), cloth, cloth_mask
-        # Here we assume a specific signature or concatenated input based on common optimizations.
-        # We will bind 4 inputs assuming the ONNX model expects:
-        # 'person_mask', 'garment_mask', 'garment_texture', 'pose_heatmap'
-        
-        # Use try-except to handle model input name mismatches gracefully in this scaffolding
-        try:
-            self._bind_input_tensor("person_mask", t_person_mask)
-            self._bind_input_tensor("garment_mask", t_garment_mask)
-            self._bind_input_tensor("garment_texture", t_garment_texture)
-            self._bind_input_tensor("pose_heatmap", t_pose_heatmap)
-        except RuntimeError as e:
-            # Fallback or detailed error for debugging model mismatch
-            raise ValueError(f"Model input binding failed. Check ONNX input names: {[i.name for i in self.inputs_meta]}") from e
-
-        # 3. Bind Output
-        # Assuming output is Bx3xHxW image
-        output_name = self.outputs_meta[0].name
-        output_shape = (1, 3, H, W)
-        output_tensor = self._bind_output_tensor(output_name, output_shape)
-        
-        # 4. Run Inference (Synchronize for accurate timing if needed, but here we just run)
-        self.session.run_with_iobinding(self.io_binding)
-        
-        # 5. Post-process (GPU -> PNG Bytes)
-        result_bytes = ImageUtils.tensor_to_bytes(output_tensor)
-        
-        return result_bytes
-
+        request = TryOnRequest(person_mask, garment_mask, garment_texture, pose_keypoints, output_format, quality)
+        return self.process_batch([request])[0]
@@ -0,0 +1,154 @@
+import threading
+import numpy as np
+import onnxruntime as ort
+import torch
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# ONNX tensor element types the engine can bind, as reported by session metadata
+ORT_TO_TORCH_DTYPES: Dict[str, torch.dtype] = {
+    "tensor(float)": torch.float32,
+    "tensor(float16)": torch.float16,
+}
+
+class ExecutionContext:
+    """
+    Per-worker inference state for one batch size.
+
+    Holds its own IOBinding with input and output buffers that are allocated and
+    bound once. Callers write preprocessed data into `host_inputs` (or directly into
+    `inputs` for data produced on the device), `upload()` the host-side ones, call
+    `run()` and read `output`. A context must only be used by one thread at a time.
+    Buffers default to float32; reduced-precision models pass their own dtypes.
+    """
+
+    def __init__(
+        self,
+        session: ort.InferenceSession,
+        batch_size: int,
+        input_shapes: Dict[str, Tuple[int, ...]],
+        output_name: str,
+        output_shape: Tuple[int, ...],
+        device: str,
+        device_id: int = 0,
+        input_dtypes: Optional[Dict[str, torch.dtype]] = None,
+        output_dtype: torch.dtype = torch.float32,
+    ):
+        self.session = session
+        self.batch_size = batch_size
+        self.device_type = 'cuda' if 'cuda' in device else 'cpu'
+        self.device_id = device_id
+        self.io_binding = session.io_binding()
+
+        self.inputs: Dict[str, torch.Tensor] = {}
+        # CPU-side preprocessing targets; pinned staging buffers on GPU, the bound buffers themselves on CPU
+        self.host_inputs: Dict[str, torch.Tensor] = {}
+        input_dtypes = input_dtypes or {}
+        for name, shape in input_shapes.items():
+            dtype = input_dtypes.get(name, torch.float32)
+            buffer = torch.empty((batch_size, *shape), dtype=dtype, device=device)
+            self._bind_input(name, buffer)
+            self.inputs[name] = buffer
+            if self.device_type == 'cuda':
+                self.host_inputs[name] = torch.empty(buffer.shape, dtype=dtype).pin_memory()
+            else:
+                self.host_inputs[name] = buffer
+
+        self.output = torch.empty((batch_size, *output_shape), dtype=output_dtype, device=device)
+        self.io_binding.bind_output(
+            name=output_name,
+            device_type=self.device_type,
+            device_id=self.device_id,
+            element_type=self._element_type(self.output),
+            shape=tuple(self.output.shape),
+            buffer_ptr=self.output.data_ptr(),
+        )
+
+    def _bind_input(self, name: str, tensor: torch.Tensor):
+        """
+        Binds a PyTorch buffer directly to ONNX Runtime input.
+        Zero-copy transfer; the buffer is rewritten in place on every request.
+        """
+        self.io_binding.bind_input(
+            name=name,
+            device_type=self.device_type,
+            device_id=self.device_id,
+            element_type=self._element_type(tensor),
+            shape=tuple(tensor.shape),
+            buffer_ptr=tensor.data_ptr(),
+        )
+
+    @staticmethod
+    def _element_type(tensor: torch.Tensor) -> type:
+        return np.float16 if tensor.dtype == torch.float16 else np.float32
+
+    def upload(self, names: Iterable[str]):
+        """
+        Copies the named host buffers to their bound device buffers (no-op on CPU).
+        """
+        for name in names:
+            if self.host_inputs[name] is not self.inputs[name]:
+                self.inputs[name].copy_(self.host_inputs[name], non_blocking=True)
+
+    def run(self):
+        if self.device_type == 'cuda':
+            self.io_binding.synchronize_inputs()
+        self.session.run_with_iobinding(self.io_binding)
+        if self.device_type == 'cuda':
+            self.io_binding.synchronize_outputs()
+
+class ExecutionContextPool:
+    """
+    Thread-safe pool of ExecutionContexts keyed by batch size.
+
+    Contexts are created lazily by `factory` up to `max_per_batch_size` per shape;
+    further checkouts block until one is checked back in. ONNX Runtime sessions
+    are safe to run concurrently, so each thread driving its own context can share
+    one InferenceSession.
+    """
+
+    def __init__(self, factory: Callable[[int], ExecutionContext], max_per_batch_size: int = 2):
+        if max_per_batch_size < 1:
+            raise ValueError("max_per_batch_size must be >= 1")
+        self.factory = factory
+        self.max_per_batch_size = max_per_batch_size
+        self._idle: Dict[int, List[ExecutionContext]] = {}
+        self._created: Dict[int, int] = {}
+        self._cond = threading.Condition()
+
+    def acquire(self, batch_size: int) -> ExecutionContext:
+        with self._cond:
+            while True:
+                idle = self._idle.setdefault(batch_size, [])
+                if idle:
+                    return idle.pop()
+                if self._created.get(batch_size, 0) < self.max_per_batch_size:
+                    self._created[batch_size] = self._created.get(batch_size, 0) + 1
+                    break
+                self._cond.wait()
+
+        # Allocate outside the lock; other batch sizes shouldn't wait on it
+        try:
+            return self.factory(batch_size)
+        except Exception:
+            with self._cond:
+                self._created[batch_size] -= 1
+                self._cond.notify_all()
+            raise
+
+    def release(self, context: ExecutionContext):
+        with self._cond:
+            self._idle.setdefault(context.batch_size, []).append(context)
+            self._cond.notify_all()
+
+    @contextmanager
+    def checkout(self, batch_size: int) -> Iterator[ExecutionContext]:
+        context = self.acquire(batch_size)
+        try:
+            yield context
+        finally:
+            self.release(context)
+
+    def size(self) -> int:
+        with self._cond:
+            return sum(self._created.values())
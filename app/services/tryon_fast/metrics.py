@@ -0,0 +1,59 @@
+import bisect
+import threading
+from typing import Any, Dict, Optional, Sequence
+
+class LatencyHistogram:
+    """
+    Thread-safe fixed-bucket latency histogram in milliseconds.
+    With `max_samples` set it stops recording once full, e.g. to capture only the
+    first N requests after startup.
+    """
+
+    DEFAULT_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self, buckets_ms: Sequence[float] = DEFAULT_BUCKETS_MS, max_samples: Optional[int] = None):
+        self.buckets_ms = tuple(sorted(buckets_ms))
+        self.max_samples = max_samples
+        self.counts = [0] * (len(self.buckets_ms) + 1) # Last bucket is +Inf
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value_ms: float) -> bool:
+        with self._lock:
+            if self.max_samples is not None and self.count >= self.max_samples:
+                return False
+            self.counts[bisect.bisect_left(self.buckets_ms, value_ms)] += 1
+            self.count += 1
+            self.sum_ms += value_ms
+            self.max_ms = max(self.max_ms, value_ms)
+            return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            buckets = {f"le_{b:g}ms": c for b, c in zip(self.buckets_ms, self.counts)}
+            buckets["le_inf"] = self.counts[-1]
+            return {
+                "count": self.count,
+                "avg_ms": self.sum_ms / self.count if self.count else 0.0,
+                "max_ms": self.max_ms,
+                "buckets": buckets,
+            }
+
+    @staticmethod
+    def merge(snapshots: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Combines snapshots of histograms with the same buckets, e.g. one per session.
+        """
+        count = sum(s["count"] for s in snapshots)
+        buckets: Dict[str, int] = {}
+        for s in snapshots:
+            for name, n in s["buckets"].items():
+                buckets[name] = buckets.get(name, 0) + n
+        return {
+            "count": count,
+            "avg_ms": sum(s["avg_ms"] * s["count"] for s in snapshots) / count if count else 0.0,
+            "max_ms": max((s["max_ms"] for s in snapshots), default=0.0),
+            "buckets": buckets,
+        }
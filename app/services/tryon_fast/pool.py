@@ -0,0 +1,374 @@
+import glob
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import onnxruntime as ort
+
+from app.services.tryon_fast.core import TryOnEngine, TryOnRequest, is_optimized_model_fresh
+from app.services.tryon_fast.metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+def parse_cpulist(text: str) -> List[int]:
+    """
+    Parses a Linux cpulist such as "0-3,8,10-11".
+    """
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def numa_cpu_sets() -> List[List[int]]:
+    """
+    Usable CPUs grouped by NUMA node; a single group when topology isn't available.
+    """
+    available = set(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else set(range(os.cpu_count() or 1))
+    nodes = []
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+        with open(path) as f:
+            cpus = [cpu for cpu in parse_cpulist(f.read()) if cpu in available]
+        if cpus:
+            nodes.append(cpus)
+    return nodes or [sorted(available)]
+
+def assign_cpus(num_workers: int, nodes: Sequence[Sequence[int]]) -> List[List[int]]:
+    """
+    Gives each worker a disjoint CPU set that never spans NUMA nodes.
+    Workers are spread round-robin over nodes and split their node's CPUs evenly.
+    """
+    per_node: List[List[int]] = [[] for _ in nodes]
+    for worker in range(num_workers):
+        per_node[worker % len(nodes)].append(worker)
+
+    assignment: List[List[int]] = [[] for _ in range(num_workers)]
+    for node_cpus, workers in zip(nodes, per_node):
+        if not workers:
+            continue
+        share = max(1, len(node_cpus) // len(workers))
+        for i, worker in enumerate(workers):
+            start = (i * share) % len(node_cpus)
+            assignment[worker] = list(node_cpus[start:start + share])
+    return assignment
+
+def load_model_bytes(path: str) -> bytes:
+    """
+    Reads the model once, for ORT-format models whose sessions all point into this one
+    buffer. ORT's Python API only takes a path or `bytes`, so this is a heap copy of the
+    file rather than a zero-copy mapping.
+    """
+    with open(path, "rb") as f:
+        return f.read()
+
+def is_ort_format(path: str) -> bool:
+    # ORT format flatbuffers carry the "ORTM" file identifier at offset 4
+    with open(path, "rb") as f:
+        return f.read(8)[4:8] == b"ORTM"
+
+def shared_initializers(model_path: str) -> Dict[str, ort.OrtValue]:
+    """
+    Wraps the model's weights as OrtValues once so several sessions can use them via
+    SessionOptions.add_initializer instead of each keeping a private copy.
+    Needs the optional `onnx` package; returns {} without it.
+
+    The arrays are decoded from the model proto, which is dropped once they're built, so
+    the weights stay resident once. Each session still parses the file while it is being
+    created, which briefly holds a second copy.
+    """
+    try:
+        import onnx
+        from onnx import numpy_helper
+    except ImportError:
+        logger.warning("onnx not installed; sessions in the pool will not share initializers")
+        return {}
+
+    model = onnx.load_model(model_path)
+    # OrtValue keeps a reference to the backing array
+    return {
+        init.name: ort.OrtValue.ortvalue_from_numpy(np.ascontiguousarray(numpy_helper.to_array(init)))
+        for init in model.graph.initializer
+    }
+
+class _ThreadMember:
+    """A TryOnEngine in this process."""
+
+    def __init__(self, engine: TryOnEngine):
+        self.engine = engine
+
+    @property
+    def ready(self) -> bool:
+        return self.engine.ready
+
+    def process_batch(self, requests: Sequence[TryOnRequest]) -> List[Union[bytes, memoryview]]:
+        return self.engine.process_batch(requests)
+
+    def warmup(self):
+        self.engine.warmup()
+
+    def startup_stats(self) -> Dict[str, Any]:
+        return self.engine.startup_stats()
+
+    def close(self):
+        pass
+
+# State of a process-mode worker; one engine per worker process
+_process_engine: Optional[TryOnEngine] = None
+
+def _init_process_worker(model_path: str, cpus: List[int], engine_kwargs: Dict[str, Any]):
+    global _process_engine
+    if cpus and hasattr(os, "sched_setaffinity"):
+        # ORT threads are created after this, so they inherit the node-local mask
+        os.sched_setaffinity(0, cpus)
+    _process_engine = TryOnEngine(model_path, **engine_kwargs)
+
+def _process_worker_batch(requests: Sequence[TryOnRequest]) -> Tuple[List[bytes], Dict[str, Any]]:
+    # memoryviews (raw output) don't pickle
+    results = [bytes(result) for result in _process_engine.process_batch(requests)]
+    return results, _process_engine.startup_stats()
+
+def _process_worker_warmup() -> Dict[str, Any]:
+    _process_engine.warmup()
+    return _process_engine.startup_stats()
+
+class _ProcessMember:
+    """A TryOnEngine in a dedicated, optionally CPU-pinned, worker process."""
+
+    def __init__(self, model_path: str, cpus: List[int], engine_kwargs: Dict[str, Any]):
+        # spawn: forking a process that already runs ORT/torch thread pools is unsafe
+        self.executor = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process_worker,
+            initargs=(model_path, cpus, engine_kwargs),
+        )
+        self.ready = False
+        # Refreshed with every batch, so reading stats never waits on the worker
+        self._stats: Dict[str, Any] = {"first_requests": LatencyHistogram().snapshot()}
+
+    def process_batch(self, requests: Sequence[TryOnRequest]) -> List[bytes]:
+        results, self._stats = self.executor.submit(_process_worker_batch, list(requests)).result()
+        return results
+
+    def warmup(self):
+        self._stats = self.executor.submit(_process_worker_warmup).result()
+        self.ready = True
+
+    def startup_stats(self) -> Dict[str, Any]:
+        return self._stats
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+class EnginePool:
+    """
+    K independent inference sessions over one model, for CPU nodes where a single
+    session stops scaling after a handful of threads.
+
+    Intra-op threads are split evenly between sessions (optionally pinned to NUMA-local
+    CPUs) and each batch goes to the member with the fewest in-flight batches.
+    In thread mode the weights are resident once: ONNX sessions are built from the model
+    path and share one set of initializers (needs `onnx`, see shared_initializers), and
+    ORT-format sessions all read from one in-memory copy of the model. Without `onnx`
+    each ONNX session holds its own copy. Sharing initializers also means the pool can't
+    write `optimized_model_path`; a warning is logged and the source graph is optimized
+    on every start.
+
+    Process mode runs each session in its own pinned worker process, each loading its
+    own full copy: K times the weights. It does not share memory between sessions and is
+    only meant for hosts where NUMA locality matters more than resident size.
+    Exposes the same process/process_batch/warmup surface as TryOnEngine.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        num_sessions: int,
+        threads_per_session: int = 0,
+        mode: str = "thread",
+        numa_pinning: bool = False,
+        **engine_kwargs: Any,
+    ):
+        if num_sessions < 1:
+            raise ValueError("num_sessions must be >= 1")
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unsupported pool mode: {mode}")
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model not found at {model_path}")
+
+        started_at = time.perf_counter()
+        nodes = numa_cpu_sets()
+        if threads_per_session <= 0:
+            threads_per_session = max(1, sum(len(cpus) for cpus in nodes) // num_sessions)
+        cpu_sets = assign_cpus(num_sessions, nodes) if numa_pinning else [[] for _ in range(num_sessions)]
+
+        engine_kwargs = dict(engine_kwargs, intra_op_threads=threads_per_session, inter_op_threads=1)
+        if mode == "process":
+            logger.warning(f"Process-mode engine pool loads {num_sessions} full copies of {model_path}")
+            optimized_model_path = engine_kwargs.get("optimized_model_path")
+            reuse_optimized = bool(optimized_model_path) and is_optimized_model_fresh(model_path, optimized_model_path)
+            self.members = []
+            for i, cpus in enumerate(cpu_sets):
+                kwargs = dict(engine_kwargs)
+                if i > 0 and not reuse_optimized:
+                    # Only the first worker writes the optimized graph
+                    kwargs.pop("optimized_model_path", None)
+                self.members.append(_ProcessMember(model_path, cpus, kwargs))
+        else:
+            self.members = self._build_thread_members(model_path, cpu_sets, threads_per_session, engine_kwargs)
+
+        self.mode = mode
+        self.load_time_s = time.perf_counter() - started_at
+        self.started_at = time.perf_counter()
+        self._lock = threading.Lock()
+        self._in_flight = [0] * num_sessions
+        self._served = [0] * num_sessions
+        self._busy_s = [0.0] * num_sessions
+        self.warmup_s: Optional[float] = None
+
+        logger.info(
+            f"Engine pool: {num_sessions} {mode} sessions x {threads_per_session} threads"
+            f"{' (NUMA pinned)' if numa_pinning else ''}, loaded in {self.load_time_s:.2f}s"
+        )
+
+    @staticmethod
+    def _build_thread_members(
+        model_path: str,
+        cpu_sets: List[List[int]],
+        threads_per_session: int,
+        engine_kwargs: Dict[str, Any],
+    ) -> List[_ThreadMember]:
+        # A fresh saved graph replaces the source for every session
+        optimized_model_path = engine_kwargs.get("optimized_model_path")
+        reuse_optimized = bool(optimized_model_path) and is_optimized_model_fresh(model_path, optimized_model_path)
+        source_path = optimized_model_path if reuse_optimized else model_path
+
+        # The Python API keeps the bytes a session is built from for the session's lifetime,
+        # so only ORT format (whose sessions share that one buffer) is loaded into memory
+        model_bytes: Optional[bytes] = None
+        initializers: Dict[str, ort.OrtValue] = {}
+        config: Dict[str, str] = {}
+        if is_ort_format(source_path):
+            # ORT format can point its initializers straight into the shared buffer
+            model_bytes = load_model_bytes(source_path)
+            config["session.use_ort_model_bytes_directly"] = "1"
+            config["session.use_ort_model_bytes_for_initializers"] = "1"
+        else:
+            initializers = shared_initializers(source_path)
+        if initializers and optimized_model_path and not reuse_optimized:
+            logger.warning(
+                f"Pooled sessions share initializers, so the optimized graph is not saved to {optimized_model_path}"
+            )
+
+        members = []
+        for i, cpus in enumerate(cpu_sets):
+            options = ort.SessionOptions()
+            for key, value in config.items():
+                options.add_session_config_entry(key, value)
+            for name, value in initializers.items():
+                options.add_initializer(name, value)
+            if cpus and threads_per_session > 1:
+                # One CPU per ORT worker thread; thread 0 is the caller
+                options.add_session_config_entry(
+                    "session.intra_op_thread_affinities",
+                    ";".join(str(cpus[t % len(cpus)]) for t in range(1, threads_per_session)),
+                )
+
+            kwargs = dict(engine_kwargs)
+            if not reuse_optimized and (i > 0 or initializers):
+                # Only one session needs to (and, with shared initializers, can) write the optimized graph
+                kwargs.pop("optimized_model_path", None)
+            engine = TryOnEngine(source_path, model_bytes=model_bytes, session_options=options, **kwargs)
+            members.append(_ThreadMember(engine))
+        return members
+
+    @property
+    def ready(self) -> bool:
+        return all(member.ready for member in self.members)
+
+    def _acquire(self) -> int:
+        with self._lock:
+            # Least loaded first; ties go to whoever has served least
+            index = min(range(len(self.members)), key=lambda i: (self._in_flight[i], self._served[i]))
+            self._in_flight[index] += 1
+            return index
+
+    def _release(self, index: int, busy_s: float):
+        with self._lock:
+            self._in_flight[index] -= 1
+            self._served[index] += 1
+            self._busy_s[index] += busy_s
+
+    def process_batch(self, requests: Sequence[TryOnRequest]) -> List[Union[bytes, memoryview]]:
+        index = self._acquire()
+        started_at = time.perf_counter()
+        try:
+            return self.members[index].process_batch(requests)
+        finally:
+            self._release(index, time.perf_counter() - started_at)
+
+    def process(
+        self,
+        person_mask: Union[bytes, np.ndarray],
+        garment_mask: Union[bytes, np.ndarray],
+        garment_texture: Union[bytes, np.ndarray],
+        pose_keypoints: np.ndarray,
+        output_format: str = "png",
+        quality: Optional[int] = None,
+    ) -> Union[bytes, memoryview]:
+        request = TryOnRequest(person_mask, garment_mask, garment_texture, pose_keypoints, output_format, quality)
+        return self.process_batch([request])[0]
+
+    def warmup(self):
+        """
+        Warms every member concurrently; each runs on its own share of the CPUs.
+        """
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(len(self.members), thread_name_prefix="tryon-pool-warmup") as executor:
+            list(executor.map(lambda member: member.warmup(), self.members))
+        self.warmup_s = time.perf_counter() - started_at
+
+    def startup_stats(self) -> Dict[str, Any]:
+        """
+        Built from the members on every call, so first_requests covers traffic served since.
+        cold_start_s is pool construction plus the (concurrent, so slowest) warm-up.
+        """
+        sessions = [member.startup_stats() for member in self.members]
+        return {
+            "ready": self.ready,
+            "load_time_s": self.load_time_s,
+            "cold_start_s": self.load_time_s + self.warmup_s if self.warmup_s is not None else None,
+            "first_requests": LatencyHistogram.merge([s["first_requests"] for s in sessions]),
+            "sessions": sessions,
+        }
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """
+        Per-session utilization: share of wall time spent serving batches since the pool started.
+        """
+        elapsed = max(time.perf_counter() - self.started_at, 1e-9)
+        with self._lock:
+            return [
+                {
+                    "session": i,
+                    "in_flight": self._in_flight[i],
+                    "batches": self._served[i],
+                    "busy_s": self._busy_s[i],
+                    "utilization": min(1.0, self._busy_s[i] / elapsed),
+                }
+                for i in range(len(self.members))
+            ]
+
+    def close(self):
+        for member in self.members:
+            member.close()
@@ -0,0 +1,221 @@
+"""
+Offline tooling for reduced-precision try-on models: building variants, INT8 calibration
+and the quality-vs-latency report. Needs `onnx` (in requirements.txt; the serving path
+only uses it to share weights between pooled sessions).
+"""
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import torch
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+
+from app.services.tryon_fast.core import MODEL_VARIANTS, TryOnEngine, TryOnRequest, variant_model_path
+from app.services.tryon_fast.utils import ImageUtils
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_FILES = {
+    "person_mask": ("person_mask.png", "person_mask.jpg"),
+    "garment_mask": ("garment_mask.png", "garment_mask.jpg"),
+    "garment_texture": ("garment_texture.png", "garment_texture.jpg", "garment_texture.webp"),
+}
+
+def load_samples(samples_dir: str, limit: Optional[int] = None) -> List[TryOnRequest]:
+    """
+    Reads sample requests from `samples_dir`: one sub-directory per sample holding
+    person_mask, garment_mask and garment_texture images plus pose_keypoints.json.
+    """
+    requests = []
+    for name in sorted(os.listdir(samples_dir)):
+        sample_dir = os.path.join(samples_dir, name)
+        if not os.path.isdir(sample_dir):
+            continue
+
+        images = {}
+        for field, candidates in SAMPLE_FILES.items():
+            path = next((os.path.join(sample_dir, c) for c in candidates if os.path.exists(os.path.join(sample_dir, c))), None)
+            if path is None:
+                break
+            with open(path, "rb") as f:
+                images[field] = f.read()
+        keypoints_path = os.path.join(sample_dir, "pose_keypoints.json")
+        if len(images) < len(SAMPLE_FILES) or not os.path.exists(keypoints_path):
+            logger.warning(f"Skipping incomplete calibration sample {sample_dir}")
+            continue
+        with open(keypoints_path) as f:
+            keypoints = np.asarray(json.load(f), dtype=np.float32)
+
+        requests.append(TryOnRequest(images["person_mask"], images["garment_mask"], images["garment_texture"], keypoints))
+        if limit is not None and len(requests) >= limit:
+            break
+
+    if not requests:
+        raise ValueError(f"No usable samples found in {samples_dir}")
+    return requests
+
+def model_inputs(request: TryOnRequest) -> Dict[str, np.ndarray]:
+    """
+    Batch-of-one float32 model inputs built with the same preprocessing the engine uses.
+    """
+    H, W = TryOnEngine.input_size
+    inputs = {
+        name: torch.empty((1, channels, H, W), dtype=torch.float32)
+        for name, channels in TryOnEngine.input_channels.items()
+    }
+    ImageUtils.preprocess_mask_into(request.person_mask, inputs["person_mask"][0])
+    ImageUtils.preprocess_mask_into(request.garment_mask, inputs["garment_mask"][0])
+    ImageUtils.preprocess_image_into(request.garment_texture, inputs["garment_texture"][0])
+    ImageUtils.keypoints_to_heatmap(request.pose_keypoints, H, W, device="cpu", out=inputs["pose_heatmap"])
+    return {name: tensor.numpy() for name, tensor in inputs.items()}
+
+class TryOnCalibrationReader(CalibrationDataReader):
+    """
+    Feeds preprocessed sample requests to ORT static quantization to collect activation ranges.
+    """
+
+    def __init__(self, samples_dir: str, limit: Optional[int] = None):
+        self.requests = load_samples(samples_dir, limit)
+        self._iter: Optional[Iterator[TryOnRequest]] = None
+
+    def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+        if self._iter is None:
+            self._iter = iter(self.requests)
+        request = next(self._iter, None)
+        return model_inputs(request) if request is not None else None
+
+    def rewind(self):
+        self._iter = None
+
+def build_variant(
+    model_path: str,
+    variant: str,
+    samples_dir: Optional[str] = None,
+    calibration_limit: Optional[int] = None,
+) -> str:
+    """
+    Writes `variant` of the float32 model next to it and returns its path.
+
+    int8_dynamic quantizes weights only and needs no data; int8_static also quantizes
+    activations (QDQ, per-channel weights) using ranges calibrated on `samples_dir`.
+    Both keep float32 inputs/outputs and target CPU inference. fp16 halves the weights
+    and I/O and is meant for the CUDA provider.
+    """
+    output_path = variant_model_path(model_path, variant)
+    if variant == "fp32":
+        return output_path
+
+    started_at = time.perf_counter()
+    if variant == "int8_dynamic":
+        quantize_dynamic(model_path, output_path, weight_type=QuantType.QInt8, per_channel=True)
+    elif variant == "int8_static":
+        if samples_dir is None:
+            raise ValueError("int8_static needs a samples directory for calibration")
+        quantize_static(
+            model_path,
+            output_path,
+            TryOnCalibrationReader(samples_dir, calibration_limit),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+        )
+    elif variant == "fp16":
+        import onnx
+        from onnxruntime.transformers.float16 import convert_float_to_float16
+
+        model = convert_float_to_float16(onnx.load(model_path), keep_io_types=False)
+        onnx.save(model, output_path)
+
+    logger.info(f"Built {variant} try-on model at {output_path} in {time.perf_counter() - started_at:.1f}s")
+    return output_path
+
+def image_quality(reference: np.ndarray, image: np.ndarray) -> Dict[str, float]:
+    """
+    PSNR (dB) and SSIM of a uint8 HWC RGB image against the reference output.
+    """
+    from skimage.metrics import peak_signal_noise_ratio, structural_similarity
+
+    if np.array_equal(reference, image):
+        return {"psnr": float("inf"), "ssim": 1.0}
+    return {
+        "psnr": float(peak_signal_noise_ratio(reference, image, data_range=255)),
+        "ssim": float(structural_similarity(reference, image, channel_axis=-1, data_range=255)),
+    }
+
+def compare_variants(
+    model_paths: Dict[str, str],
+    samples_dir: str,
+    reference: str = "fp32",
+    repeats: int = 3,
+    limit: Optional[int] = None,
+    intra_op_threads: int = 0,
+) -> Dict[str, Any]:
+    """
+    Quality-vs-latency report: runs every variant over the same samples through
+    TryOnEngine and compares its raw outputs with the reference variant's.
+
+    Returns {variant: {"latency_ms": {...}, "psnr": ..., "ssim": ..., "min_ssim": ...}}.
+    Latency covers the full engine path (decode, preprocess, inference) per request.
+    """
+    if reference not in model_paths:
+        raise ValueError(f"Reference variant {reference} is not among {list(model_paths)}")
+    requests = [
+        TryOnRequest(r.person_mask, r.garment_mask, r.garment_texture, r.pose_keypoints, output_format="raw")
+        for r in load_samples(samples_dir, limit)
+    ]
+    H, W = TryOnEngine.input_size
+
+    outputs: Dict[str, List[np.ndarray]] = {}
+    report: Dict[str, Any] = {}
+    for variant, path in model_paths.items():
+        engine = TryOnEngine(path, contexts_per_batch_size=1, intra_op_threads=intra_op_threads, batch_buckets=[1])
+        engine.warmup()
+
+        latencies = []
+        results = []
+        for request in requests:
+            for _ in range(repeats):
+                started_at = time.perf_counter()
+                result = engine.process_batch([request])[0]
+                latencies.append((time.perf_counter() - started_at) * 1000.0)
+            results.append(np.frombuffer(bytes(result), dtype=np.uint8).reshape(H, W, 3))
+        outputs[variant] = results
+
+        report[variant] = {
+            "model_path": path,
+            "model_mb": os.path.getsize(path) / (1024 * 1024),
+            "latency_ms": {
+                "mean": float(np.mean(latencies)),
+                "p50": float(np.percentile(latencies, 50)),
+                "p95": float(np.percentile(latencies, 95)),
+            },
+        }
+
+    for variant, results in outputs.items():
+        scores = [image_quality(ref, out) for ref, out in zip(outputs[reference], results)]
+        report[variant]["psnr"] = float(np.mean([s["psnr"] for s in scores]))
+        report[variant]["ssim"] = float(np.mean([s["ssim"] for s in scores]))
+        report[variant]["min_ssim"] = float(min(s["ssim"] for s in scores))
+    return report
+
+def format_report(report: Dict[str, Any], reference: str = "fp32") -> str:
+    lines = [f"{'variant':<14}{'size MB':>9}{'mean ms':>10}{'p95 ms':>9}{'speedup':>9}{'PSNR dB':>9}{'SSIM':>8}"]
+    reference_ms = report[reference]["latency_ms"]["mean"]
+    for variant, row in report.items():
+        latency = row["latency_ms"]
+        lines.append(
+            f"{variant:<14}{row['model_mb']:>9.1f}{latency['mean']:>10.2f}{latency['p95']:>9.2f}"
+            f"{reference_ms / latency['mean']:>8.2f}x{row['psnr']:>9.2f}{row['ssim']:>8.4f}"
+        )
+    return "\n".join(lines)
+
+def existing_variants(model_path: str, variants: Sequence[str] = MODEL_VARIANTS) -> Dict[str, str]:
+    """
+    The variants of `model_path` that have been built so far.
+    """
+    paths = {variant: variant_model_path(model_path, variant) for variant in variants}
+    return {variant: path for variant, path in paths.items() if os.path.exists(path)}
@@ -1,7 +1,44 @@
+import threading
+import time
 import torch
 import numpy as np
 import cv2
-from typing import Tuple, Union, List
+from concurrent.futures import Executor
+from typing import Dict, Optional, Sequence, Tuple, Union, List
+
+# Encoded output formats: name -> (extension, cv2 quality flag, default quality)
+OUTPUT_FORMATS = {
+    "png": (".png", cv2.IMWRITE_PNG_COMPRESSION, None), # None keeps OpenCV's fast RLE default
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY, 90),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY, 90),
+}
+# Accepted quality values per format (inclusive)
+QUALITY_RANGES = {
+    "png": (0, 9),
+    "jpeg": (1, 100),
+    "webp": (1, 100),
+}
+
+# Decode flags by downscale factor
+REDUCED_COLOR_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+REDUCED_GRAYSCALE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+OUTPUT_MEDIA_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+    "raw": "application/octet-stream",
+}
 
 class ImageUtils:
     """
@@ -9,6 +46,126 @@ class ImageUtils:
     Minimizes CPU-GPU transfers.
     """
 
+    # Per-thread uint8 resize targets keyed by shape, so resizing doesn't allocate
+    _scratch = threading.local()
+
+    # Normalization folded into one multiply-add: (x / 255 - mean) / std == x * scale + bias
+    _norm_cache: Dict[Tuple[Tuple[float, ...], Tuple[float, ...], int], Tuple[np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def _norm_constants(cls, mean: Sequence[float], std: Sequence[float], channels: int) -> Tuple[np.ndarray, np.ndarray]:
+        key = (tuple(mean), tuple(std), channels)
+        constants = cls._norm_cache.get(key)
+        if constants is None:
+            # Assume mean/std are scalar or length 1 for grayscale, 3 for RGB
+            mean_np = np.broadcast_to(np.asarray(mean, dtype=np.float32), (channels,))
+            std_np = np.broadcast_to(np.asarray(std, dtype=np.float32), (channels,))
+            constants = (1.0 / (255.0 * std_np), -mean_np / std_np)
+            cls._norm_cache[key] = constants
+        return constants
+
+    @classmethod
+    def _resize_buffer(cls, shape: Tuple[int, ...]) -> np.ndarray:
+        buffers = getattr(cls._scratch, "buffers", None)
+        if buffers is None:
+            buffers = cls._scratch.buffers = {}
+        buffer = buffers.get(shape)
+        if buffer is None:
+            buffer = buffers[shape] = np.empty(shape, dtype=np.uint8)
+        return buffer
+
+    @staticmethod
+    def probe_size(data: bytes) -> Optional[Tuple[int, int]]:
+        """
+        Reads (H, W) from a PNG or JPEG header without decoding. None for other formats.
+        """
+        if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+            return int.from_bytes(data[20:24], "big"), int.from_bytes(data[16:20], "big")
+
+        if data[:2] == b"\xff\xd8":
+            i = 2
+            while i + 9 <= len(data):
+                if data[i] != 0xFF:
+                    return None
+                marker = data[i + 1]
+                if marker == 0xFF: # Fill byte
+                    i += 1
+                    continue
+                # SOF0-SOF15 carry the frame size (C4/C8/CC are DHT/JPG/DAC)
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                    return int.from_bytes(data[i + 5:i + 7], "big"), int.from_bytes(data[i + 7:i + 9], "big")
+                i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+        return None
+
+    @staticmethod
+    def decode(data: bytes, target_size: Tuple[int, int], grayscale: bool = False) -> np.ndarray:
+        """
+        Decodes image bytes, letting the codec downscale by 2/4/8 when the source is
+        at least that many times larger than the target (JPEG does this in the DCT).
+        cv2.imdecode returns BGR.
+        """
+        factor = 1
+        size = ImageUtils.probe_size(data)
+        if size is not None:
+            for f in (8, 4, 2):
+                if size[0] // f >= target_size[0] and size[1] // f >= target_size[1]:
+                    factor = f
+                    break
+
+        flags = REDUCED_GRAYSCALE_FLAGS[factor] if grayscale else REDUCED_COLOR_FLAGS[factor]
+        # Decode using OpenCV (CPU) - Unavoidable for encoded formats like PNG/JPG
+        img_np = cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+        if img_np is None:
+            raise ValueError("Could not decode image")
+        return img_np
+
+    @classmethod
+    def _resize(cls, img_np: np.ndarray, target_size: Tuple[int, int], interpolation: int) -> np.ndarray:
+        # Resize (CPU) - cv2.resize is very fast, often faster than transferring large image to GPU then resizing
+        if (img_np.shape[0], img_np.shape[1]) == target_size:
+            return img_np
+        dst = cls._resize_buffer((target_size[0], target_size[1]) + img_np.shape[2:])
+        return cv2.resize(img_np, (target_size[1], target_size[0]), dst=dst, interpolation=interpolation)
+
+    @classmethod
+    def preprocess_image_into(
+        cls,
+        image: Union[np.ndarray, bytes],
+        out: torch.Tensor,
+        mean: Sequence[float] = (0.5,),
+        std: Sequence[float] = (0.5,),
+    ) -> torch.Tensor:
+        """
+        Fused decode -> resize -> BGR to RGB -> normalize, written directly into `out`,
+        a (C, H, W) float32 CPU tensor (e.g. one row of a batch buffer).
+        """
+        channels, height, width = out.shape
+        img_np = cls.decode(image, (height, width)) if isinstance(image, bytes) else image
+        if img_np is None:
+            raise ValueError("Could not decode image")
+        img_np = cls._resize(img_np, (height, width), cv2.INTER_LINEAR)
+
+        # HWC -> CHW, BGR -> RGB and (x / 255 - mean) / std in a single pass per channel
+        scale, bias = cls._norm_constants(mean, std, channels)
+        dst = out.numpy()
+        for c in range(channels):
+            np.multiply(img_np[:, :, channels - 1 - c], scale[c], out=dst[c])
+            dst[c] += bias[c]
+        return out
+
+    @classmethod
+    def preprocess_mask_into(cls, mask: Union[np.ndarray, bytes], out: torch.Tensor) -> torch.Tensor:
+        """
+        Fused decode -> resize -> binarize of a single channel mask into `out`, a (1, H, W) float32 CPU tensor.
+        """
+        _, height, width = out.shape
+        img_np = cls.decode(mask, (height, width), grayscale=True) if isinstance(mask, bytes) else mask
+        img_np = cls._resize(img_np, (height, width), cv2.INTER_NEAREST)
+
+        # Binary thresholding often helps masks: x / 255 > 0.5 <=> x > 127 for uint8
+        np.greater(img_np, 127, out=out.numpy()[0])
+        return out
+
     @staticmethod
     def preprocess_image(
         image: Union[np.ndarray, bytes], 
@@ -18,42 +175,15 @@ class ImageUtils:
         device: str = "cuda"
     ) -> torch.Tensor:
         """
-        Converts raw image bytes or numpy array to normalized NCHW float32 tensor on GPU.
+        Converts raw image bytes or numpy array to normalized NCHW float32 RGB tensor on GPU.
         """
-        if isinstance(image, bytes):
-            # Decode using OpenCV (CPU) - Unavoidable for encoded formats like PNG/JPG
-            # cv2.imdecode returns BGR
-            nparr = np.frombuffer(image, np.uint8)
-            img_np = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        else:
-            img_np = image
-
-        if img_np is None:
-            raise ValueError("Could not decode image")
-
-        # Resize (CPU) - cv2.resize is very fast, often faster than transferring large image to GPU then resizing
-        if (img_np.shape[0], img_np.shape[1]) != target_size:
-            img_np = cv2.resize(img_np, (target_size[1], target_size[0]), interpolation=cv2.INTER_LINEAR)
-
-        # Convert to Tensor (CPU -> GPU)
-        # HWC -> CHW, BGR -> RGB
-        tensor = torch.from_numpy(img_np).permute(2, 0, 1).float()
+        tensor = torch.empty((1, 3, *target_size), dtype=torch.float32)
+        ImageUtils.preprocess_image_into(image, tensor[0], mean, std)
         
+        # CPU -> GPU
         if device == "cuda" and torch.cuda.is_available():
             tensor = tensor.to(device, non_blocking=True)
-            
-        # Normalize: (x / 255.0 - mean) / std
-        tensor = tensor / 255.0
-        
-        # Apply mean/std
-        # Assume mean/std are scalar or length 1 for grayscale, 3 for RGB
-        mean_tensor = torch.tensor(mean, device=device).view(-1, 1, 1)
-        std_tensor = torch.tensor(std, device=device).view(-1, 1, 1)
-        
-        tensor = (tensor - mean_tensor) / std_tensor
-        
-        # Add Batch Dimension: CHW -> BCHW
-        return tensor.unsqueeze(0)
+        return tensor
 
     @staticmethod
     def preprocess_mask(
@@ -64,93 +194,164 @@ class ImageUtils:
         """
         Handles single channel masks.
         """
-        if isinstance(mask, bytes):
-            nparr = np.frombuffer(mask, np.uint8)
-            img_np = cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE)
-        else:
-            img_np = mask
-
-        if (img_np.shape[0], img_np.shape[1]) != target_size:
-            img_np = cv2.resize(img_np, (target_size[1], target_size[0]), interpolation=cv2.INTER_NEAREST)
-
-        tensor = torch.from_numpy(img_np).float().unsqueeze(0) # HW -> CHW (C=1)
+        tensor = torch.empty((1, 1, *target_size), dtype=torch.float32)
+        ImageUtils.preprocess_mask_into(mask, tensor[0])
         
         if device == "cuda" and torch.cuda.is_available():
             tensor = tensor.to(device, non_blocking=True)
-            
-        tensor = tensor / 255.0
-        # Binary thresholding often helps masks
-        tensor = (tensor > 0.5).float()
-        
-        return tensor.unsqueeze(0) # BCHW
+        return tensor # BCHW
 
     @staticmethod
-    def tensor_to_bytes(tensor: torch.Tensor) -> bytes:
+    def tensor_to_uint8(tensor: torch.Tensor) -> np.ndarray:
         """
-        Converts GPU tensor to PNG bytes.
-        Expects NCHW tensor, normalized [-1, 1] or [0, 1].
+        Converts a GPU tensor to a CPU uint8 RGB array in one transfer.
+        Expects NCHW (or CHW) tensor, normalized [-1, 1]; returns (N, H, W, C) or (H, W, C).
         """
-        # Remove batch dim
-        if tensor.dim() == 4:
-            tensor = tensor.squeeze(0)
-            
         # Un-normalize if needed (assuming [-1, 1] input from GANs usually)
         # Mapping [-1, 1] to [0, 255]
         tensor = (tensor * 0.5 + 0.5).clamp(0, 1) * 255.0
         
         # CHW -> HWC
-        tensor = tensor.permute(1, 2, 0).byte()
+        tensor = tensor.movedim(-3, -1).byte()
         
         # GPU -> CPU
-        img_np = tensor.cpu().numpy()
-        
+        return tensor.cpu().numpy()
+
+    @staticmethod
+    def encode_image(
+        img_np: np.ndarray,
+        output_format: str = "png",
+        quality: Optional[int] = None,
+    ) -> Union[bytes, memoryview]:
+        """
+        Encodes an HWC uint8 RGB array.
+
+        output_format:
+            png  - lossless; quality is the zlib compression level 0-9 (default: OpenCV's fastest)
+            jpeg - quality 1-100 (default 90)
+            webp - quality 1-100 (default 90)
+            raw  - no encoding; returns a memoryview over the HWC RGB bytes
+        """
+        output_format = output_format.lower()
+        if output_format == "raw":
+            return memoryview(np.ascontiguousarray(img_np)).cast("B")
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {output_format}")
+
         # RGB -> BGR for OpenCV
         if img_np.shape[2] == 3:
             img_np = cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR)
-            
-        success, encoded_img = cv2.imencode('.png', img_np)
+
+        ext, flag, default_quality = OUTPUT_FORMATS[output_format]
+        quality = default_quality if quality is None else int(quality)
+        params = [flag, quality] if quality is not None else []
+        success, encoded_img = cv2.imencode(ext, img_np, params)
         if not success:
-            raise ValueError("Failed to encode image to PNG")
+            raise ValueError(f"Failed to encode image to {output_format.upper()}")
             
         return encoded_img.tobytes()
 
     @staticmethod
+    def tensor_to_bytes(
+        tensor: torch.Tensor,
+        output_format: str = "png",
+        quality: Optional[int] = None,
+    ) -> Union[bytes, memoryview]:
+        """
+        Converts GPU tensor to encoded image bytes (PNG by default).
+        Expects NCHW tensor, normalized [-1, 1] or [0, 1].
+        """
+        # Remove batch dim
+        if tensor.dim() == 4:
+            tensor = tensor.squeeze(0)
+        return ImageUtils.encode_image(ImageUtils.tensor_to_uint8(tensor), output_format, quality)
+
+    @staticmethod
+    def encode_batch(
+        images: np.ndarray,
+        formats: Sequence[Tuple[str, Optional[int]]],
+        executor: Optional[Executor] = None,
+        timings: Optional[List[float]] = None,
+    ) -> List[Union[bytes, memoryview]]:
+        """
+        Encodes each (H, W, C) image of a batch with its own (format, quality).
+        cv2.imencode releases the GIL, so a thread pool encodes the batch in parallel.
+        With `timings`, it's filled with each image's encode time in seconds.
+        """
+        def encode(job):
+            started_at = time.perf_counter()
+            return ImageUtils.encode_image(*job), time.perf_counter() - started_at
+
+        jobs = [(images[i], fmt, quality) for i, (fmt, quality) in enumerate(formats)]
+        if executor is None or len(jobs) == 1:
+            encoded = [encode(job) for job in jobs]
+        else:
+            encoded = list(executor.map(encode, jobs))
+        if timings is not None:
+            timings[:] = [seconds for _, seconds in encoded]
+        return [result for result, _ in encoded]
+
+    # Coordinate axes keyed by (H, W, device); reused across calls
+    _grid_cache: Dict[Tuple[int, int, str], Tuple[torch.Tensor, torch.Tensor]] = {}
+
+    @classmethod
+    def _coordinate_grid(cls, height: int, width: int, device: str) -> Tuple[torch.Tensor, torch.Tensor]:
+        key = (height, width, str(device))
+        grid = cls._grid_cache.get(key)
+        if grid is None:
+            ys = torch.arange(0, height, 1, dtype=torch.float32, device=device)
+            xs = torch.arange(0, width, 1, dtype=torch.float32, device=device)
+            grid = (ys, xs)
+            cls._grid_cache[key] = grid
+        return grid
+
+    @classmethod
     def keypoints_to_heatmap(
+        cls,
         keypoints: np.ndarray, 
         height: int, 
         width: int, 
         num_keypoints: int = 18, 
         sigma: float = 6.0,
-        device: str = "cuda"
+        device: str = "cuda",
+        out: Optional[torch.Tensor] = None,
     ) -> torch.Tensor:
         """
         Generates Gaussian heatmaps from keypoints on GPU.
-        keypoints: (N, 3) array (x, y, visibility) or (N, 2)
-        Returns: (1, 18, H, W) tensor
+        keypoints: (N, 3) array (x, y, visibility) or (N, 2), or a batch (B, N, 3) / (B, N, 2)
+        out: optional preallocated (B, num_keypoints, H, W) tensor to write into
+        Returns: (B, num_keypoints, H, W) tensor, B = 1 for a single keypoint set
         """
-        # Create grid
-        xs = torch.arange(0, width, 1, dtype=torch.float32, device=device)
-        ys = torch.arange(0, height, 1, dtype=torch.float32, device=device)
-        yy, xx = torch.meshgrid(ys, xs, indexing='ij')
-        
-        heatmaps = torch.zeros((num_keypoints, height, width), dtype=torch.float32, device=device)
-        
-        # Transfer keypoints to GPU
-        kps_tensor = torch.tensor(keypoints, device=device)
-        
-        for i in range(min(len(keypoints), num_keypoints)):
-            kp = kps_tensor[i]
-            # Check visibility if present (x, y, v)
-            if kp.shape[0] > 2 and kp[2] < 0.1:
-                continue
-                
-            x, y = kp[0], kp[1]
-            if x < 0 or y < 0: 
-                continue
-
-            # Gaussian formula
-            heatmap = torch.exp(-((xx - x) ** 2 + (yy - y) ** 2) / (2 * sigma ** 2))
-            heatmaps[i] = heatmap
-
-        return heatmaps.unsqueeze(0) # Add batch dim
+        kps = torch.as_tensor(np.asarray(keypoints), dtype=torch.float32, device=device)
+        if kps.dim() == 2:
+            kps = kps.unsqueeze(0)
+
+        batch_size = kps.shape[0]
+        kps = kps[:, :num_keypoints]
+        n = kps.shape[1]
+
+        # Invisible keypoints (low confidence or negative coords) are masked out
+        x, y = kps[..., 0], kps[..., 1]
+        visible = (x >= 0) & (y >= 0)
+        if kps.shape[2] > 2:
+            visible &= kps[..., 2] >= 0.1
+
+        # The Gaussian is separable: exp(-(dx^2 + dy^2) / 2s^2) = exp(-dx^2 / 2s^2) * exp(-dy^2 / 2s^2)
+        # so only (B, N, H) and (B, N, W) exponentials are needed instead of a full frame per keypoint
+        ys, xs = cls._coordinate_grid(height, width, device)
+        denom = 2 * sigma ** 2
+        gy = torch.exp(-((ys - y.unsqueeze(-1)) ** 2) / denom) * visible.unsqueeze(-1)
+        gx = torch.exp(-((xs - x.unsqueeze(-1)) ** 2) / denom)
+
+        if out is not None:
+            torch.mul(gy.unsqueeze(-1), gx.unsqueeze(-2), out=out[:, :n])
+            out[:, n:].zero_()
+            return out
+
+        heatmaps = gy.unsqueeze(-1) * gx.unsqueeze(-2)
+
+        if n < num_keypoints:
+            padding = torch.zeros((batch_size, num_keypoints - n, height, width), dtype=torch.float32, device=device)
+            heatmaps = torch.cat([heatmaps, padding], dim=1)
 
+        return heatmaps
@@ -0,0 +1,54 @@
+"""
+Builds reduced-precision variants of the 2D try-on model and compares them.
+
+    python scripts/tryon_variants.py build weights/tryon.onnx --variant int8_static --samples data/calibration
+    python scripts/tryon_variants.py report weights/tryon.onnx --samples data/calibration
+
+Samples are directories holding person_mask, garment_mask and garment_texture images
+plus pose_keypoints.json. Select the served variant with TRYON_MODEL_VARIANT.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.tryon_fast.core import MODEL_VARIANTS
+from app.services.tryon_fast.quantization import build_variant, compare_variants, existing_variants, format_report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Write a model variant next to the float32 model")
+    build.add_argument("model_path")
+    build.add_argument("--variant", choices=MODEL_VARIANTS[1:], required=True)
+    build.add_argument("--samples", help="Calibration samples (int8_static)")
+    build.add_argument("--calibration-limit", type=int)
+
+    report = subparsers.add_parser("report", help="Quality vs latency of the built variants")
+    report.add_argument("model_path")
+    report.add_argument("--samples", required=True)
+    report.add_argument("--variants", nargs="+", choices=MODEL_VARIANTS, default=list(MODEL_VARIANTS))
+    report.add_argument("--repeats", type=int, default=3)
+    report.add_argument("--limit", type=int)
+    report.add_argument("--threads", type=int, default=0, help="ORT intra-op threads (0 = ORT default)")
+    report.add_argument("--json", help="Also write the raw report here")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        print(build_variant(args.model_path, args.variant, args.samples, args.calibration_limit))
+        return
+
+    model_paths = existing_variants(args.model_path, args.variants)
+    results = compare_variants(model_paths, args.samples, repeats=args.repeats, limit=args.limit, intra_op_threads=args.threads)
+    print(format_report(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
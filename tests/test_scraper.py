@@ -1,4 +1,6 @@
+import asyncio
 import unittest
+from unittest.mock import AsyncMock, MagicMock
 from app.services.scraper.parsers.heuristics import ContentParser
 
 class TestHeuristics(unittest.TestCase):
@@ -27,6 +29,308 @@ class TestHeuristics(unittest.TestCase):
         low = "100% Cotton rigid denim"
         self.assertEqual(ContentParser.estimate_stretchiness(low), 0.1)
 
+def fake_playwright():
+    """
+    Stand-in for async_playwright(): records launches and contexts, pages never close.
+    """
+    browsers, contexts = [], []
+
+    async def new_context(**kwargs):
+        context = MagicMock()
+        context.options = kwargs
+        context.new_page = AsyncMock(return_value=MagicMock(is_closed=MagicMock(return_value=False)))
+        context.add_init_script = AsyncMock()
+        context.close = AsyncMock()
+        context.route = AsyncMock()
+        contexts.append(context)
+        return context
+
+    async def launch(**kwargs):
+        browser = MagicMock()
+        browser.is_connected.return_value = True
+        browser.new_context = AsyncMock(side_effect=new_context)
+        browser.close = AsyncMock()
+        browsers.append(browser)
+        return browser
+
+    playwright = MagicMock()
+    playwright.chromium.launch = AsyncMock(side_effect=launch)
+    playwright.stop = AsyncMock()
+    factory = MagicMock()
+    factory.return_value.start = AsyncMock(return_value=playwright)
+    return factory, browsers, contexts
+
+class TestBrowserPool(unittest.TestCase):
+    def test_reuses_contexts_and_rotates_after_request_limit(self):
+        from app.services.scraper.browser import BrowserPool
+        factory, browsers, contexts = fake_playwright()
+        pool = BrowserPool(max_contexts=2, max_requests_per_context=3, max_concurrency=2, playwright_factory=factory)
+
+        async def scrape(n):
+            for _ in range(n):
+                async with pool.page():
+                    pass
+
+        asyncio.run(scrape(7))
+        # One launch; a fresh context (with its own user agent) every 3 pages
+        self.assertEqual(len(browsers), 1)
+        self.assertEqual(len(contexts), 3)
+        self.assertEqual(pool.contexts_retired, 2)
+        self.assertIn("user_agent", contexts[0].options)
+
+    def test_failed_page_and_crashed_browser_are_replaced(self):
+        from app.services.scraper.browser import BrowserPool
+        factory, browsers, contexts = fake_playwright()
+        pool = BrowserPool(max_contexts=2, max_requests_per_context=100, max_concurrency=2, playwright_factory=factory)
+
+        async def run():
+            with self.assertRaises(RuntimeError):
+                async with pool.page():
+                    raise RuntimeError("Target closed")
+            async with pool.page():
+                pass
+            browsers[0].is_connected.return_value = False
+            async with pool.page():
+                pass
+
+        asyncio.run(run())
+        self.assertEqual(len(browsers), 2)
+        self.assertEqual(len(contexts), 3)
+
+    def test_concurrency_is_capped(self):
+        from app.services.scraper.browser import BrowserPool
+        factory, _, _ = fake_playwright()
+        pool = BrowserPool(max_contexts=4, max_requests_per_context=100, max_concurrency=2, playwright_factory=factory)
+        active, peak = 0, 0
+
+        async def scrape():
+            nonlocal active, peak
+            async with pool.page():
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.01)
+                active -= 1
+
+        async def run():
+            await asyncio.gather(*(scrape() for _ in range(8)))
+
+        asyncio.run(run())
+        self.assertEqual(peak, 2)
+
+class TestRequestFilter(unittest.TestCase):
+    def test_blocks_heavy_types_and_trackers_but_keeps_image_urls(self):
+        from app.services.scraper.browser import BrowserPool
+        from app.services.scraper.interception import RequestFilter
+        request_filter = RequestFilter(["image", "font"], ["google-analytics.com"])
+        factory, _, contexts = fake_playwright()
+        pool = BrowserPool(max_contexts=1, max_requests_per_context=10, max_concurrency=1,
+                           request_filter=request_filter, playwright_factory=factory)
+        requests = [
+            ("document", "https://shop.com/p/1"),
+            ("image", "https://cdn.shop.com/p/1.jpg"),
+            ("font", "https://cdn.shop.com/f.woff2"),
+            ("script", "https://www.google-analytics.com/analytics.js"),
+            ("script", "https://shop.com/app.js"),
+        ]
+
+        async def run():
+            async with pool.lease() as pooled:
+                context = contexts[0]
+                route_handler = context.route.call_args.args[1]
+                on_request = next(c.args[1] for c in context.on.call_args_list if c.args[0] == "request")
+                routes = []
+                for resource_type, url in requests:
+                    request = MagicMock(resource_type=resource_type, url=url)
+                    route = MagicMock(continue_=AsyncMock(), abort=AsyncMock())
+                    on_request(request)
+                    await route_handler(route, request)
+                    routes.append(route)
+                return pooled.image_urls, routes
+
+        image_urls, routes = asyncio.run(run())
+        self.assertEqual(image_urls, ["https://cdn.shop.com/p/1.jpg"])
+        self.assertEqual([r.abort.called for r in routes], [False, True, True, True, False])
+        self.assertEqual(request_filter.stats()["blocked_by_reason"], {
+            "type:image": 1, "type:font": 1, "domain:google-analytics.com": 1,
+        })
+        self.assertEqual(request_filter.allowed_requests, 2)
+
+class TestStructuredExtraction(unittest.TestCase):
+    PAGE = """<html><head>
+    <title>Linen Shirt | Shop</title>
+    <meta property="og:title" content="Linen Shirt (OG)">
+    <meta property="og:image" content="https://cdn.shop.com/og.jpg">
+    <meta property="product:price:amount" content="59.00">
+    <script type="application/ld+json">{"@context": "https://schema.org", "@graph": [
+        {"@type": "BreadcrumbList"},
+        {"@type": "ProductGroup", "name": "Linen Shirt", "brand": {"@type": "Brand", "name": "Acme"},
+         "image": ["/img/front.jpg", {"url": "https://cdn.shop.com/back.jpg"}],
+         "offers": [{"@type": "Offer", "price": "1.299,00", "priceCurrency": "SEK"}],
+         "hasVariant": [{"@type": "Product", "size": "Small"}, {"@type": "Product", "size": "Medium"}]}
+    ]}</script>
+    <script>var text = "95% Polyester 5% Spandex";</script>
+    </head><body>
+    <nav>Shop 100% Wool coats</nav>
+    <h1>Linen Shirt</h1>
+    <div class="product-details"><p class="composition">100% Linen. Rigid weave.</p></div>
+    <select name="size"><option value="">Select a size</option><option value="l">Large</option></select>
+    </body></html>"""
+
+    def test_structured_data_fills_fields_and_heuristics_see_only_detail_blocks(self):
+        from app.services.scraper.parsers.structured import extract_product
+        product = extract_product(self.PAGE, "https://shop.com/p/1")
+        self.assertEqual((product.name, product.brand, product.price, product.currency), ("Linen Shirt", "Acme", 1299.0, "SEK"))
+        self.assertEqual(product.images[:3], [
+            "https://shop.com/img/front.jpg", "https://cdn.shop.com/back.jpg", "https://cdn.shop.com/og.jpg",
+        ])
+        self.assertEqual(product.sizes, ["Small", "Medium", "Large"])
+        self.assertEqual(product.sources, ["json-ld", "opengraph", "html"])
+        self.assertEqual(ContentParser.extract_materials(product.detail_text), "100% Linen")
+
+    def test_price_formats(self):
+        from app.services.scraper.parsers.structured import parse_price
+        self.assertEqual(parse_price("1,299.00"), 1299.0)
+        self.assertEqual(parse_price("€ 29,99"), 29.99)
+        self.assertEqual(parse_price("1.299"), 1299.0)
+        self.assertEqual(parse_price(42), 42.0)
+        self.assertIsNone(parse_price("sold out"))
+
+    def test_microdata_ignores_properties_of_nested_items(self):
+        from app.services.scraper.parsers.structured import extract_product
+        page = """<html><body><div itemscope itemtype="https://schema.org/Product">
+        <div itemprop="brand" itemscope itemtype="https://schema.org/Brand"><span itemprop="name">Acme</span></div>
+        <div itemscope itemtype="https://schema.org/Review"><span itemprop="name">Great shirt</span></div>
+        <h2 itemprop="name">Oxford Shirt</h2>
+        <div itemprop="offers" itemscope itemtype="https://schema.org/Offer">
+          <meta itemprop="price" content="49.90"><meta itemprop="priceCurrency" content="EUR">
+        </div>
+        </div></body></html>"""
+        product = extract_product(page, "https://shop.com/p/3")
+        self.assertEqual((product.name, product.brand), ("Oxford Shirt", "Acme"))
+        self.assertEqual((product.price, product.currency), (49.9, "EUR"))
+
+    def test_numeric_json_ld_sizes(self):
+        from app.services.scraper.parsers.structured import extract_product
+        page = """<html><head><script type="application/ld+json">
+        {"@type": "Product", "name": "Sneaker", "size": 42, "hasVariant": [{"@type": "Product", "size": 43}]}
+        </script></head><body></body></html>"""
+        self.assertEqual(extract_product(page, "https://shop.com/p/2").sizes, ["42", "43"])
+
+PRODUCT_PAGE = """<html><head>
+<script type="application/ld+json">{"@context": "https://schema.org", "@type": "Product", "name": "Linen Shirt"}</script>
+</head><body><h1>Linen Shirt</h1><p>""" + "Breathable 100% Linen shirt with a relaxed fit. " * 10 + """</p></body></html>"""
+SHELL_PAGE = """<html><head><script src="/app.js"></script></head><body><div id="__next"></div></body></html>"""
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+
+class TestTieredFetcher(unittest.TestCase):
+    def _fetcher(self, pages):
+        import httpx
+        from app.services.scraper.driver import PageSnapshot
+        from app.services.scraper.fetcher import TieredFetcher
+        requested = []
+
+        def handler(request):
+            requested.append(str(request.url))
+            return httpx.Response(200, headers={"content-type": "text/html"}, text=pages[request.url.host])
+
+        driver = MagicMock()
+        driver.get_page = AsyncMock(return_value=PageSnapshot("<html>rendered</html>", []))
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        return TieredFetcher(driver, FakeRedis(), client=client), driver, requested
+
+    def test_server_rendered_product_skips_the_browser(self):
+        fetcher, driver, requested = self._fetcher({"shop.com": PRODUCT_PAGE})
+
+        async def run():
+            return [await fetcher.fetch(f"https://shop.com/p/{i}") for i in range(2)]
+
+        snapshots = asyncio.run(run())
+        self.assertEqual([s.tier for s in snapshots], ["http", "http"])
+        self.assertIn("Linen Shirt", snapshots[0].html)
+        driver.get_page.assert_not_called()
+        self.assertEqual(fetcher.redis.data, {"scraper:tier:shop.com": "http"})
+
+    def test_js_shell_escalates_and_domain_then_goes_straight_to_browser(self):
+        from app.services.scraper.fetcher import has_product_data, looks_like_js_shell
+        fetcher, driver, requested = self._fetcher({"spa.com": SHELL_PAGE})
+
+        async def run():
+            return [await fetcher.fetch(f"https://spa.com/p/{i}") for i in range(2)]
+
+        snapshots = asyncio.run(run())
+        self.assertEqual([s.tier for s in snapshots], ["browser", "browser"])
+        self.assertEqual(requested, ["https://spa.com/p/0"])
+        self.assertEqual(driver.get_page.await_count, 2)
+        self.assertEqual(fetcher.stats(), {"http_pages": 0, "browser_pages": 2, "static_misses": 1})
+        self.assertTrue(looks_like_js_shell(SHELL_PAGE))
+        self.assertFalse(looks_like_js_shell(PRODUCT_PAGE))
+        self.assertTrue(has_product_data('<meta content="product" property="og:type">'))
+        self.assertFalse(has_product_data(SHELL_PAGE))
+
+class TestPageReadiness(unittest.TestCase):
+    def _page(self, idle_s, selector_s, image_counts):
+        from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+        async def wait(delay, timeout):
+            if delay is None or delay * 1000 > timeout:
+                await asyncio.sleep(timeout / 1000)
+                raise PlaywrightTimeoutError("timeout")
+            await asyncio.sleep(delay)
+        async def wait_for_load_state(state, timeout):
+            await wait(idle_s, timeout)
+        async def wait_for_selector(selector, state, timeout):
+            await wait(selector_s, timeout)
+        page = MagicMock()
+        page.wait_for_load_state = AsyncMock(side_effect=wait_for_load_state)
+        page.wait_for_selector = AsyncMock(side_effect=wait_for_selector)
+        # (image count, at bottom) per scroll step
+        page.evaluate = AsyncMock(side_effect=[(n, i >= 2) for i, n in enumerate(image_counts)])
+        return page
+
+    def test_selectors_beat_busy_network_and_scroll_stops_when_images_settle(self):
+        import time
+        from unittest.mock import patch
+        from app.services.scraper.readiness import wait_until_ready
+        page = self._page(idle_s=None, selector_s=0.01, image_counts=[2, 5, 8, 8, 8, 8, 8])
+        with patch("app.services.scraper.readiness.settings") as settings:
+            settings.SCRAPER_READY_SELECTORS = {"shop.com": [".price", "h1"]}
+            settings.SCRAPER_NETWORK_IDLE_TIMEOUT_S = 3.0
+            settings.SCRAPER_SCROLL_STEP_S = 0.0
+            settings.SCRAPER_SCROLL_STABLE_STEPS = 2
+            settings.SCRAPER_MAX_SCROLL_STEPS = 20
+            started_at = time.monotonic()
+            ready = asyncio.run(wait_until_ready(page, "https://www.shop.com/p/1", time.monotonic() + 5))
+
+        self.assertLess(time.monotonic() - started_at, 1.0)
+        self.assertEqual((ready.signal, ready.scroll_steps, ready.images), ("selectors", 5, 8))
+        self.assertEqual([c.args[0] for c in page.wait_for_selector.call_args_list], [".price", "h1"])
+
+    def test_deadline_bounds_a_page_that_never_settles(self):
+        import time
+        from unittest.mock import patch
+        from app.services.scraper.readiness import wait_until_ready
+        page = self._page(idle_s=None, selector_s=None, image_counts=list(range(100)))
+        with patch("app.services.scraper.readiness.settings") as settings:
+            settings.SCRAPER_READY_SELECTORS = {}
+            settings.SCRAPER_DEFAULT_READY_SELECTORS = ["h1"]
+            settings.SCRAPER_NETWORK_IDLE_TIMEOUT_S = 0.1
+            settings.SCRAPER_SCROLL_STEP_S = 0.05
+            settings.SCRAPER_SCROLL_STABLE_STEPS = 2
+            settings.SCRAPER_MAX_SCROLL_STEPS = 100
+            started_at = time.monotonic()
+            ready = asyncio.run(wait_until_ready(page, "https://example.com/p/1", time.monotonic() + 0.5))
+
+        self.assertLess(time.monotonic() - started_at, 0.8)
+        self.assertEqual(ready.signal, "deadline")
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -3,9 +3,11 @@ from unittest.mock import MagicMock, patch
 import os
 import shutil
 import tempfile
+import time
 import numpy as np
 import torch
 from app.services.tryon_3d.core import ReconstructionPipeline
+from app.services.tryon_3d.registry import ModelRegistry
 
 class TestReconstructionPipeline(unittest.TestCase):
     def setUp(self):
@@ -14,35 +16,501 @@ class TestReconstructionPipeline(unittest.TestCase):
     def tearDown(self):
         shutil.rmtree(self.test_dir)
 
+    def _write_views(self, count):
+        import cv2
+        paths = []
+        for i in range(count):
+            path = os.path.join(self.test_dir, f"view_{i}.jpg")
+            cv2.imwrite(path, np.full((640, 480, 3), 40 * i, dtype=np.uint8))
+            paths.append(path)
+        return paths
+
     @patch('app.services.tryon_3d.core.PixieWrapper')
     @patch('app.services.tryon_3d.core.PifuhdWrapper')
     def test_pipeline_flow(self, MockPifuhd, MockPixie):
+        from app.services.tryon_3d.wrappers.models import PifuhdWrapper, PixieWrapper
+
         # Setup Mocks
         mock_pixie = MockPixie.return_value
-        mock_pixie.predict.return_value = {"betas": torch.tensor([1.0])}
+        mock_pixie.predict.side_effect = lambda x: {"betas": torch.ones((x.shape[0], 10))}
+        mock_pixie.fuse.side_effect = PixieWrapper.fuse
+        mock_pixie.body_mesh.return_value = (
+            np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]], dtype=np.float32), np.array([[0, 1, 2]], dtype=np.int32)
+        )
         
         mock_pifuhd = MockPifuhd.return_value
-        mock_pifuhd.predict.return_value = (
-            np.zeros((10, 3)), # Vertices
-            np.zeros((10, 3), dtype=np.int32) # Faces
+        mock_pifuhd.encode.side_effect = lambda x: x.mean(dim=1)
+        mock_pifuhd.fuse.side_effect = PifuhdWrapper.fuse
+        mock_pifuhd.reconstruct.return_value = (
+            np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float32), # Vertices
+            np.array([[0, 2, 1], [0, 1, 3], [0, 3, 2], [1, 2, 3]], dtype=np.int32) # Faces
         )
         
-        pipeline = ReconstructionPipeline()
+        pipeline = ReconstructionPipeline(max_batch_size=2)
         
         # Execute
+        events = []
         results = pipeline.process_images(
-            image_paths=["dummy.jpg"],
-            output_dir=self.test_dir
+            image_paths=self._write_views(3),
+            output_dir=self.test_dir,
+            progress=lambda stage, data: events.append((stage, data)),
         )
         
         # Verify
         self.assertIn("mesh_path", results)
         self.assertTrue(os.path.exists(results["mesh_path"]))
         self.assertTrue(results["mesh_path"].endswith(".glb"))
+        self.assertTrue(os.path.exists(results["lod_manifest_path"]))
+        self.assertEqual(results["num_views"], 3)
+        from app.services.tryon_3d.exporters import Exporter
+        self.assertNotIn("smplx_params", results)
+        self.assertEqual(Exporter.load_smplx_params(results["smplx_params_path"])["betas"].shape, (1, 10))
+
+        # Every stage reports in order; the coarse body mesh is out before PIFuHD runs
+        from app.services.tryon_3d.progress import STAGES
+        self.assertEqual(tuple(stage for stage, _ in events), STAGES)
+        self.assertTrue(os.path.exists(events[1][1]["artifacts"]["smplx_mesh_path"]))
+        self.assertEqual(set(results["timings"]["stages_s"]), set(STAGES))
         
-        # Verify calls
+        # Verify calls: 3 views in chunks of 2, fused into one reconstruction
         mock_pixie.load.assert_called()
         mock_pifuhd.load.assert_called()
+        self.assertEqual([c.args[0].shape[0] for c in mock_pixie.predict.call_args_list], [2, 1])
+        self.assertEqual(mock_pifuhd.reconstruct.call_args.args[0].shape, (1, 512, 512))
+
+    @patch('app.services.tryon_3d.core.PixieWrapper')
+    @patch('app.services.tryon_3d.core.PifuhdWrapper')
+    def test_next_inference_overlaps_previous_export(self, MockPifuhd, MockPixie):
+        import threading
+        from app.services.tryon_3d.exporters import Exporter
+        from app.services.tryon_3d.wrappers.models import PixieWrapper
+        mock_pixie = MockPixie.return_value
+        mock_pixie.predict.side_effect = lambda x: {"betas": torch.ones((x.shape[0], 10))}
+        mock_pixie.fuse.side_effect = PixieWrapper.fuse
+        mock_pixie.body_mesh.return_value = (np.eye(3, dtype=np.float32), np.array([[0, 1, 2]]))
+        second_inference = threading.Event()
+        def reconstruct(features, plan):
+            if threading.current_thread().name == "second":
+                second_inference.set()
+            return np.eye(3, dtype=np.float32), np.array([[0, 1, 2]])
+        MockPifuhd.return_value.reconstruct.side_effect = reconstruct
+
+        overlapped = []
+        def save_lods(vertices, faces, path, **kwargs):
+            if "first" in path:
+                overlapped.append(second_inference.wait(timeout=5))
+            return {"manifest_path": path}
+
+        pipeline = ReconstructionPipeline()
+        views = self._write_views(1)
+        with patch.object(Exporter, "save_lods", side_effect=save_lods), patch.object(Exporter, "render_preview"):
+            first = threading.Thread(target=pipeline.process_images, args=(views, os.path.join(self.test_dir, "first")), name="first")
+            first.start()
+            while not mock_pixie.body_mesh.called:
+                time.sleep(0.01)
+            second = threading.Thread(target=pipeline.process_images, args=(views, os.path.join(self.test_dir, "second")), name="second")
+            second.start()
+            first.join()
+            second.join()
+
+        # The first job's export waited for the second job's inference, so it didn't hold the GPU section
+        self.assertEqual(overlapped, [True])
+
+    def test_views_are_letterboxed_and_normalized(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from app.services.tryon_3d.utils import load_views
+
+        with ThreadPoolExecutor(2) as executor:
+            views = load_views(self._write_views(2), executor, size=64)
+        self.assertEqual(tuple(views.shape), (2, 3, 64, 64))
+        # 480x640 portrait: black bars left and right, image in the middle
+        self.assertEqual(views[1, 0, 32, 0].item(), -1.0)
+        self.assertAlmostEqual(views[1, 0, 32, 32].item(), 40 / 127.5 - 1.0, places=2)
+
+class TestPreviewRasterizer(unittest.TestCase):
+    def test_points_keep_orientation(self):
+        from app.services.tryon_3d.exporters import Exporter
+        # x -> column, y -> row
+        vertices = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+        img = Exporter.rasterize(vertices, np.zeros((0, 3)), resolution=32)
+        self.assertEqual((img[0, 0], img[0, 31], img[31, 0], img[31, 31]), (255, 255, 255, 0))
+
+    def test_mesh_zbuffer_keeps_nearest_triangle(self):
+        from app.services.tryon_3d.exporters import Exporter
+        # Two overlapping squares facing the camera; the far one is tilted so it shades darker
+        vertices = np.array([
+            [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1],
+            [0, 0, -1], [1, 0, -1.5], [1, 1, -1.5], [0, 1, -1],
+        ], dtype=np.float64)
+        faces = np.array([[0, 1, 2], [0, 2, 3], [4, 5, 6], [4, 6, 7]])
+        front = Exporter.rasterize(vertices, faces, resolution=64, mode="mesh")
+        back = Exporter.rasterize(vertices, faces, resolution=64, yaw=180.0, mode="mesh")
+
+        self.assertTrue((front > 0).all())
+        self.assertEqual(int(front[32, 32]), 255)
+        self.assertLess(int(back[32, 32]), 255)
+
+    def test_side_views_see_the_near_side_lit_head_on(self):
+        from app.services.tryon_3d.exporters import Exporter
+        # A square in the x=-1 plane and a tilted one beyond x=+1; at yaw 90 the camera looks from -x
+        vertices = np.array([
+            [-1, 0, 0], [-1, 0, 1], [-1, 1, 1], [-1, 1, 0],
+            [1, 0, 0], [1.5, 0, 1], [1.5, 1, 1], [1, 1, 0],
+        ], dtype=np.float64)
+        faces = np.array([[0, 1, 2], [0, 2, 3], [4, 5, 6], [4, 6, 7]])
+        left = Exporter.rasterize(vertices, faces, resolution=64, yaw=90.0, mode="mesh")
+        right = Exporter.rasterize(vertices, faces, resolution=64, yaw=-90.0, mode="mesh")
+        self.assertEqual(int(left[32, 32]), 255)
+        self.assertLess(int(right[32, 32]), 255)
+
+        # A face turned 45 degrees towards -x faces a camera at yaw 45 head-on
+        diagonal = np.array([[0, 0, 0], [1, 0, 1], [1, 1, 1], [0, 1, 0]], dtype=np.float64)
+        quad = np.array([[0, 1, 2], [0, 2, 3]])
+        self.assertGreaterEqual(int(Exporter.rasterize(diagonal, quad, resolution=64, yaw=45.0, mode="mesh")[32, 32]), 250)
+
+    def test_multiple_views_side_by_side(self):
+        import cv2
+        import trimesh
+        from app.services.tryon_3d.exporters import Exporter
+        mesh = trimesh.creation.icosphere(subdivisions=3)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Exporter.render_preview(mesh.vertices, mesh.faces, os.path.join(tmp, "p.png"),
+                                           resolution=96, views=("front", "right", 45), mode="mesh")
+            self.assertEqual(cv2.imread(path).shape, (96, 288, 3))
+
+class TestLODExport(unittest.TestCase):
+    def test_clean_drops_duplicates_degenerates_and_unused(self):
+        from app.services.tryon_3d.lod import clean_mesh
+        vertices = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [1, 0, 0], [5, 5, 5]], dtype=np.float64)
+        faces = np.array([[0, 1, 2], [0, 3, 2], [0, 1, 1]])
+        v, f = clean_mesh(vertices, faces)
+        self.assertEqual((len(v), len(f)), (3, 1))
+
+    def test_lods_and_manifest(self):
+        import json
+        import struct
+        import trimesh
+        from app.services.tryon_3d.exporters import Exporter
+        mesh = trimesh.creation.icosphere(subdivisions=4)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "reconstruction.glb")
+            result = Exporter.save_lods(mesh.vertices, mesh.faces, path, ratios=(1.0, 0.1))
+            with open(result["manifest_path"]) as f:
+                manifest = json.load(f)
+            with open(path, "rb") as f:
+                glb = f.read()
+
+        # Coarsest first, each level smaller than the one above it
+        self.assertEqual([l["file"] for l in manifest["lods"]], ["reconstruction.lod1.glb", "reconstruction.glb"])
+        coarse, full = manifest["lods"]
+        self.assertEqual(full["faces"], len(mesh.faces))
+        self.assertLessEqual(coarse["faces"], 0.1 * len(mesh.faces))
+        self.assertLess(coarse["bytes"], full["bytes"] / 5)
+
+        # Quantized positions decode back to the sphere through the node transform
+        json_length = struct.unpack_from("<I", glb, 12)[0]
+        gltf = json.loads(glb[20:20 + json_length])
+        self.assertIn("KHR_mesh_quantization", gltf["extensionsRequired"])
+        view = gltf["bufferViews"][0]
+        start = 20 + json_length + 8 + view["byteOffset"]
+        quantized = np.frombuffer(glb[start:start + view["byteLength"]], dtype=np.uint16).reshape(-1, 4)[:, :3]
+        node = gltf["nodes"][0]
+        positions = quantized * np.array(node["scale"]) + np.array(node["translation"])
+        self.assertAlmostEqual(np.abs(np.linalg.norm(positions, axis=1) - 1).max(), 0, places=3)
+
+class TestSurfaceExtraction(unittest.TestCase):
+    def test_blocks_are_welded_watertight(self):
+        import trimesh
+        from app.services.tryon_3d.surface import extract_surface, plan_extraction
+        queries = []
+        def sphere(points):
+            queries.append(len(points))
+            return (np.linalg.norm(points, axis=1) < 0.6).astype(np.float32)
+
+        # 8 MB allows 32^3 blocks, so the 128^3 grid is split into 64
+        plan = plan_extraction(128, 8, coarse_resolution=16)
+        self.assertEqual(plan.block_size, 32)
+        vertices, faces = extract_surface(sphere, plan)
+
+        mesh = trimesh.Trimesh(vertices, faces, process=False)
+        self.assertTrue(mesh.is_watertight)
+        self.assertAlmostEqual(mesh.volume, 4 / 3 * np.pi * 0.6 ** 3, delta=0.02)
+        # Only points near the surface are queried
+        self.assertLess(sum(queries), 0.5 * 129 ** 3)
+        self.assertLessEqual(max(queries), plan.points_per_query)
+
+    def test_resolution_must_align_with_coarse_grid(self):
+        from app.services.tryon_3d.surface import plan_extraction
+        with self.assertRaises(ValueError):
+            plan_extraction(96, 64)
+
+class TestProgressEvents(unittest.TestCase):
+    def test_publisher_appends_to_task_stream(self):
+        import json
+        from app.services.tryon_3d.progress import ProgressPublisher
+        client = MagicMock()
+        pipe = client.pipeline.return_value
+        ProgressPublisher(client, "task-1", maxlen=10, ttl=60).stage("pixie", {"duration_s": 1.5})
+
+        key, fields = pipe.xadd.call_args.args
+        self.assertEqual(key, "tryon3d:progress:task-1")
+        self.assertEqual(fields["event"], "stage")
+        data = json.loads(fields["data"])
+        self.assertEqual((data["stage"], data["progress"], data["duration_s"]), ("pixie", 0.4, 1.5))
+        pipe.expire.assert_called_with(key, 60)
+
+    def test_reader_relays_sse_until_terminal_event(self):
+        import asyncio
+        from unittest.mock import AsyncMock
+        from app.services.tryon_3d.progress import ProgressReader
+        key = "tryon3d:progress:task-1"
+        client = MagicMock()
+        client.xread = AsyncMock(side_effect=[
+            [[key, [("1-0", {"event": "stage", "data": "{}"})]]],
+            [],
+            [[key, [("2-0", {"event": "completed", "data": "{}"}), ("3-0", {"event": "stage", "data": "{}"})]]],
+        ])
+
+        async def collect():
+            return [chunk async for chunk in ProgressReader(client).sse("task-1", "0-5")]
+
+        chunks = asyncio.run(collect())
+        self.assertEqual(chunks, [
+            "id: 1-0\nevent: stage\ndata: {}\n\n",
+            ": keep-alive\n\n",
+            "id: 2-0\nevent: completed\ndata: {}\n\n",
+        ])
+        # Resumes after the client's last event, then after each one relayed
+        self.assertEqual([c.args[0][key] for c in client.xread.call_args_list], ["0-5", "1-0", "1-0"])
+
+class TestArtifactStore(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _result(self, name, size):
+        import json
+        out = os.path.join(self.test_dir, name)
+        os.makedirs(out)
+        with open(os.path.join(out, "reconstruction.glb"), "wb") as f:
+            f.write(b"\0" * size)
+        with open(os.path.join(out, "reconstruction.lod1.glb"), "wb") as f:
+            f.write(b"\0" * 10)
+        with open(os.path.join(out, "reconstruction.lods.json"), "w") as f:
+            json.dump({"lods": [{"file": "reconstruction.lod1.glb"}, {"file": "reconstruction.glb"}]}, f)
+        return {
+            "mesh_path": os.path.join(out, "reconstruction.glb"),
+            "lod_manifest_path": os.path.join(out, "reconstruction.lods.json"),
+            "smplx_params": {"betas": [[0.0] * 10]},
+        }
+
+    def test_hit_returns_stored_artifacts_and_lru_evicts(self):
+        from app.services.tryon_3d.artifacts import ArtifactStore
+        store = ArtifactStore(os.path.join(self.test_dir, "store"), max_bytes=3000) # Room for two entries
+        self.assertIsNone(store.get("a" * 64))
+
+        stored = store.put("a" * 64, self._result("a", 1000))
+        shutil.rmtree(os.path.join(self.test_dir, "a")) # The job's output dir can go away
+        hit = store.get("a" * 64)
+        self.assertEqual(hit, stored)
+        self.assertTrue(os.path.exists(os.path.join(os.path.dirname(hit["mesh_path"]), "reconstruction.lod1.glb")))
+        self.assertEqual(hit["smplx_params"], {"betas": [[0.0] * 10]})
+
+        # "a" was used more recently than "b", so "b" goes when "c" exceeds the quota
+        store.put("b" * 64, self._result("b", 1000))
+        os.utime(os.path.join(store._dir("b" * 64), "result.json"), (0, 0))
+        store.get("a" * 64)
+        store.put("c" * 64, self._result("c", 1000))
+        self.assertIsNone(store.get("b" * 64))
+        self.assertIsNotNone(store.get("a" * 64))
+        self.assertIsNotNone(store.get("c" * 64))
+        self.assertEqual(store.evictions, 1)
+
+    def test_rewriting_outputs_after_put_leaves_the_entry_unchanged(self):
+        from app.services.tryon_3d.artifacts import ArtifactStore
+        store = ArtifactStore(os.path.join(self.test_dir, "store"), max_bytes=10 ** 6)
+        result = self._result("a", 100)
+        stored = store.put("a" * 64, result)
+        # A rerun into the same output dir rewrites the files in place
+        with open(result["mesh_path"], "wb") as f:
+            f.write(b"\1" * 50)
+        with open(stored["mesh_path"], "rb") as f:
+            self.assertEqual(f.read(), b"\0" * 100)
+
+    @patch("app.services.tryon_3d.tasks.reconstruction_key", return_value="k" * 64)
+    @patch("app.services.tryon_3d.tasks.get_artifact_store", return_value=None)
+    @patch("app.services.tryon_3d.tasks.get_redis")
+    def test_failed_enqueue_releases_claim_and_user_slot(self, get_redis, _, __):
+        from app.services.tryon_3d import tasks
+        client = get_redis.return_value
+        client.set.return_value = True
+        client.pipeline.return_value.execute.return_value = [1, True]
+
+        with patch.object(tasks.reconstruct_3d_task, "apply_async", side_effect=ConnectionError("broker down")):
+            with self.assertRaises(ConnectionError):
+                tasks.submit_reconstruction(["a.jpg"], "/tmp/out", user_id="u1")
+
+        task_id = client.set.call_args.args[1]
+        client.eval.assert_called_once_with(tasks._RELEASE_SCRIPT, 1, tasks.inflight_key("k" * 64), task_id)
+        client.decr.assert_called_once_with("tryon3d:user_jobs:u1")
+
+    @patch("app.services.tryon_3d.tasks.get_pipeline")
+    @patch("app.services.tryon_3d.tasks.get_artifact_store", return_value=None)
+    @patch("app.services.tryon_3d.tasks.get_redis")
+    def test_task_returns_before_exports_and_completes_after(self, get_redis, _, get_pipeline):
+        import json
+        from concurrent.futures import Future
+        from app.services.tryon_3d import tasks
+        from app.services.tryon_3d.progress import COMPLETED
+        client = get_redis.return_value
+        exports = Future()
+        get_pipeline.return_value.reconstruct.return_value = exports
+
+        returned = tasks.reconstruct_3d_task.apply(
+            (["a.jpg"], "/tmp/out"), {"cache_key": "k" * 64, "user_id": "u1"}, task_id="t1",
+        ).get()
+
+        # Inference done: the worker is free, but the job still holds its claim until the exports land
+        self.assertEqual((returned["status"], returned["cached"]), ("exporting", False))
+        self.assertEqual(returned["result"]["mesh_path"], "/tmp/out/reconstruction.glb")
+        self.assertEqual(returned["result"]["preview_path"], "/tmp/out/preview.png")
+        client.eval.assert_not_called()
+        client.decr.assert_not_called()
+
+        exports.set_result({"mesh_path": "/tmp/out/reconstruction.glb"})
+        event = client.pipeline.return_value.xadd.call_args.args[1]
+        completed = json.loads(event["data"])
+        self.assertEqual(event["event"], COMPLETED)
+        self.assertEqual(completed["result"], {"mesh_path": "/tmp/out/reconstruction.glb"})
+        client.eval.assert_called_once_with(tasks._RELEASE_SCRIPT, 1, tasks.inflight_key("k" * 64), "t1")
+        client.decr.assert_called_once_with("tryon3d:user_jobs:u1")
+
+    @patch("app.services.tryon_3d.tasks.get_pipeline")
+    @patch("app.services.tryon_3d.tasks.get_artifact_store", return_value=None)
+    @patch("app.services.tryon_3d.tasks.get_redis")
+    def test_task_result_references_smplx_params_file(self, _, __, get_pipeline):
+        from concurrent.futures import Future
+        from app.services.tryon_3d import tasks
+        get_pipeline.return_value.reconstruct.return_value = Future()
+
+        returned = tasks.reconstruct_3d_task.apply((["a.jpg"], "/tmp/out"), task_id="t1").get()
+        # A reference to the binary params, not the arrays themselves
+        self.assertEqual(returned["result"]["smplx_params_path"], "/tmp/out/smplx_params.npz")
+        self.assertNotIn("smplx_params", returned["result"])
+
+    @patch("app.services.tryon_3d.tasks.reconstruction_key", return_value="k" * 64)
+    @patch("app.services.tryon_3d.tasks.get_artifact_store", return_value=None)
+    @patch("app.services.tryon_3d.tasks.get_redis")
+    def test_identical_submissions_attach_to_one_job(self, get_redis, _, __):
+        from app.services.tryon_3d import tasks
+        claims = {}
+        client = get_redis.return_value
+        client.set.side_effect = lambda key, value, nx, ex: claims.setdefault(key, value) == value
+        client.get.side_effect = claims.get
+
+        with patch.object(tasks.reconstruct_3d_task, "apply_async") as apply_async:
+            first = tasks.submit_reconstruction(["a.jpg"], "/tmp/out1")
+            second = tasks.submit_reconstruction(["a.jpg"], "/tmp/out2")
+
+        self.assertEqual((first["status"], second["status"]), ("queued", "attached"))
+        self.assertEqual(second["task_id"], first["task_id"])
+        apply_async.assert_called_once()
+        self.assertEqual(apply_async.call_args.kwargs["task_id"], first["task_id"])
+
+class TestJobRouting(unittest.TestCase):
+    def test_routes_by_cost_and_workers_claim_only_what_fits(self):
+        from app.services.tryon_3d.routing import estimate_cost, route, worker_queues
+        tiers = [8, 16, 24]
+        preview = estimate_cost(num_views=1, surface_resolution=128)
+        full = estimate_cost(num_views=8, surface_resolution=512)
+        self.assertLess(preview.gpu_memory_mb, full.gpu_memory_mb)
+        self.assertEqual(route(preview, tiers_gb=tiers), "tryon3d.interactive.8g")
+        self.assertEqual(route(full, tiers_gb=tiers), "tryon3d.batch.16g")
+        self.assertEqual(route(preview, interactive=False, tiers_gb=tiers), "tryon3d.batch.8g")
+
+        # Interactive first; larger tiers first within a class; nothing above capacity
+        self.assertEqual(worker_queues(16384, tiers_gb=tiers), [
+            "tryon3d.interactive.16g", "tryon3d.interactive.8g", "tryon3d.batch.16g", "tryon3d.batch.8g",
+        ])
+
+    def test_worker_polls_interactive_before_batch(self):
+        import random
+        from kombu import Connection
+        import kombu.transport.redis as kombu_redis
+        from app.services.tryon_3d.routing import fairness_priority, worker_queues
+        from app.services.tryon_3d.worker import celery_app
+        queues = worker_queues(16384, tiers_gb=[8, 16])
+
+        with patch.object(kombu_redis.Channel, "_create_client", return_value=MagicMock()):
+            connection = Connection("redis://localhost:6379/0", transport_options=celery_app.conf.broker_transport_options)
+            channel = connection.channel()
+            for queue in random.sample(queues, len(queues)):
+                channel.basic_consume(queue, no_ack=True, callback=lambda message: None, consumer_tag=queue)
+            # A fresh user's batch job and an interactive job of a user with two jobs running
+            pending = {
+                channel._q_for_pri("tryon3d.batch.16g", fairness_priority(0, "tryon3d.batch.16g")): "batch",
+                channel._q_for_pri("tryon3d.interactive.8g", fairness_priority(2, "tryon3d.interactive.8g")): "interactive",
+            }
+            channel._brpop_start()
+            keys = channel.client.connection.send_command.call_args.args[1:-1]
+            channel._in_poll = None # No BRPOP reply to read on close
+            connection.release()
+
+        # BRPOP pops from the first non-empty list among its keys
+        self.assertEqual(next(pending[key] for key in keys if key in pending), "interactive")
+        self.assertEqual(list(keys[:len(queues)]), queues)
+
+    def test_queue_metrics_sum_priority_lists(self):
+        import asyncio
+        from unittest.mock import AsyncMock
+        from app.services.tryon_3d.routing import PRIORITY_SEP, queue_metrics
+        lengths = {"q": 2, f"q{PRIORITY_SEP}3": 1}
+        pipe = MagicMock()
+        calls = []
+        pipe.llen.side_effect = lambda key: calls.append(lengths.get(key, 0))
+        pipe.lrange.side_effect = lambda key, start, end: calls.append(["100.0", "300.0", "200.0"])
+        pipe.execute = AsyncMock(side_effect=lambda: calls)
+        client = MagicMock()
+        client.pipeline.return_value = pipe
+
+        metrics = asyncio.run(queue_metrics(client, ["q"]))
+        self.assertEqual(metrics["q"]["depth"], 3)
+        self.assertEqual((metrics["q"]["wait_ms"]["count"], metrics["q"]["wait_ms"]["p50"]), (3, 200.0))
+
+class TestModelRegistry(unittest.TestCase):
+    def _registry(self):
+        def factory():
+            model = MagicMock()
+            model.load.side_effect = lambda device: setattr(model, "device", device)
+            return model
+        return ModelRegistry({"pixie": factory, "pifuhd": factory}, min_free_gpu_fraction=0.2)
+
+    def test_models_are_loaded_once(self):
+        registry = self._registry()
+        first = registry.get("pixie", "cpu")
+        self.assertIs(registry.get("pixie", "cpu"), first)
+        registry.preload("cpu")
+        self.assertEqual(registry.loads, 2)
+        first.load.assert_called_once_with("cpu")
+
+    @patch('app.services.tryon_3d.registry.GPUMemoryManager.cleanup')
+    def test_evicts_least_recently_used_under_pressure(self, _):
+        registry = self._registry()
+        pixie = registry.get("pixie", "cpu")
+        registry.get("pifuhd", "cpu")
+        registry.get("pixie", "cpu")
+
+        with patch.object(ModelRegistry, 'free_gpu_fraction', side_effect=[0.5]):
+            self.assertEqual(registry.relieve_memory_pressure(), 0)
+        # Still short after the cache flush, enough once one model is gone
+        with patch.object(ModelRegistry, 'free_gpu_fraction', side_effect=[0.1, 0.1, 0.3, 0.3]):
+            self.assertEqual(registry.relieve_memory_pressure(), 1)
+
+        self.assertFalse(registry.is_loaded("pifuhd"))
+        self.assertTrue(registry.is_loaded("pixie"))
+        pixie.unload.assert_not_called()
 
 if __name__ == '__main__':
     unittest.main()
@@ -2,9 +2,17 @@ import unittest
 import numpy as np
 import torch
 import os
+import asyncio
 from unittest.mock import MagicMock, patch
 from app.services.tryon_fast.utils import ImageUtils
-from app.services.tryon_fast.core import TryOnEngine
+from app.services.tryon_fast.core import TryOnEngine, TryOnRequest, variant_model_path
+from app.services.tryon_fast.metrics import LatencyHistogram
+from app.services.tryon_fast.batching import MicroBatcher
+from app.services.tryon_fast.execution import ExecutionContextPool
+from app.services.tryon_fast.async_engine import AsyncTryOnEngine, plan_threads
+from app.services.tryon_fast.pool import EnginePool, assign_cpus, parse_cpulist
+from app.services.tryon_fast.cache import DiskResultStore, MemoryLRUCache, ResultCache, result_cache_key
+from app.core.exceptions import ServiceException
 
 class TestImageUtils(unittest.TestCase):
     def test_keypoints_to_heatmap(self):
@@ -19,6 +27,19 @@ class TestImageUtils(unittest.TestCase):
         self.assertTrue(heatmap[0, 0, 10, 10] > 0.9) # Peak at center
         self.assertTrue(heatmap[0, 0, 0, 0] < 0.1)   # Low far away
 
+    def test_keypoints_to_heatmap_batch(self):
+        # Second set has an invisible keypoint and a negative coordinate
+        kps = np.array([
+            [[10, 10, 1], [30, 40, 1]],
+            [[20, 5, 0.0], [-1, 40, 1]],
+        ], dtype=np.float32)
+        heatmap = ImageUtils.keypoints_to_heatmap(kps, 64, 64, num_keypoints=3, device="cpu")
+
+        self.assertEqual(heatmap.shape, (2, 3, 64, 64))
+        self.assertAlmostEqual(heatmap[0, 1, 40, 30].item(), 1.0, places=5)
+        self.assertEqual(heatmap[1].abs().sum().item(), 0.0) # Both masked
+        self.assertEqual(heatmap[:, 2].abs().sum().item(), 0.0) # Padded keypoint slot
+
     def test_preprocess_image(self):
         # Create a random image
         img = np.zeros((100, 100, 3), dtype=np.uint8)
@@ -29,6 +50,62 @@ class TestImageUtils(unittest.TestCase):
         self.assertEqual(tensor.shape, (1, 3, 256, 192))
         self.assertIsInstance(tensor, torch.Tensor)
 
+    def test_preprocess_image_into_fuses_swap_and_normalize(self):
+        img = np.zeros((100, 80, 3), dtype=np.uint8)
+        img[..., 0] = 255 # Blue in BGR
+
+        out = torch.full((2, 3, 64, 48), 7.0)
+        ImageUtils.preprocess_image_into(img, out[1])
+
+        self.assertTrue(torch.all(out[0] == 7.0)) # Other rows untouched
+        self.assertTrue(torch.allclose(out[1, 0], torch.tensor(-1.0))) # R
+        self.assertTrue(torch.allclose(out[1, 2], torch.tensor(1.0)))  # B
+
+    def test_preprocess_mask_into_binarizes(self):
+        mask = np.array([[0, 127], [128, 255]], dtype=np.uint8)
+        out = torch.empty((1, 2, 2))
+        ImageUtils.preprocess_mask_into(mask, out)
+        self.assertEqual(out[0].tolist(), [[0.0, 0.0], [1.0, 1.0]])
+
+    def test_reduced_decode_for_large_sources(self):
+        import cv2
+        img = np.full((1024, 768, 3), 128, dtype=np.uint8)
+        jpeg = cv2.imencode(".jpg", img)[1].tobytes()
+        png = cv2.imencode(".png", img)[1].tobytes()
+
+        self.assertEqual(ImageUtils.probe_size(jpeg), (1024, 768))
+        self.assertEqual(ImageUtils.probe_size(png), (1024, 768))
+        self.assertEqual(ImageUtils.decode(jpeg, (256, 192)).shape, (256, 192, 3))
+        self.assertEqual(ImageUtils.decode(png, (300, 192)).shape, (512, 384, 3)) # 4x would undershoot
+
+        out = torch.empty((3, 256, 192))
+        ImageUtils.preprocess_image_into(jpeg, out)
+        self.assertLess(out.abs().max().item(), 0.05) # Mid grey ~ 0
+
+    def test_encode_formats(self):
+        tensor = torch.zeros((1, 3, 32, 24))
+
+        self.assertTrue(ImageUtils.tensor_to_bytes(tensor).startswith(b"\x89PNG"))
+        self.assertTrue(ImageUtils.tensor_to_bytes(tensor, "jpeg", quality=70).startswith(b"\xff\xd8"))
+        self.assertEqual(ImageUtils.tensor_to_bytes(tensor, "webp")[8:12], b"WEBP")
+
+        raw = ImageUtils.tensor_to_bytes(tensor, "raw")
+        self.assertIsInstance(raw, memoryview)
+        self.assertEqual(raw.nbytes, 32 * 24 * 3)
+        self.assertEqual(raw[0], 127) # 0 in [-1, 1] -> mid grey
+
+        with self.assertRaises(ValueError):
+            ImageUtils.tensor_to_bytes(tensor, "gif")
+
+    def test_encode_batch_in_parallel(self):
+        from concurrent.futures import ThreadPoolExecutor
+        images = ImageUtils.tensor_to_uint8(torch.zeros((3, 3, 16, 16)))
+        with ThreadPoolExecutor(2) as executor:
+            encoded = ImageUtils.encode_batch(images, [("png", None), ("jpeg", 50), ("png", 9)], executor)
+
+        self.assertEqual(len(encoded), 3)
+        self.assertTrue(encoded[1].startswith(b"\xff\xd8"))
+
 class TestTryOnEngine(unittest.TestCase):
     
     @patch('app.services.tryon_fast.core.ort.InferenceSession')
@@ -57,6 +134,367 @@ class TestTryOnEngine(unittest.TestCase):
             if os.path.exists("dummy_model.onnx"):
                 os.remove("dummy_model.onnx")
 
+    @patch('app.services.tryon_fast.core.ort.InferenceSession')
+    def test_warmup_pads_batches_to_buckets(self, mock_session):
+        output_meta = MagicMock()
+        output_meta.name = "output"
+        output_meta.type = "tensor(float)"
+        mock_session.return_value.get_outputs.return_value = [output_meta]
+
+        with open("dummy_model.onnx", "w") as f:
+            f.write("dummy")
+        try:
+            engine = TryOnEngine("dummy_model.onnx", batch_buckets=[1, 4])
+        finally:
+            os.remove("dummy_model.onnx")
+
+        self.assertFalse(engine.ready)
+        engine.warmup(iterations=1)
+        self.assertTrue(engine.ready)
+        self.assertIsNotNone(engine.cold_start_s)
+        self.assertEqual(engine.contexts.size(), 2)
+
+        # 3 requests run on the warmed batch-4 context instead of creating a new shape
+        mask = np.zeros((256, 192), dtype=np.uint8)
+        texture = np.zeros((256, 192, 3), dtype=np.uint8)
+        kps = np.zeros((18, 3), dtype=np.float32)
+        results = engine.process_batch([TryOnRequest(mask, mask, texture, kps)] * 3)
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(engine.contexts.size(), 2)
+        self.assertEqual(engine.startup_stats()["first_requests"]["count"], 3)
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_stops_after_max_samples(self):
+        hist = LatencyHistogram(buckets_ms=(10, 100), max_samples=3)
+        for value in (5, 50, 500, 1):
+            hist.observe(value)
+
+        snapshot = hist.snapshot()
+        self.assertEqual(snapshot["count"], 3)
+        self.assertEqual(snapshot["buckets"], {"le_10ms": 1, "le_100ms": 1, "le_inf": 1})
+        self.assertEqual(snapshot["max_ms"], 500)
+
+class TestExecutionContextPool(unittest.TestCase):
+
+    def _factory(self, batch_size):
+        ctx = MagicMock()
+        ctx.batch_size = batch_size
+        return ctx
+
+    def test_contexts_are_reused_per_batch_size(self):
+        pool = ExecutionContextPool(self._factory, max_per_batch_size=2)
+
+        with pool.checkout(1) as a:
+            pass
+        with pool.checkout(1) as b:
+            pass
+        with pool.checkout(4) as c:
+            pass
+
+        self.assertIs(a, b)
+        self.assertEqual(c.batch_size, 4)
+        self.assertEqual(pool.size(), 2)
+
+    def test_checkout_blocks_when_exhausted(self):
+        import threading
+        pool = ExecutionContextPool(self._factory, max_per_batch_size=1)
+        first = pool.acquire(1)
+        acquired = []
+
+        t = threading.Thread(target=lambda: acquired.append(pool.acquire(1)))
+        t.start()
+        t.join(timeout=0.1)
+        self.assertEqual(acquired, []) # Still waiting
+
+        pool.release(first)
+        t.join(timeout=5)
+        self.assertEqual(acquired, [first])
+
+class TestMicroBatcher(unittest.TestCase):
+
+    def test_concurrent_requests_share_one_batch(self):
+        engine = MagicMock()
+        engine.process_batch.side_effect = lambda reqs: [r.pose_keypoints.tobytes() for r in reqs]
+
+        async def run():
+            batcher = MicroBatcher(engine, max_batch_size=4, max_wait_ms=50)
+            kps = [np.full((18, 3), i, dtype=np.float32) for i in range(3)]
+            results = await asyncio.gather(*[batcher.submit(b"", b"", b"", k) for k in kps])
+            await batcher.stop()
+            return kps, results, batcher.stats.snapshot()
+
+        kps, results, stats = asyncio.run(run())
+
+        self.assertEqual(engine.process_batch.call_count, 1)
+        self.assertEqual(results, [k.tobytes() for k in kps])
+        self.assertEqual(stats["batches"], 1)
+        self.assertAlmostEqual(stats["avg_fill_ratio"], 0.75)
+
+    def test_full_batch_dispatches_without_waiting(self):
+        engine = MagicMock()
+        engine.process_batch.side_effect = lambda reqs: [b"ok"] * len(reqs)
+
+        async def run():
+            batcher = MicroBatcher(engine, max_batch_size=2, max_wait_ms=10_000)
+            kps = np.zeros((18, 3), dtype=np.float32)
+            results = await asyncio.wait_for(
+                asyncio.gather(*[batcher.submit(b"", b"", b"", kps) for _ in range(4)]), timeout=5
+            )
+            await batcher.stop()
+            return results
+
+        self.assertEqual(asyncio.run(run()), [b"ok"] * 4)
+        self.assertEqual(engine.process_batch.call_count, 2)
+
+class TestAsyncTryOnEngine(unittest.TestCase):
+
+    def test_plan_threads_does_not_oversubscribe(self):
+        for cores in (1, 2, 8, 32):
+            workers, intra = plan_threads(0, cores=cores)
+            self.assertGreaterEqual(workers, 1)
+            self.assertLessEqual(workers * intra, cores)
+        self.assertEqual(plan_threads(4, cores=16), (4, 4))
+
+    @patch('app.services.tryon_fast.async_engine.TryOnEngine')
+    def test_rejects_with_503_when_saturated(self, MockEngine):
+        import threading
+        release = threading.Event()
+        MockEngine.return_value.process.side_effect = lambda *args: release.wait(5) and b"png"
+
+        async def run():
+            engine = AsyncTryOnEngine("model.onnx", workers=1, max_pending=1, max_batch_size=1)
+            kps = np.zeros((18, 3), dtype=np.float32)
+            first = asyncio.create_task(engine.process_async(b"", b"", b"", kps))
+            await asyncio.sleep(0.05)
+            with self.assertRaises(ServiceException) as ctx:
+                await engine.process_async(b"", b"", b"", kps)
+            release.set()
+            result = await first
+            await engine.close()
+            return ctx.exception, result
+
+        exc, result = asyncio.run(run())
+        self.assertEqual(exc.status_code, 503)
+        self.assertEqual(result, b"png")
+
+    def test_ready_does_not_wait_for_a_missing_model(self):
+        from app import main
+        from app.services.health import HealthService
+        with patch.object(HealthService, "_readiness_checks", {}), \
+                patch.object(main.settings, "TRYON_WARMUP_ON_STARTUP", True), \
+                patch.object(main, "tryon_model_configured", return_value=False):
+            main.create_application()
+            readiness = asyncio.run(HealthService.get_readiness())
+        self.assertEqual(readiness.status, "ready")
+        self.assertNotIn("tryon_2d", readiness.checks)
+
+    def test_quality_is_validated_per_format(self):
+        from unittest.mock import AsyncMock
+        from app.routers.tryon import tryon_2d
+        engine = MagicMock(process_async=AsyncMock(return_value=b"img"))
+        upload = MagicMock(read=AsyncMock(return_value=b""))
+
+        def call(output_format, quality):
+            return asyncio.run(tryon_2d(upload, upload, upload, "[[0, 0]]", output_format, quality, engine))
+
+        for output_format, valid, invalid in [("png", (0, 9), (-1, 10)), ("jpeg", (1, 100), (0, 101)), ("webp", (1, 100), (0, 101))]:
+            for quality in valid:
+                self.assertEqual(call(output_format, quality).body, b"img")
+            for quality in invalid:
+                with self.assertRaises(ServiceException) as ctx:
+                    call(output_format, quality)
+                self.assertEqual(ctx.exception.status_code, 422)
+
+class TestEnginePool(unittest.TestCase):
+
+    def test_cpu_assignment_stays_within_numa_nodes(self):
+        self.assertEqual(parse_cpulist("0-3,8,10-11\n"), [0, 1, 2, 3, 8, 10, 11])
+        nodes = [[0, 1, 2, 3], [4, 5, 6, 7]]
+        cpus = assign_cpus(4, nodes)
+        self.assertEqual(cpus, [[0, 1], [4, 5], [2, 3], [6, 7]])
+
+    @patch('app.services.tryon_fast.pool.os.path.exists', return_value=True)
+    @patch.object(EnginePool, '_build_thread_members')
+    def test_startup_stats_follow_live_traffic(self, mock_build, _):
+        from app.services.tryon_fast.pool import _ThreadMember
+        members = []
+        for _ in range(2):
+            engine = MagicMock(ready=True)
+            histogram = LatencyHistogram(max_samples=10)
+            engine.process_batch.side_effect = lambda requests, h=histogram: [h.observe(5.0) and b"img" for _ in requests]
+            engine.startup_stats.side_effect = lambda h=histogram: {"cold_start_s": 1.0, "first_requests": h.snapshot()}
+            members.append(_ThreadMember(engine))
+        mock_build.return_value = members
+
+        pool = EnginePool("model.onnx", 2, threads_per_session=1)
+        pool.warmup()
+        self.assertEqual(pool.startup_stats()["first_requests"]["count"], 0)
+        pool.process_batch([MagicMock()] * 3)
+        pool.process_batch([MagicMock()])
+
+        stats = pool.startup_stats()
+        self.assertEqual(stats["first_requests"]["count"], 4)
+        self.assertEqual(stats["first_requests"]["avg_ms"], 5.0)
+        # Load time counted once, not again inside each member's cold start
+        self.assertAlmostEqual(stats["cold_start_s"], pool.load_time_s + pool.warmup_s)
+
+    @patch('app.services.tryon_fast.pool.TryOnEngine')
+    @patch('app.services.tryon_fast.pool.shared_initializers')
+    def test_onnx_sessions_share_initializers_without_holding_model_bytes(self, mock_initializers, mock_engine):
+        import tempfile
+        import onnxruntime as ort
+        mock_initializers.return_value = {"w": ort.OrtValue.ortvalue_from_numpy(np.zeros(4, dtype=np.float32))}
+        with tempfile.TemporaryDirectory() as root:
+            model_path = os.path.join(root, "model.onnx")
+            with open(model_path, "wb") as f:
+                f.write(b"\x08\x07" + b"\0" * 30) # ONNX protobuf, not ORT format
+            with self.assertLogs("app.services.tryon_fast.pool", level="WARNING") as logs:
+                EnginePool._build_thread_members(
+                    model_path, [[], []], 1, {"optimized_model_path": os.path.join(root, "model.opt.onnx")},
+                )
+
+        # Built from the path: ORT would otherwise keep a second copy of the weights per pool
+        self.assertEqual([c.kwargs["model_bytes"] for c in mock_engine.call_args_list], [None, None])
+        self.assertTrue(all("optimized_model_path" not in c.kwargs for c in mock_engine.call_args_list))
+        self.assertIn("optimized graph is not saved", logs.output[0])
+
+    @patch('app.services.tryon_fast.pool.os.path.exists', return_value=True)
+    @patch.object(EnginePool, '_build_thread_members')
+    def test_routes_to_least_loaded_session(self, mock_build, _):
+        import threading
+        release = threading.Event()
+        busy, idle = MagicMock(), MagicMock()
+        busy.process_batch.side_effect = lambda requests: release.wait(5) and [b"busy"]
+        idle.process_batch.return_value = [b"idle"]
+        mock_build.return_value = [busy, idle]
+
+        pool = EnginePool("model.onnx", 2, threads_per_session=1)
+        worker = threading.Thread(target=pool.process_batch, args=([MagicMock()],))
+        worker.start()
+        while pool.stats()[0]["in_flight"] == 0:
+            pass
+        # Session 0 is busy, so the next two batches go to session 1
+        self.assertEqual(pool.process_batch([MagicMock()]), [b"idle"])
+        self.assertEqual(pool.process_batch([MagicMock()]), [b"idle"])
+        release.set()
+        worker.join()
+
+        stats = pool.stats()
+        self.assertEqual([s["batches"] for s in stats], [1, 2])
+        self.assertTrue(all(0.0 <= s["utilization"] <= 1.0 for s in stats))
+
+class TestModelVariants(unittest.TestCase):
+
+    def test_variant_paths(self):
+        self.assertEqual(variant_model_path("./weights/tryon.onnx", "fp32"), "./weights/tryon.onnx")
+        self.assertEqual(variant_model_path("./weights/tryon.onnx", "int8_static"), "./weights/tryon.int8_static.onnx")
+        with self.assertRaises(ValueError):
+            variant_model_path("./weights/tryon.onnx", "int4")
+
+    def test_calibration_reader_yields_model_inputs(self):
+        import cv2
+        import json
+        import tempfile
+        from app.services.tryon_fast.quantization import TryOnCalibrationReader
+
+        with tempfile.TemporaryDirectory() as samples_dir:
+            for name in ("a", "b"):
+                sample = os.path.join(samples_dir, name)
+                os.makedirs(sample)
+                cv2.imwrite(os.path.join(sample, "person_mask.png"), np.full((64, 48), 255, dtype=np.uint8))
+                cv2.imwrite(os.path.join(sample, "garment_mask.png"), np.zeros((64, 48), dtype=np.uint8))
+                cv2.imwrite(os.path.join(sample, "garment_texture.png"), np.zeros((64, 48, 3), dtype=np.uint8))
+                with open(os.path.join(sample, "pose_keypoints.json"), "w") as f:
+                    json.dump([[10.0, 20.0, 1.0]] * 18, f)
+            os.makedirs(os.path.join(samples_dir, "incomplete"))
+
+            reader = TryOnCalibrationReader(samples_dir)
+            first = reader.get_next()
+            self.assertIsNotNone(reader.get_next())
+            self.assertIsNone(reader.get_next())
+            reader.rewind()
+            self.assertIsNotNone(reader.get_next())
+
+        self.assertEqual(first["pose_heatmap"].shape, (1, 18, 256, 192))
+        self.assertEqual(first["garment_texture"].dtype, np.float32)
+        self.assertEqual(first["person_mask"].max(), 1.0)
+        self.assertEqual(first["garment_texture"].min(), -1.0)
+
+class TestResultCache(unittest.TestCase):
+
+    def test_key_depends_on_inputs_and_model(self):
+        kps = np.zeros((18, 3), dtype=np.float32)
+        base = result_cache_key("model-a", b"mask", b"mask", b"tex", kps)
+
+        self.assertEqual(base, result_cache_key("model-a", b"mask", b"mask", b"tex", kps.copy()))
+        self.assertNotEqual(base, result_cache_key("model-b", b"mask", b"mask", b"tex", kps))
+        self.assertNotEqual(base, result_cache_key("model-a", b"mask", b"mask", b"tex2", kps))
+        self.assertNotEqual(base, result_cache_key("model-a", b"mask", b"mask", b"tex", kps.reshape(-1)))
+
+    def test_lru_evicts_by_size(self):
+        lru = MemoryLRUCache(max_bytes=10)
+        lru.set("a", b"1234")
+        lru.set("b", b"1234")
+        lru.get("a") # a is now most recent
+        lru.set("c", b"1234")
+
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(lru.get("a"), b"1234")
+        self.assertEqual(lru.evictions, 1)
+        self.assertLessEqual(lru.current_bytes, 10)
+
+    def test_disk_store_evicts_least_recently_used(self):
+        import tempfile
+        import time
+        with tempfile.TemporaryDirectory() as root:
+            async def run():
+                store = DiskResultStore(root, max_bytes=250, low_water=0.8)
+                for key in ("aa1", "bb2"):
+                    await store.set(key, b"x" * 100)
+                    time.sleep(0.01) # Distinct mtimes
+                await store.get("aa1") # bb2 is now least recently used
+                time.sleep(0.01)
+                await store.set("cc3", b"x" * 100)
+                return store, [await store.get(k) is not None for k in ("aa1", "bb2", "cc3")]
+
+            store, present = asyncio.run(run())
+            self.assertEqual(present, [True, False, True])
+            self.assertEqual((store.evictions, store.current_bytes), (1, 200))
+            # A reopened store picks up the current size
+            self.assertEqual(DiskResultStore(root, max_bytes=250).current_bytes, 200)
+
+    def test_disk_store_overwrite_counts_only_the_difference(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as root:
+            async def run():
+                cache = ResultCache(MemoryLRUCache(1024), DiskResultStore(root, max_bytes=250))
+                for size in (100, 100, 120):
+                    await cache.set("aa1", b"x" * size)
+                return cache.snapshot()
+
+            snapshot = asyncio.run(run())
+            self.assertEqual((snapshot["disk_bytes"], snapshot["disk_evictions"]), (120, 0))
+
+    def test_backend_hit_is_promoted_to_memory(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as root:
+            async def run():
+                writer = ResultCache(MemoryLRUCache(1024), DiskResultStore(root))
+                await writer.set("key", b"png")
+
+                reader = ResultCache(MemoryLRUCache(1024), DiskResultStore(root))
+                first = await reader.get("key")
+                second = await reader.get("key")
+                missing = await reader.get("other")
+                return first, second, missing, reader.snapshot()
+
+            first, second, missing, stats = asyncio.run(run())
+
+        self.assertEqual((first, second, missing), (b"png", b"png", None))
+        self.assertEqual((stats["backend_hits"], stats["memory_hits"], stats["misses"]), (1, 1, 1))
+
 if __name__ == '__main__':
     unittest.main()
 